@@ -1,8 +1,17 @@
 """API Views for the sequencers app."""
 
+from django.db.models import OuterRef
 from rest_framework.generics import ListCreateAPIView, RetrieveAPIView, RetrieveUpdateDestroyAPIView
-
-from digestiflow.utils import ProjectMixin, SodarObjectInProjectPermissions
+from projectroles.models import Project
+
+from digestiflow.utils import (
+    ConditionalGetMixin,
+    ProjectMixin,
+    SodarObjectInProjectPermissions,
+    StreamingListMixin,
+    last_modified,
+    object_count,
+)
 from ..models import BarcodeSet, BarcodeSetEntry
 from .serializers import BarcodeSetSerializer, BarcodeSetEntrySerializer
 
@@ -16,23 +25,54 @@ class BarcodeSetViewMixin(ProjectMixin):
         return result
 
     def get_queryset(self):
-        return BarcodeSet.objects.filter(project=self.get_project())
+        return BarcodeSet.objects.filter(project=self.get_project()).prefetch_related("entries")
 
 
-class BarcodeSetCreateApiView(BarcodeSetViewMixin, ListCreateAPIView):
+class BarcodeSetCreateApiView(
+    ConditionalGetMixin, StreamingListMixin, BarcodeSetViewMixin, ListCreateAPIView
+):
     permission_classes = (SodarObjectInProjectPermissions,)
     serializer_class = BarcodeSetSerializer
 
+    def get_modification_stamps(self):
+        """Return the latest modification and number of the barcode sets and their entries."""
+        barcode_sets = BarcodeSet.objects.filter(project=OuterRef("pk"))
+        entries = BarcodeSetEntry.objects.filter(barcode_set__project=OuterRef("pk"))
+        return (
+            Project.objects.filter(pk=self.get_project().pk)
+            .order_by()
+            .values_list(
+                last_modified(barcode_sets),
+                object_count(barcode_sets),
+                last_modified(entries),
+                object_count(entries),
+            )
+            .first()
+        )
+
     def perform_create(self, serializer):
         serializer.save(project=self.get_project())
 
 
-class BarcodeSetUpdateDestroyApiView(BarcodeSetViewMixin, RetrieveUpdateDestroyAPIView):
+class BarcodeSetUpdateDestroyApiView(
+    ConditionalGetMixin, BarcodeSetViewMixin, RetrieveUpdateDestroyAPIView
+):
     permission_classes = (SodarObjectInProjectPermissions,)
     serializer_class = BarcodeSetSerializer
     lookup_url_kwarg = "barcodeset"
     lookup_field = "sodar_uuid"
 
+    def get_modification_stamps(self):
+        """Return the latest modification of the barcode set and the latest modification and number of
+        its entries."""
+        entries = BarcodeSetEntry.objects.filter(barcode_set=OuterRef("pk"))
+        return (
+            self.get_queryset()
+            .filter(sodar_uuid=self.kwargs["barcodeset"])
+            .values_list("date_modified", last_modified(entries), object_count(entries))
+            .first()
+        )
+
 
 class BarcodeSetEntryApiViewMixin(ProjectMixin):
     """Common functionality for BarcodeSetEntry API views."""
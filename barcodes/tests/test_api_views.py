@@ -22,6 +22,30 @@ class BarcodeSetListCreateApiViewTest(
         data = json.loads(response.content.decode("utf-8"))
         self.assertEqual(len(data), 1)
 
+    def testGetNotModified(self):
+        """Test that a request with the current ETag is answered with 304"""
+        response = self.runGet(self.root)
+        self.response_200(response)
+        self.assertNotIn("Last-Modified", response)
+        response = self.runGet(self.root, extra={"HTTP_IF_NONE_MATCH": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def testGetModified(self):
+        """Test that the ETag changes with the barcode sets and the deletion of entries"""
+        etags = [self.runGet(self.root)["ETag"]]
+        self.barcode_set.entries.create(name="Second entry", sequence="CCCCCCCC")
+        etags.append(self.runGet(self.root)["ETag"])
+        self.barcode_set_entry.delete()
+        etags.append(self.runGet(self.root)["ETag"])
+        self.assertEqual(len(set(etags)), 3)
+
+    def testGetStream(self):
+        """Test that the streamed list is the regular list"""
+        expected = self.runGet(self.root).content
+        response = self.runGet(self.root, data={"stream": "1"})
+        self.response_200(response)
+        self.assertEqual(b"".join(response.streaming_content), expected)
+
     def testGetAccessDenied(self):
         """Test that access is denied if role assignment is missing"""
         self.runGet(None)
@@ -77,6 +101,32 @@ class BarcodeSetUpdateApiViewTest(
         data = json.loads(response.content.decode("utf-8"))
         self.assertEqual(data["sodar_uuid"], str(self.barcode_set.sodar_uuid))
 
+    def testGetNotModified(self):
+        """Test that a request with the current ETag is answered with 304"""
+        response = self.runGet(self.root, barcodeset=self.barcode_set.sodar_uuid)
+        self.response_200(response)
+        self.assertNotIn("Last-Modified", response)
+        response = self.runGet(
+            self.root,
+            barcodeset=self.barcode_set.sodar_uuid,
+            extra={"HTTP_IF_NONE_MATCH": response["ETag"]},
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def testGetModified(self):
+        """Test that the ETag changes with the barcode set and the deletion of entries"""
+
+        def get_etag():
+            return self.runGet(self.root, barcodeset=self.barcode_set.sodar_uuid)["ETag"]
+
+        etags = [get_etag()]
+        self.barcode_set.description = "changed"
+        self.barcode_set.save()
+        etags.append(get_etag())
+        self.barcode_set_entry.delete()
+        etags.append(get_etag())
+        self.assertEqual(len(set(etags)), 3)
+
     def testGetAccessDenied(self):
         """Test that access is denied if role assignment is missing"""
         self.runGet(None, barcodeset=self.barcode_set.sodar_uuid)
@@ -303,9 +303,17 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.BasicAuthentication",
         "rest_framework.authentication.SessionAuthentication",
         "knox.auth.TokenAuthentication",
-    )
+    ),
+    "DEFAULT_THROTTLE_CLASSES": ("digestiflow.throttling.CostWeightedThrottle",),
 }
 
+# Rate limiting of the API, see ``digestiflow.throttling``.  Each API token or user (IP address for anonymous
+# requests) may spend ``API_THROTTLE_RATE`` cost units per ``API_THROTTLE_PERIOD`` seconds, 0 disables the
+# limit.  Listing objects costs ``API_THROTTLE_LIST_COST`` units, other requests one unit.
+API_THROTTLE_RATE = env.int("API_THROTTLE_RATE", 1200)
+API_THROTTLE_PERIOD = env.int("API_THROTTLE_PERIOD", 60)
+API_THROTTLE_COSTS = {"list": env.int("API_THROTTLE_LIST_COST", 20), "detail": 1}
+
 # Knox settings
 TOKEN_TTL = None
 
@@ -505,3 +513,37 @@ FILEBOXES_BASE_URL = env.str("FILEBOXES_BASE_URL", None)
 
 if FILEBOXES_ENABLED:
     INSTALLED_APPS += ["fileboxes.apps.FileboxesConfig"]
+
+# Configuration for "flowcells"
+# ------------------------------------------------------------------------------
+
+# Quiet period (in seconds) before updating the error caches of a flow cell.  Update requests arriving in
+# this period are coalesced into the pending update.
+FLOWCELLS_ERROR_CACHE_UPDATE_DELAY = env.int("FLOWCELLS_ERROR_CACHE_UPDATE_DELAY", 10)
+
+# Store index histograms in the compact binary format (see ``flowcells.histogram_codec``) instead of JSON.
+FLOWCELLS_HISTOGRAM_PACKED = env.bool("FLOWCELLS_HISTOGRAM_PACKED", True)
+
+# Number of most frequent sequences to keep when storing index histograms.  Less frequent sequences below the
+# minimal index fraction are aggregated into a count of "other" sequences.  Set to 0 to store as posted.
+FLOWCELLS_INDEX_HISTOGRAM_TOP_K = env.int("FLOWCELLS_INDEX_HISTOGRAM_TOP_K", 1000)
+
+# Number of days that tombstones of deleted objects are kept for the "changes" API.  Clients with older
+# tokens have to do a full synchronization.
+FLOWCELLS_TOMBSTONE_RETENTION_DAYS = env.int("FLOWCELLS_TOMBSTONE_RETENTION_DAYS", 30)
+
+# Overlap (in seconds) of consecutive "changes" API responses, must be longer than the longest transaction
+# writing flow cells such that no change is missed.  Changes in the overlap are returned again.
+FLOWCELLS_CHANGES_OVERLAP = env.int("FLOWCELLS_CHANGES_OVERLAP", 60)
+
+# Time (in seconds) to keep rendered rows of the flow cell lists in the cache.  Rows are invalidated on
+# changes of the flow cell or its objects, so this only limits the memory use.
+FLOWCELLS_ROW_CACHE_TIMEOUT = env.int("FLOWCELLS_ROW_CACHE_TIMEOUT", 24 * 60 * 60)
+
+# Time (in seconds) to keep generated sample sheets in the cache.  The sheets are cached under the
+# modification dates of the flow cell and its libraries, so this only limits the memory use.
+FLOWCELLS_SAMPLE_SHEET_CACHE_TIMEOUT = env.int("FLOWCELLS_SAMPLE_SHEET_CACHE_TIMEOUT", 24 * 60 * 60)
+
+# Time (in seconds) to keep the rendered sample sheet and index statistics tabs of the flow cell detail page
+# in the cache.  Tabs are invalidated on changes of the flow cell or its objects.
+FLOWCELLS_TAB_CACHE_TIMEOUT = env.int("FLOWCELLS_TAB_CACHE_TIMEOUT", 24 * 60 * 60)
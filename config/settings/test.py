@@ -58,6 +58,11 @@ TEMPLATES[0]["OPTIONS"]["loaders"] = [
 # ------------------------------------------------------------------------------
 CELERY_TASK_ALWAYS_EAGER = True
 
+# API throttling
+# ------------------------------------------------------------------------------
+# The cache is not cleared between tests, enabled in the throttling tests.
+API_THROTTLE_RATE = 0
+
 # Logging
 # ------------------------------------------------------------------------------
 
@@ -6,10 +6,13 @@ from django.conf.urls import url
 from sequencers.api import views as sequencer_views
 from barcodes.api import views as barcode_views
 from flowcells.api import views as flowcell_views
+from .api_views import ApiMetricsView
 
 app_name = "api"
 
 urlpatterns = [
+    # /metrics/
+    url(regex=r"^metrics/$", view=ApiMetricsView.as_view(), name="metrics"),
     #
     # App "sequencers"
     #
@@ -85,18 +88,42 @@ urlpatterns = [
         view=flowcell_views.FlowCellResolveApiView.as_view({"get": "resolve"}),
         name="flowcells-resolve",
     ),
+    # /flowcells/changes/:project/
+    url(
+        regex=r"^flowcells/changes/(?P<project>[0-9a-f-]+)/$",
+        view=flowcell_views.FlowCellChangesApiView.as_view(),
+        name="flowcells-changes",
+    ),
+    # /flowcells/samplesheet/:project/:flowcell/:format/
+    url(
+        regex=r"^flowcells/samplesheet/(?P<project>[0-9a-f-]+)/(?P<flowcell>[0-9a-f-]+)/(?P<sheet_format>[a-z0-9-]+)/$",
+        view=flowcell_views.FlowCellSampleSheetApiView.as_view(),
+        name="flowcells-samplesheet",
+    ),
     # /indexhistos/:project/:flowcell/
     url(
         regex=r"^indexhistos/(?P<project>[0-9a-f-]+)/(?P<flowcell>[0-9a-f-]+)/$",
         view=flowcell_views.LaneIndexHistogramListCreateApiView.as_view(),
         name="indexhistos",
     ),
+    # /indexhistos/batch/:project/:flowcell/
+    url(
+        regex=r"^indexhistos/batch/(?P<project>[0-9a-f-]+)/(?P<flowcell>[0-9a-f-]+)/$",
+        view=flowcell_views.LaneIndexHistogramBatchApiView.as_view(),
+        name="indexhistos-batch",
+    ),
     # /indexhistos/:project/:flowcell/:indexhistogram/
     url(
         regex=r"^indexhistos/(?P<project>[0-9a-f-]+)/(?P<flowcell>[0-9a-f-]+)/(?P<indexhistogram>[0-9a-f-]+)/$",
         view=flowcell_views.LaneIndexHistogramUpdateDestroyApiView.as_view(),
         name="indexhistos",
     ),
+    # /libraries/:project/:flowcell/
+    url(
+        regex=r"^libraries/(?P<project>[0-9a-f-]+)/(?P<flowcell>[0-9a-f-]+)/$",
+        view=flowcell_views.LibraryListUpsertApiView.as_view(),
+        name="libraries",
+    ),
     # /messages/:project/:flowcell/
     url(
         regex=r"^messages/(?P<project>[0-9a-f-]+)/(?P<flowcell>[0-9a-f-]+)/$",
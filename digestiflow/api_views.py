@@ -0,0 +1,36 @@
+"""API views of the site, not belonging to an app."""
+
+from django.http import HttpResponse
+from rest_framework.permissions import BasePermission
+from rest_framework.views import APIView
+
+from .throttling import METRICS, get_metrics
+
+
+class IsSuperuser(BasePermission):
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_superuser)
+
+
+class ApiMetricsView(APIView):
+    """Export the API metrics counted by ``CostWeightedThrottle`` in the Prometheus text format.
+
+    Only available to superusers, the metrics themselves are not throttled.
+    """
+
+    permission_classes = (IsSuperuser,)
+    throttle_classes = ()
+
+    def get(self, request, *args, **kwargs):
+        values = get_metrics()
+        lines = []
+        for name, type_, help_text in METRICS:
+            metric = "digestiflow_api_%s_total" % name
+            lines.append("# HELP %s %s" % (metric, help_text))
+            lines.append("# TYPE %s %s" % (metric, type_))
+            for value_name, kind, value in values:
+                if value_name == name:
+                    lines.append('%s{kind="%s"} %d' % (metric, kind, value))
+        return HttpResponse(
+            "\n".join(lines) + "\n", content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
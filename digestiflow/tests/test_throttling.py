@@ -0,0 +1,99 @@
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import override_settings
+from knox.models import AuthToken
+from test_plus.test import APITestCase
+
+from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
+from sequencers.tests import SetupSequencingMachineMixin
+
+
+@override_settings(API_THROTTLE_RATE=4, API_THROTTLE_COSTS={"list": 2, "detail": 1})
+class CostWeightedThrottleTest(
+    SetupSequencingMachineMixin, SetupProjectMixin, SetupUserMixin, APITestCase
+):
+    """Tests for the cost-weighted rate limiting of the API"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        # Stay in one time window.
+        patcher = mock.patch("digestiflow.throttling.time.time", return_value=1_000_000_000.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.list_url = self.reverse("api:sequencers", project=self.project.sodar_uuid)
+        self.detail_url = self.reverse(
+            "api:sequencers", project=self.project.sodar_uuid, sequencer=self.hiseq2000.sodar_uuid
+        )
+
+    def getStatuses(self, urls, **extra):
+        return [self.client.get(url, **extra).status_code for url in urls]
+
+    def testListCostsMore(self):
+        """Test that the quota is spent faster by lists than by details"""
+        with self.login(self.root):
+            self.assertEqual(self.getStatuses([self.list_url] * 3), [200, 200, 429])
+            cache.clear()
+            self.assertEqual(self.getStatuses([self.detail_url] * 5), [200, 200, 200, 200, 429])
+
+    def testRetryAfter(self):
+        """Test that throttled responses tell when to retry"""
+        with self.login(self.root):
+            self.getStatuses([self.list_url] * 2)
+            response = self.client.get(self.detail_url)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "20")
+
+    def testPerUser(self):
+        """Test that the quota is per user"""
+        with self.login(self.root):
+            self.assertEqual(self.getStatuses([self.list_url] * 3), [200, 200, 429])
+        with self.login(self.owner):
+            self.assertEqual(self.getStatuses([self.list_url]), [200])
+
+    def testPerToken(self):
+        """Test that the quota is per API token"""
+        tokens = [AuthToken.objects.create(self.owner)[1] for _ in range(2)]
+        for token in tokens:
+            self.assertEqual(
+                self.getStatuses([self.list_url] * 3, HTTP_AUTHORIZATION="Token %s" % token),
+                [200, 200, 429],
+            )
+
+    @override_settings(API_THROTTLE_RATE=0)
+    def testDisabled(self):
+        """Test that throttling is disabled with a rate of 0"""
+        with self.login(self.root):
+            self.assertEqual(self.getStatuses([self.list_url] * 3), [200, 200, 200])
+
+    def testCacheUnavailable(self):
+        """Test that requests are neither throttled nor counted if the cache is unavailable"""
+        with self.login(self.root), mock.patch.object(cache, "incr", return_value=None):
+            self.assertEqual(self.getStatuses([self.list_url] * 3), [200, 200, 200])
+        self.assertIsNone(cache.get("api-throttle-metrics:requests:list"))
+
+    def testMetrics(self):
+        """Test that requests, cost, and throttled requests are exported as metrics"""
+        with self.login(self.root):
+            self.getStatuses([self.list_url] * 3 + [self.detail_url])
+            response = self.client.get(self.reverse("api:metrics"))
+        self.response_200(response)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        lines = response.content.decode("utf-8").splitlines()
+        self.assertIn("# TYPE digestiflow_api_requests_total counter", lines)
+        for line in (
+            'digestiflow_api_requests_total{kind="list"} 3',
+            'digestiflow_api_requests_total{kind="detail"} 1',
+            'digestiflow_api_cost_total{kind="list"} 4',
+            'digestiflow_api_cost_total{kind="detail"} 0',
+            'digestiflow_api_throttled_total{kind="list"} 1',
+            'digestiflow_api_throttled_total{kind="detail"} 1',
+        ):
+            self.assertIn(line, lines)
+
+    def testMetricsAccessDenied(self):
+        """Test that the metrics are only available to superusers"""
+        self.assertEqual(self.getStatuses([self.reverse("api:metrics")]), [401])
+        with self.login(self.owner):
+            self.assertEqual(self.getStatuses([self.reverse("api:metrics")]), [403])
@@ -0,0 +1,129 @@
+"""Cost-weighted rate limiting of the REST API.
+
+Each client (identified by API token, user, or IP address for anonymous requests) may spend
+``settings.API_THROTTLE_RATE`` cost units per ``settings.API_THROTTLE_PERIOD`` seconds.  Requests cost the
+units of their kind in ``settings.API_THROTTLE_COSTS``, listing objects is more expensive than handling a
+single one.  The units spent are counted per client and fixed time window in the default cache, which is
+shared by the workers in production (Redis).  The number of requests, units spent, and throttled requests
+are counted in the cache as well and exported by ``api_views.ApiMetricsView``.  If the cache is unavailable
+(the ``IGNORE_EXCEPTIONS`` option of django-redis in production), requests are not throttled nor counted.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.mixins import ListModelMixin
+from rest_framework.throttling import BaseThrottle
+
+#: Request kind for listing objects.
+KIND_LIST = "list"
+
+#: Request kind for handling single objects.
+KIND_DETAIL = "detail"
+
+#: Prefix of the cache keys of the units spent by the clients.
+CACHE_PREFIX = "api-throttle"
+
+#: Prefix of the cache keys of the metrics.
+METRICS_CACHE_PREFIX = "api-throttle-metrics"
+
+#: Timeout of the metrics in the cache.  ``None`` means the counters never expire, as defined by the Django
+#: cache API for all backends (Redis, local memory).
+METRICS_TIMEOUT = None
+
+#: Exported metrics, name, type, and help text.
+METRICS = (
+    ("requests", "counter", "Number of API requests"),
+    ("cost", "counter", "Cost units spent by API requests"),
+    ("throttled", "counter", "Number of API requests rejected by rate limiting"),
+)
+
+
+def _increment(key, delta, timeout):
+    """Atomically increment the counter ``key`` in the cache by ``delta`` and return the new value.
+
+    Returns ``None`` if the cache is unavailable.
+    """
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key, delta)
+    except ValueError:  # expired in the meantime
+        if cache.add(key, delta, timeout) is None:
+            return None
+        return delta
+
+
+def get_request_kind(request, view):
+    """Return the kind of ``request`` to ``view``, ``KIND_LIST`` or ``KIND_DETAIL``.
+
+    Views can set ``throttle_kind``, otherwise safe requests to list views or the "list" action of view sets
+    are ``KIND_LIST``.
+    """
+    kind = getattr(view, "throttle_kind", None)
+    if kind is not None:
+        return kind
+    if request.method not in ("GET", "HEAD"):
+        return KIND_DETAIL
+    action = getattr(view, "action", None)
+    if action is not None:
+        is_list = action == "list"
+    else:
+        is_list = isinstance(view, ListModelMixin)
+    return KIND_LIST if is_list else KIND_DETAIL
+
+
+def count_metric(name, kind, value=1):
+    """Increment the metric ``name`` of requests of ``kind`` by ``value``."""
+    _increment("%s:%s:%s" % (METRICS_CACHE_PREFIX, name, kind), value, METRICS_TIMEOUT)
+
+
+def get_metrics():
+    """Return list of the triples of metric name, request kind, and value."""
+    keys = {
+        (name, kind): "%s:%s:%s" % (METRICS_CACHE_PREFIX, name, kind)
+        for name, _, _ in METRICS
+        for kind in sorted(settings.API_THROTTLE_COSTS)
+    }
+    values = cache.get_many(keys.values())
+    return [(name, kind, values.get(key, 0)) for (name, kind), key in keys.items()]
+
+
+class CostWeightedThrottle(BaseThrottle):
+    """Limit the cost units spent per client in fixed time windows, see module documentation.
+
+    Throttling is disabled if ``settings.API_THROTTLE_RATE`` is 0.
+    """
+
+    def get_ident(self, request):
+        token_key = getattr(request.auth, "token_key", None)
+        if token_key:
+            return "token:%s" % token_key
+        if request.user and request.user.is_authenticated:
+            return "user:%s" % request.user.pk
+        return "ip:%s" % super().get_ident(request)
+
+    def allow_request(self, request, view):
+        rate = settings.API_THROTTLE_RATE
+        if not rate:
+            return True
+        period = settings.API_THROTTLE_PERIOD
+        kind = get_request_kind(request, view)
+        cost = settings.API_THROTTLE_COSTS[kind]
+        now = time.time()
+        window = int(now // period)
+        self.wait_seconds = (window + 1) * period - now
+        spent = _increment(
+            "%s:%s:%d" % (CACHE_PREFIX, self.get_ident(request), window), cost, period
+        )
+        if spent is None:  # cache unavailable, fail open
+            return True
+        count_metric("requests", kind)
+        if spent > rate:
+            count_metric("throttled", kind)
+            return False
+        count_metric("cost", kind, cost)
+        return True
+
+    def wait(self):
+        return self.wait_seconds
@@ -1,11 +1,21 @@
 """Share utility code."""
 
+import calendar
+import datetime
+import hashlib
 import json
 
 from crispy_forms.helper import FormHelper
 from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import CharField, F, Func, Subquery
 from django.forms.models import model_to_dict as _model_to_dict
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework.permissions import DjangoModelPermissions
+from rest_framework.renderers import JSONRenderer
 from projectroles.models import Project
 from projectroles.views import ProjectPermissionMixin as _ProjectPermissionMixin
 
@@ -52,7 +62,8 @@ def humanize_dict(value):
 class ProjectMixin:
     """Mixin for DRF views.
 
-    Makes the project available in an API view through ``get_project()``.
+    Makes the project available in an API view through ``get_project()``.  The project is looked up once
+    per request and shared by the permission checks, querysets, and serializer contexts.
     """
 
     #: The ``Project`` model to use.
@@ -60,7 +71,120 @@ class ProjectMixin:
 
     def get_project(self):
         """Return the project object."""
-        return self.project_class.objects.get(sodar_uuid=self.kwargs["project"])
+        if "_project" not in self.__dict__:
+            self._project = self.project_class.objects.get(sodar_uuid=self.kwargs["project"])
+        return self._project
+
+
+def last_modified(queryset, date_field="date_modified"):
+    """Return expression with the latest ``date_field`` of the objects in ``queryset``, ``NULL`` if empty.
+
+    For annotating objects with the last modification of their children, ``queryset`` refers to the
+    annotated objects with ``OuterRef``.
+    """
+    return Subquery(
+        queryset.order_by().annotate(value=Func(F(date_field), function="MAX")).values("value")
+    )
+
+
+def distinct_values(queryset, field):
+    """Return expression with the sorted array of the distinct values of ``field`` of the objects in
+    ``queryset``, see ``last_modified()``.
+
+    For related objects without modification date, e.g., the names of users, as modification stamps.
+    """
+    return Subquery(
+        queryset.order_by()
+        .annotate(
+            value=Func(
+                F(field),
+                template="ARRAY_AGG(DISTINCT %(expressions)s ORDER BY %(expressions)s)",
+                output_field=ArrayField(CharField()),
+            )
+        )
+        .values("value")
+    )
+
+
+def object_count(queryset):
+    """Return expression with the number of objects in ``queryset``, see ``last_modified()``."""
+    return Subquery(
+        queryset.order_by().annotate(value=Func(F("pk"), function="COUNT")).values("value")
+    )
+
+
+class ConditionalGetMixin:
+    """Mixin for DRF views answering conditional ``GET`` requests before any serialization happens.
+
+    Views implement ``get_modification_stamps()`` that returns a tuple of values changing with the response,
+    e.g., dates of last modification and object counts, usually computed in one query, or ``None`` if there
+    is no object.  The strong ``ETag`` is derived from these, the URL, and the format.  With
+    ``last_modified_stamps``, the ``Last-Modified`` header is the latest ``datetime`` of the stamps, only
+    use this if deletions are reflected by the stamps.
+    """
+
+    #: Whether to send ``Last-Modified`` and answer ``If-Modified-Since``.
+    last_modified_stamps = False
+
+    def get(self, request, *args, **kwargs):
+        stamps = self.get_modification_stamps()
+        if stamps is None:
+            return super().get(request, *args, **kwargs)
+        key = repr((request.get_full_path(), request.accepted_renderer.format, tuple(stamps)))
+        etag = '"%s"' % hashlib.sha1(key.encode("utf-8")).hexdigest()
+        modified = None
+        dates = [value for value in stamps if isinstance(value, datetime.datetime)]
+        # Changes in the same second as the latest one would be invisible in ``Last-Modified``.
+        if (
+            self.last_modified_stamps
+            and dates
+            and max(dates) < timezone.now() - datetime.timedelta(seconds=1)
+        ):
+            modified = calendar.timegm(max(dates).utctimetuple())
+        response = get_conditional_response(request, etag=etag, last_modified=modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        response["ETag"] = etag
+        if modified is not None:
+            response["Last-Modified"] = http_date(modified)
+        return response
+
+
+class StreamingListMixin:
+    """Mixin for DRF list views that stream the list as JSON array if the ``stream`` query parameter is set.
+
+    The primary keys of the filtered queryset are loaded first, then the objects are loaded and serialized in
+    chunks of ``stream_chunk_size``, each with its own prefetching, keeping the order of the queryset.  Thus,
+    the memory use does not depend on the size of the list.  Streamed lists are not paginated.
+    """
+
+    #: Number of objects to load and serialize at once.
+    stream_chunk_size = 100
+
+    def iter_chunks(self, queryset):
+        """Yield the objects of ``queryset`` in lists of at most ``stream_chunk_size``."""
+        pks = list(queryset.values_list("pk", flat=True))
+        for start in range(0, len(pks), self.stream_chunk_size):
+            chunk_pks = pks[start : start + self.stream_chunk_size]
+            by_pk = {obj.pk: obj for obj in queryset.filter(pk__in=chunk_pks)}
+            # Skip objects deleted in the meantime.
+            yield [by_pk[pk] for pk in chunk_pks if pk in by_pk]
+
+    def stream_list(self, queryset):
+        """Yield the JSON array of the serialized objects of ``queryset`` piece by piece."""
+        renderer = JSONRenderer()
+        separator = b"["
+        for chunk in self.iter_chunks(queryset):
+            for item in self.get_serializer(chunk, many=True).data:
+                yield separator + renderer.render(item)
+                separator = b","
+        yield b"[]" if separator == b"[" else b"]"
+
+    def list(self, request, *args, **kwargs):
+        if not request.query_params.get("stream"):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(self.stream_list(queryset), content_type="application/json")
 
 
 def revcomp(s):
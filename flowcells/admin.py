@@ -7,6 +7,7 @@ from .models import (
     LaneIndexHistogram,
     Message,
     KnownIndexContamination,
+    Tombstone,
 )
 
 # Register your models here.
@@ -16,3 +17,4 @@ admin.site.register(Library)
 admin.site.register(LaneIndexHistogram)
 admin.site.register(Message)
 admin.site.register(KnownIndexContamination)
+admin.site.register(Tombstone)
@@ -0,0 +1,166 @@
+"""Vectorized analysis of index histograms with NumPy.
+
+The histograms of a flow cell are loaded into a ``HistogramTable`` with one array per column (sequence,
+count, sample size, lane, and index read).  Sequences are compared after 2-bit encoding them into
+``uint64`` codes.  Sets of sequences such as the sample sheet barcodes or the known contaminations are
+represented by ``SeqSet`` objects that keep sorted code arrays per sequence length.  Thus, membership and
+prefix matching of all encoded sequences of one length takes one ``numpy.isin()`` call per length present
+in the set.
+
+Only sequences consisting of ``ACGT`` with at most ``MAX_ENCODED_LENGTH`` characters can be encoded, the
+caller has to handle the others.
+"""
+
+import re
+
+import numpy as np
+
+#: Maximal length of sequences that can be encoded into a ``uint64``.
+MAX_ENCODED_LENGTH = 32
+
+#: Byte value to 2-bit code of the base, 4 for all values that are no base.
+_DIGITS = np.full(256, 4, dtype=np.uint8)
+_DIGITS[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+
+#: Leading ``ACGT`` characters of a sequence.
+_RE_BASES = re.compile(r"[ACGT]*")
+
+
+def encode_seqs(seqs, length):
+    """Encode ``seqs`` that all have the given ``length`` (between 1 and ``MAX_ENCODED_LENGTH``).
+
+    Return pair of ``uint64`` array with the codes and boolean array with whether the sequence could be
+    encoded.
+    """
+    # Each non-ASCII character becomes one "?", so all sequences keep their length.
+    raw = "".join(seqs).encode("ascii", "replace")
+    digits = _DIGITS[np.frombuffer(raw, dtype=np.uint8)].reshape(len(seqs), length)
+    codes = np.zeros(len(seqs), dtype=np.uint64)
+    for column in digits.T:
+        codes = (codes << np.uint64(2)) | (column & 3).astype(np.uint64)
+    return codes, (digits < 4).all(axis=1)
+
+
+def _shift(length):
+    return np.uint64(2 * length)
+
+
+class SeqSet:
+    """Set of sequences for vectorized lookup of encoded query sequences.
+
+    Answers whether queries are contained in the set and whether they are a prefix of a sequence in the set
+    or vice versa (the semantics of ``seq_index.PrefixIndex``).
+    """
+
+    def __init__(self, seqs=()):
+        seqs = set(seqs)
+        #: Whether the empty sequence is in the set, it is a prefix of all queries.
+        self.has_empty = "" in seqs
+        #: Sorted codes of the encodable sequences, by length.
+        self._codes = {}
+        #: Sorted codes of the encodable prefixes of all sequences, by length.
+        self._prefixes = {}
+        by_length = {}
+        by_prefix_length = {}
+        for seq in seqs:
+            if 0 < len(seq) <= MAX_ENCODED_LENGTH:
+                by_length.setdefault(len(seq), []).append(seq)
+            prefix = seq[: min(_RE_BASES.match(seq).end(), MAX_ENCODED_LENGTH)]
+            if prefix:
+                by_prefix_length.setdefault(len(prefix), []).append(prefix)
+        for length, group in by_length.items():
+            codes, valid = encode_seqs(group, length)
+            if valid.any():
+                self._codes[length] = np.unique(codes[valid])
+        prefixes = {}
+        for length, group in by_prefix_length.items():
+            codes, _ = encode_seqs(group, length)
+            for prefix_length in range(1, length + 1):
+                prefixes.setdefault(prefix_length, []).append(
+                    codes >> _shift(length - prefix_length)
+                )
+        self._prefixes = {
+            length: np.unique(np.concatenate(arrays)) for length, arrays in prefixes.items()
+        }
+
+    def contains(self, codes, length):
+        """Return boolean array with whether the encoded sequences of ``length`` are in the set."""
+        if length not in self._codes:
+            return np.zeros(len(codes), dtype=bool)
+        return np.isin(codes, self._codes[length])
+
+    def match_prefix(self, codes, length):
+        """Return boolean array with whether the encoded sequences of ``length`` are a prefix of a sequence
+        in the set or vice versa."""
+        if self.has_empty:
+            return np.ones(len(codes), dtype=bool)
+        if length in self._prefixes:
+            result = np.isin(codes, self._prefixes[length])
+        else:
+            result = np.zeros(len(codes), dtype=bool)
+        for other_length, other_codes in self._codes.items():
+            if other_length < length:
+                result |= np.isin(codes >> _shift(length - other_length), other_codes)
+        return result
+
+
+class HistogramTable:
+    """Entries of index histograms as columns.
+
+    Row ``i`` gives the ``count`` of sequence ``seqs[i]`` in the histogram for ``lane`` and
+    ``index_read_no`` sampled from ``sample_size`` reads.  The rows of the ``k``-th histogram are
+    ``slices[k]`` and their ``hist_no`` is ``k``.
+    """
+
+    def __init__(self, histograms):
+        #: The ``LaneIndexHistogram`` objects.
+        self.histograms = list(histograms)
+        #: The sequences, a ``list`` of ``str``.
+        self.seqs = []
+        #: The row slice of each histogram.
+        self.slices = []
+        counts = []
+        for hist in self.histograms:
+            histogram = hist.histogram or {}
+            self.slices.append(slice(len(self.seqs), len(self.seqs) + len(histogram)))
+            self.seqs += histogram.keys()
+            counts += histogram.values()
+        sizes = [rows.stop - rows.start for rows in self.slices]
+        #: The counts, as ``float64`` for computing fractions.
+        self.count = np.array(counts, dtype=np.float64)
+        #: The sample sizes.
+        self.sample_size = np.repeat([hist.sample_size for hist in self.histograms], sizes)
+        #: The lane numbers.
+        self.lane = np.repeat([hist.lane for hist in self.histograms], sizes)
+        #: The index read numbers.
+        self.index_read_no = np.repeat([hist.index_read_no for hist in self.histograms], sizes)
+        #: The number of the histogram in ``histograms``.
+        self.hist_no = np.repeat(np.arange(len(self.histograms)), sizes)
+        #: The sequence lengths.
+        self.length = np.fromiter(map(len, self.seqs), dtype=np.int64, count=len(self.seqs))
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def fraction(self):
+        """Return the fraction of the sampled reads of each row."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.count / self.sample_size
+
+    def encode(self, rows):
+        """Encode sequences of the ``rows`` (an index array).
+
+        Return a dict from length to triple of the row indices with this length, their codes, and whether they
+        could be encoded.
+        """
+        result = {}
+        lengths = self.length[rows]
+        for length in np.unique(lengths):
+            selected = rows[lengths == length]
+            if 0 < length <= MAX_ENCODED_LENGTH:
+                codes, valid = encode_seqs([self.seqs[i] for i in selected], int(length))
+            else:
+                codes = np.zeros(len(selected), dtype=np.uint64)
+                valid = np.zeros(len(selected), dtype=bool)
+            result[int(length)] = (selected, codes, valid)
+        return result
@@ -0,0 +1,28 @@
+"""Pagination for the flowcells API."""
+
+from rest_framework.pagination import CursorPagination
+
+
+class OptionalCursorPagination(CursorPagination):
+    """Cursor pagination ordered by modification date that is only used if requested by the client.
+
+    Pagination is enabled by passing the ``page_size`` or ``cursor`` query parameter.  Otherwise, the list
+    is returned unpaginated as before.  As the order is by modification date, objects that are modified
+    while paging through the list show up again on a later page, which allows for polling changes.
+    """
+
+    ordering = ("date_modified", "id")
+    page_size = 100
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def is_requested(self, request):
+        """Return whether the client requested pagination."""
+        return bool(
+            {self.page_size_query_param, self.cursor_query_param} & set(request.query_params)
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
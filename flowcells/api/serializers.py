@@ -1,19 +1,199 @@
 """Serializers for the sequencers app."""
 
+import datetime
+import functools
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import QuerySet, Subquery
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from filesfolders.models import File, Folder
 from projectroles.utils import build_secret
 
 from sequencers.models import SequencingMachine
-from ..models import FlowCell, LaneIndexHistogram, Library, Message
-from ..tasks import flowcell_update_error_caches
+from ..models import (
+    FlowCell,
+    LaneIndexHistogram,
+    Library,
+    Message,
+    Tombstone,
+    invalidate_row_fragments,
+    reduce_histogram,
+    update_flowcell_summaries,
+)
+from ..histogram_codec import unpack_histogram
+from ..tasks import schedule_error_cache_update
+
+
+def _split_names(value):
+    return {name for name in value.split(",") if name}
+
+
+def get_sparse_fields(request, field_names, expandable_fields):
+    """Return set of the names from ``field_names`` selected by the ``fields`` and ``expand`` query parameters
+    of ``request`` or ``None`` if all fields are to be used.
+
+    The comma-separated ``fields`` selects fields, default is all fields except for the
+    ``expandable_fields``.  These are included if listed in the comma-separated ``expand``.  Only the
+    query parameters of safe requests are interpreted.  Raises ``ValidationError`` on unknown names.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return None
+    fields = request.query_params.get("fields")
+    expand = request.query_params.get("expand")
+    if fields is None and expand is None:
+        return None
+    if fields is None:
+        selected = set(field_names) - set(expandable_fields)
+    else:
+        selected = _split_names(fields)
+    expanded = _split_names(expand or "")
+    errors = {}
+    if selected - set(field_names):
+        errors["fields"] = "Unknown field(s): %s" % ", ".join(sorted(selected - set(field_names)))
+    if expanded - set(expandable_fields):
+        errors["expand"] = "Unknown field(s): %s" % ", ".join(
+            sorted(expanded - set(expandable_fields))
+        )
+    if errors:
+        raise serializers.ValidationError(errors)
+    return selected | expanded
+
+
+class SparseFieldsetMixin:
+    """Restrict the fields of a serializer to those selected with ``get_sparse_fields()``."""
+
+    #: Names of nested fields only included on request.
+    expandable_fields = ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        selected = get_sparse_fields(
+            self.context.get("request"), fields.keys(), self.expandable_fields
+        )
+        if selected is not None:
+            for name in list(fields):
+                if name not in selected:
+                    del fields[name]
+        return fields
+
+
+class LaneIndexHistogramListSerializer(serializers.ListSerializer):
+    """Upsert the index histograms of a flow cell in bulk, see ``LaneIndexHistogramSerializer``."""
+
+    #: Fields written on updating existing histograms.
+    update_fields = (
+        "sample_size",
+        "min_index_fraction",
+        "histogram_json",
+        "histogram_packed",
+        "other_count",
+        "other_num_sequences",
+        "date_modified",
+    )
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        keys = [(item["lane"], item["index_read_no"]) for item in attrs]
+        duplicates = {key for key in keys if keys.count(key) > 1}
+        if duplicates:
+            raise serializers.ValidationError(
+                "Duplicate lane and index read: %s"
+                % ", ".join("%d/%d" % key for key in sorted(duplicates))
+            )
+        return attrs
+
+    def create(self, validated_data):
+        """Create or update the histograms of the flow cell by lane and index read in one transaction and
+        schedule a single error cache update for them."""
+        flowcell = self.context["flowcell"]
+        existing = {
+            (hist.lane, hist.index_read_no): hist
+            for hist in flowcell.index_histograms.defer("histogram_json", "histogram_packed")
+        }
+        now = timezone.now()
+        result, to_create, to_update = [], [], []
+        for attrs in validated_data:
+            instance = existing.get((attrs["lane"], attrs["index_read_no"]))
+            if instance is None:
+                instance = LaneIndexHistogram(flowcell=flowcell, **attrs)
+                to_create.append(instance)
+            else:
+                for key, value in attrs.items():
+                    setattr(instance, key, value)
+                instance.date_modified = now
+                to_update.append(instance)
+            result.append(instance)
+        with transaction.atomic():
+            LaneIndexHistogram.objects.bulk_update(to_update, self.update_fields)
+            LaneIndexHistogram.objects.bulk_create(to_create)
+            invalidate_row_fragments(flowcell.pk)
+            update_flowcell_summaries(flowcell.pk)
+        if result:
+            schedule_error_cache_update(
+                flowcell.pk,
+                lanes=list(sorted({hist.lane for hist in result})),
+                index_read_nos=list(sorted({hist.index_read_no for hist in result})),
+            )
+        return result
 
 
 class LaneIndexHistogramSerializer(serializers.ModelSerializer):
     flowcell = serializers.ReadOnlyField(source="flowcell.sodar_uuid")
+    histogram = serializers.JSONField()
+
+    def validate(self, attrs):
+        """Reduce the histogram to the most frequent sequences, see ``reduce_histogram()``."""
+        attrs = super().validate(attrs)
+        if "histogram" in attrs:
+            field = LaneIndexHistogram._meta.get_field("min_index_fraction")
+            sample_size = attrs.get("sample_size", getattr(self.instance, "sample_size", 0))
+            min_index_fraction = attrs.get(
+                "min_index_fraction", getattr(self.instance, "min_index_fraction", field.default)
+            )
+            lane = attrs.get("lane", getattr(self.instance, "lane", None))
+            index_read_no = attrs.get(
+                "index_read_no", getattr(self.instance, "index_read_no", None)
+            )
+            histogram, other_count, other_num_sequences = reduce_histogram(
+                attrs["histogram"],
+                sample_size,
+                min_index_fraction,
+                settings.FLOWCELLS_INDEX_HISTOGRAM_TOP_K,
+                keep=self._get_sheet_barcodes(lane, index_read_no)
+                if len(attrs["histogram"]) > settings.FLOWCELLS_INDEX_HISTOGRAM_TOP_K
+                else (),
+            )
+            attrs.update(
+                histogram=histogram,
+                other_count=other_count,
+                other_num_sequences=other_num_sequences,
+            )
+        return attrs
+
+    def _get_sheet_barcodes(self, lane, index_read_no):
+        """Return the barcode sequences expected for ``index_read_no`` on ``lane`` of the flow cell.
+
+        The libraries of all lanes are loaded once per request, shared with the other histograms of a batch
+        through the context.
+        """
+        flowcell = self.context.get("flowcell") or getattr(self.instance, "flowcell", None)
+        if flowcell is None:
+            return ()
+        if "sheet_libraries" not in self.context:
+            libraries = {}
+            for library in flowcell.libraries.select_related("barcode", "barcode2"):
+                for lane_number in library.lane_numbers:
+                    libraries.setdefault(lane_number, []).append(library)
+            self.context["sheet_libraries"] = libraries
+        return flowcell._get_expected_index_seqs(
+            self.context["sheet_libraries"].get(lane, ()), index_read_no
+        )
 
     def create(self, validated_data):
         validated_data["flowcell"] = self.context["flowcell"]
@@ -21,16 +201,27 @@ class LaneIndexHistogramSerializer(serializers.ModelSerializer):
             instance = self.context["flowcell"].index_histograms.get(
                 lane=validated_data["lane"], index_read_no=validated_data["index_read_no"]
             )
-            self.update(instance, validated_data)
+            instance = super().update(instance, validated_data)
         except LaneIndexHistogram.DoesNotExist:
             instance = super().create(validated_data)
 
-        flowcell_update_error_caches.delay(instance.flowcell.pk)
+        schedule_error_cache_update(
+            instance.flowcell.pk, lanes=[instance.lane], index_read_nos=[instance.index_read_no]
+        )
         return instance
 
-    def update(self, *args, **kwargs):
-        result = super().update(*args, **kwargs)
-        flowcell_update_error_caches.delay(result.flowcell.pk)
+    def update(self, instance, validated_data):
+        # Lane and index read may change, update old and new partition.
+        lanes = {instance.lane}
+        index_read_nos = {instance.index_read_no}
+        result = super().update(instance, validated_data)
+        lanes.add(result.lane)
+        index_read_nos.add(result.index_read_no)
+        schedule_error_cache_update(
+            result.flowcell.pk,
+            lanes=list(sorted(lanes)),
+            index_read_nos=list(sorted(index_read_nos)),
+        )
         return result
 
     class Meta:
@@ -43,12 +234,15 @@ class LaneIndexHistogramSerializer(serializers.ModelSerializer):
             "sample_size",
             "min_index_fraction",
             "histogram",
+            "other_count",
+            "other_num_sequences",
         )
-        read_only_fields = ("sodar_uuid", "flowcell")
+        read_only_fields = ("sodar_uuid", "flowcell", "other_count", "other_num_sequences")
+        list_serializer_class = LaneIndexHistogramListSerializer
 
 
 class LibrarySerializer(serializers.ModelSerializer):
-    flow_cell = serializers.ReadOnlyField(source="flowcell.sodar_uuid")
+    flow_cell = serializers.ReadOnlyField(source="flow_cell.sodar_uuid")
     barcode = serializers.ReadOnlyField(source="barcode.sodar_uuid")
     barcode2 = serializers.ReadOnlyField(source="barcode2.sodar_uuid")
 
@@ -78,6 +272,29 @@ class LibrarySerializer(serializers.ModelSerializer):
         read_only_fields = ("sodar_uuid", "flow_cell")
 
 
+class LibraryUpsertSerializer(serializers.ModelSerializer):
+    """Validate sample sheet rows for ``libraries.upsert_libraries()``."""
+
+    sodar_uuid = serializers.UUIDField(required=False, allow_null=True)
+    barcode = serializers.UUIDField(required=False, allow_null=True)
+    barcode2 = serializers.UUIDField(required=False, allow_null=True)
+
+    class Meta:
+        model = Library
+        fields = (
+            "sodar_uuid",
+            "name",
+            "project_id",
+            "reference",
+            "barcode",
+            "barcode_seq",
+            "barcode2",
+            "barcode_seq2",
+            "lane_numbers",
+            "demux_reads",
+        )
+
+
 class MessageUuidSerializer(serializers.ModelSerializer):
     """Serialize a message into its UUID.
 
@@ -105,7 +322,7 @@ class FileSerializer(serializers.ModelSerializer):
 class MessageSerializer(serializers.ModelSerializer):
     """Full serializers for messages."""
 
-    flow_cell = serializers.ReadOnlyField(source="flowcell.sodar_uuid")
+    flow_cell = serializers.ReadOnlyField(source="flow_cell.sodar_uuid")
     author = serializers.ReadOnlyField(source="author.username")
     attachment_files = serializers.SerializerMethodField()
 
@@ -171,7 +388,9 @@ class MessageSerializer(serializers.ModelSerializer):
         ]
 
 
-class FlowCellSerializer(serializers.ModelSerializer):
+class FlowCellSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    expandable_fields = ("libraries", "index_histograms", "messages")
+
     sequencing_machine = serializers.CharField(source="sequencing_machine.vendor_id")
     project = serializers.ReadOnlyField(source="project.sodar_uuid")
     demux_operator = serializers.ReadOnlyField(source="demux_operator.username")
@@ -243,6 +462,250 @@ class FlowCellSerializer(serializers.ModelSerializer):
         )
 
 
+class FlowCellChangeSerializer(FlowCellSerializer):
+    """Serialize flow cells without the nested objects, these are listed separately by the changes API."""
+
+    libraries = None
+    index_histograms = None
+    messages = None
+
+    class Meta(FlowCellSerializer.Meta):
+        fields = tuple(
+            name
+            for name in FlowCellSerializer.Meta.fields
+            if name not in FlowCellSerializer.expandable_fields
+        )
+        read_only_fields = ("sodar_uuid", "project", "demux_operator")
+
+
+#: Orderings of the flow cell list selectable with the ``ordering`` query parameter.
+FLOWCELL_LIST_ORDERINGS = ("run_date", "date_modified", "vendor_id")
+
+
+class FlowCellListFilterSerializer(serializers.Serializer):
+    """Validate the query parameters for filtering and ordering the flow cell list.
+
+    ``FILTER_LOOKUPS`` maps the filter parameters to their lookups, these are backed by the indexes of
+    ``FlowCell``.  The parameters given as ``None`` or left out are not used.  The sequencer and the
+    demultiplexing operator are looked up in subqueries such that the flow cells are selected by their
+    primary keys.  Requires the ``project`` in the context.
+    """
+
+    #: Lookup of each filter parameter.
+    FILTER_LOOKUPS = {
+        "run_date_after": "run_date__gte",
+        "run_date_before": "run_date__lte",
+        "sequencing_machine": "sequencing_machine",
+        "vendor_id": "vendor_id",
+        "label": "label",
+        "demux_operator": "demux_operator",
+        "modified_after": "date_modified__gte",
+        "modified_before": "date_modified__lte",
+    }
+
+    run_date_after = serializers.DateField(required=False)
+    run_date_before = serializers.DateField(required=False)
+    sequencing_machine = serializers.CharField(required=False, help_text="Vendor ID of sequencer")
+    vendor_id = serializers.CharField(required=False)
+    label = serializers.CharField(required=False)
+    demux_operator = serializers.CharField(required=False, help_text="User name")
+    modified_after = serializers.DateTimeField(required=False)
+    modified_before = serializers.DateTimeField(required=False)
+    ordering = serializers.ChoiceField(
+        required=False,
+        choices=[prefix + name for name in FLOWCELL_LIST_ORDERINGS for prefix in ("", "-")],
+    )
+
+    def validate_sequencing_machine(self, value):
+        return Subquery(
+            SequencingMachine.objects.filter(
+                project=self.context["project"], vendor_id=value
+            ).values("pk")
+        )
+
+    def validate_demux_operator(self, value):
+        return Subquery(get_user_model().objects.filter(username=value).values("pk"))
+
+    def filter_queryset(self, queryset):
+        """Return ``queryset`` filtered and ordered by the validated data."""
+        data = self.validated_data
+        queryset = queryset.filter(
+            **{
+                lookup: data[name]
+                for name, lookup in self.FILTER_LOOKUPS.items()
+                if data.get(name) is not None
+            }
+        )
+        if data.get("ordering"):
+            queryset = queryset.order_by(data["ordering"], "pk")
+        return queryset
+
+
+#: Conversion of model field values to the representation of the DRF field, by DRF field class.  The values
+#: for the other fields are used as returned by the database.
+_VALUE_TO_REPRESENTATION = {
+    serializers.DateField: datetime.date.isoformat,
+    serializers.FloatField: float,
+    serializers.UUIDField: str,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _value_fields(serializer_class, names):
+    """Return tuple of quadruples for the fields ``names`` of ``serializer_class``.
+
+    Each gives the field name, the ``values()`` lookup of its source, the conversion function (or
+    ``None``), and whether the field is skipped on ``None``.  DRF skips read-only fields with a dotted
+    source if an object on the way is ``None``, e.g., for libraries without second barcode.
+    """
+    fields = serializer_class().fields
+    return tuple(
+        (
+            name,
+            fields[name].source.replace(".", "__"),
+            _VALUE_TO_REPRESENTATION.get(type(fields[name])),
+            fields[name].read_only and "." in fields[name].source,
+        )
+        for name in names
+    )
+
+
+def _values_representations(queryset, value_fields, *extra):
+    """Yield pair of ``extra`` values and representation for each row of ``queryset``."""
+    lookups = [lookup for _, lookup, _, _ in value_fields]
+    for row in queryset.values_list(*extra, *lookups):
+        result = {}
+        for (name, _, convert, skip_none), value in zip(value_fields, row[len(extra) :]):
+            if value is None:
+                if not skip_none:
+                    result[name] = None
+            else:
+                result[name] = value if convert is None else convert(value)
+        yield row[: len(extra)], result
+
+
+def _parent_uuid_fields(value_fields, name, lookup, uuids):
+    """Return ``value_fields`` with field ``name`` mapped from the ``lookup`` of the parent's primary key to
+    its UUID in ``uuids``, saving the join."""
+    return tuple(
+        (name, lookup, uuids.__getitem__, False) if field[0] == name else field
+        for field in value_fields
+    )
+
+
+def flowcell_representations(pks, selected=None):
+    """Return list with the ``FlowCellSerializer`` representation of the flow cells with primary keys ``pks``.
+
+    The representations are built from one ``values_list()`` query per model, joined by flow cell, instead
+    of model instances and nested serializers.  ``selected`` is the set of the fields to include, as
+    returned by ``get_sparse_fields()``, ``None`` for all fields.
+    """
+    pks = list(pks)
+    names = [
+        name for name in FlowCellSerializer.Meta.fields if selected is None or name in selected
+    ]
+    flowcell_fields = _value_fields(
+        FlowCellSerializer,
+        tuple(name for name in names if name not in FlowCellSerializer.expandable_fields),
+    )
+    by_pk = {}
+    uuids = {}
+    for (pk, uuid), result in _values_representations(
+        FlowCell.objects.filter(pk__in=pks), flowcell_fields, "pk", "sodar_uuid"
+    ):
+        by_pk[pk] = result
+        uuids[pk] = uuid
+    nested = {name: {pk: [] for pk in by_pk} for name in FlowCellSerializer.expandable_fields}
+    if "libraries" in names:
+        library_fields = _parent_uuid_fields(
+            _value_fields(LibrarySerializer, LibrarySerializer.Meta.fields),
+            "flow_cell",
+            "flow_cell",
+            uuids,
+        )
+        for (pk,), result in _values_representations(
+            Library.objects.filter(flow_cell__in=pks).order_by("rank", "name"),
+            library_fields,
+            "flow_cell",
+        ):
+            nested["libraries"][pk].append(result)
+    if "index_histograms" in names:
+        histogram_fields = _parent_uuid_fields(
+            _value_fields(
+                LaneIndexHistogramSerializer,
+                tuple(
+                    name for name in LaneIndexHistogramSerializer.Meta.fields if name != "histogram"
+                ),
+            ),
+            "flowcell",
+            "flowcell",
+            uuids,
+        )
+        for (pk, packed, histogram), result in _values_representations(
+            LaneIndexHistogram.objects.filter(flowcell__in=pks).order_by("lane", "index_read_no"),
+            histogram_fields,
+            "flowcell",
+            "histogram_packed",
+            "histogram_json",
+        ):
+            result["histogram"] = histogram if packed is None else unpack_histogram(packed)
+            nested["index_histograms"][pk].append(
+                {name: result[name] for name in LaneIndexHistogramSerializer.Meta.fields}
+            )
+    if "messages" in names:
+        for pk, uuid in (
+            Message.objects.filter(flow_cell__in=pks)
+            .order_by("date_created")
+            .values_list("flow_cell", "sodar_uuid")
+        ):
+            nested["messages"][pk].append(uuid)
+    for pk, result in by_pk.items():
+        for name in names:
+            if name in nested:
+                result[name] = nested[name][pk]
+        by_pk[pk] = {name: result[name] for name in names if name in result}
+    return [by_pk[pk] for pk in pks if pk in by_pk]
+
+
+class FlowCellReadListSerializer(serializers.ListSerializer):
+    """Build the representations of all flow cells at once, see ``flowcell_representations()``."""
+
+    def to_representation(self, data):
+        if isinstance(data, QuerySet):
+            pks = data.values_list("pk", flat=True)
+        else:
+            pks = [flowcell.pk for flowcell in data]
+        return flowcell_representations(pks, self.child.get_selected_fields())
+
+
+class FlowCellReadSerializer(serializers.BaseSerializer):
+    """Read-only serializer producing the representation of ``FlowCellSerializer`` from ``values()``
+    queries, for ``GET`` requests.
+
+    Only the primary key of the flow cell objects passed in is used, so they can be loaded with ``only()``.
+    """
+
+    class Meta:
+        list_serializer_class = FlowCellReadListSerializer
+
+    def get_selected_fields(self):
+        return get_sparse_fields(
+            self.context.get("request"),
+            FlowCellSerializer.Meta.fields,
+            FlowCellSerializer.expandable_fields,
+        )
+
+    def to_representation(self, instance):
+        return flowcell_representations([instance.pk], self.get_selected_fields())[0]
+
+
+class TombstoneSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tombstone
+        fields = ("object_type", "object_uuid", "flowcell_uuid", "date_deleted")
+        read_only_fields = fields
+
+
 class AttachmentSerializer(serializers.ModelSerializer):
     """Serializing filesfolders File objects as attachments"""
 
@@ -1,29 +1,69 @@
 """API Views for the flowcells app."""
 
+import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import OuterRef
 from django.shortcuts import get_object_or_404
-from projectroles.models import Project
-from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import exceptions, serializers
+from rest_framework.generics import (
+    GenericAPIView,
+    ListAPIView,
+    ListCreateAPIView,
+    RetrieveUpdateDestroyAPIView,
+)
+from rest_framework.renderers import BaseRenderer, JSONRenderer
 from rest_framework.response import Response
+from rest_framework.status import HTTP_201_CREATED
+from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import SAFE_METHODS
+from projectroles.models import Project
 
-from digestiflow.utils import ProjectMixin, SodarObjectInProjectPermissions
+from digestiflow.throttling import KIND_LIST
+from digestiflow.utils import (
+    ConditionalGetMixin,
+    ProjectMixin,
+    SodarObjectInProjectPermissions,
+    StreamingListMixin,
+    distinct_values,
+    last_modified,
+)
 from ..models import (
     FlowCell,
     LaneIndexHistogram,
+    Library,
     Message,
+    Tombstone,
     flow_cell_created,
     flow_cell_updated,
     message_created,
     MSG_STATE_SENT,
     MSG_STATE_DRAFT,
+    FLOWCELL_ERROR_CACHE_FIELDS,
 )
+from ..libraries import upsert_libraries
+from ..samplesheets import SAMPLE_SHEET_FORMATS, get_sheet_lane, sample_sheet_response
+from .pagination import OptionalCursorPagination
 from .serializers import (
+    get_sparse_fields,
+    FlowCellChangeSerializer,
+    FlowCellListFilterSerializer,
+    FlowCellReadSerializer,
     FlowCellSerializer,
     LaneIndexHistogramSerializer,
+    LibrarySerializer,
+    LibraryUpsertSerializer,
     MessageSerializer,
     AttachmentSerializer,
+    TombstoneSerializer,
 )
+from ..tasks import schedule_error_cache_update
 
 # TODO: authorization still missing, need mixin for this!
 
@@ -36,26 +76,103 @@ class FlowCellApiViewMixin(ProjectMixin):
         result["project"] = self.get_project()
         return result
 
-    def get_queryset(self):
-        return FlowCell.objects.filter(project=self.get_project()).prefetch_related(
-            "index_histograms",
-            "messages",
-            "libraries",
-            "libraries__barcode",
-            "libraries__barcode__barcode_set",
-            "libraries__barcode2",
-            "libraries__barcode2__barcode_set",
+    #: Related objects to pre-fetch for the nested fields of ``FlowCellSerializer``.
+    prefetch_lookups = (
+        "index_histograms",
+        "messages",
+        "libraries",
+        "libraries__barcode",
+        "libraries__barcode__barcode_set",
+        "libraries__barcode2",
+        "libraries__barcode2__barcode_set",
+    )
+
+    #: Model and flow cell field of the related objects of each of the nested fields.
+    models_for_fields = {
+        "index_histograms": (LaneIndexHistogram, "flowcell"),
+        "messages": (Message, "flow_cell"),
+        "libraries": (Library, "flow_cell"),
+    }
+
+    def get_selected_fields(self):
+        return get_sparse_fields(
+            self.request, FlowCellSerializer.Meta.fields, FlowCellSerializer.expandable_fields
         )
 
+    def get_nested_stamps(self, lookup):
+        """Return ``last_modified()`` expressions for the related objects of the selected nested fields.
+
+        ``lookup`` selects the flow cells of the objects relative to the outer query, e.g., ``project``.
+        """
+        selected = self.get_selected_fields()
+        return [
+            last_modified(
+                model.objects.filter(
+                    **{field if lookup is None else "%s__%s" % (field, lookup): OuterRef("pk")}
+                )
+            )
+            for name, (model, field) in self.models_for_fields.items()
+            if selected is None or name in selected
+        ]
+
+    def get_serializer_class(self):
+        if self.request.method in SAFE_METHODS:
+            return FlowCellReadSerializer
+        return super().get_serializer_class()
+
+    def get_queryset(self):
+        """Return flow cells of the project.
 
-class FlowCellListCreateApiView(FlowCellApiViewMixin, ListCreateAPIView):
+        For reading, ``FlowCellReadSerializer`` only needs the primary keys (and the pagination the
+        modification dates), otherwise the related objects are loaded for ``FlowCellSerializer``.
+        """
+        queryset = FlowCell.objects.filter(project=self.get_project())
+        if self.request.method in SAFE_METHODS:
+            # Reject unknown fields before streaming.
+            self.get_selected_fields()
+            return queryset.only("pk", "date_modified")
+        return queryset.select_related(
+            "project", "sequencing_machine", "demux_operator"
+        ).prefetch_related(*self.prefetch_lookups)
+
+
+class FlowCellListCreateApiView(
+    ConditionalGetMixin, StreamingListMixin, FlowCellApiViewMixin, ListCreateAPIView
+):
     permission_classes = (SodarObjectInProjectPermissions,)
     serializer_class = FlowCellSerializer
+    pagination_class = OptionalCursorPagination
+    last_modified_stamps = True
+    #: Flow cells come with their libraries and index histograms.
+    stream_chunk_size = 10
+
+    def get_modification_stamps(self):
+        """Return the latest modifications of all flow cells of the project, their objects, and deletions.
+
+        The demultiplexing operators have no modification date, their names are part of the stamps.
+        """
+        flowcells = FlowCell.objects.filter(project=OuterRef("pk"))
+        return (
+            Project.objects.filter(pk=self.get_project().pk)
+            .order_by()
+            .values_list(
+                last_modified(flowcells),
+                last_modified(flowcells, "sequencing_machine__date_modified"),
+                distinct_values(flowcells, "demux_operator__username"),
+                last_modified(
+                    Tombstone.objects.filter(project_uuid=OuterRef("sodar_uuid")), "date_deleted"
+                ),
+                *self.get_nested_stamps("project"),
+            )
+            .first()
+        )
 
     def get_queryset(self):
         """Restrict flow cells to those with a sequencing, processing, or delivery state from query string.
 
         For this, the query parameters "sequencing_status", "conversion_status", and "delivery_status" are interpreted.
+        On reading, the list is further filtered and ordered by the query parameters of
+        ``FlowCellListFilterSerializer``.
         """
         queryset = super().get_queryset().all()
         for token in ("sequencing", "conversion", "delivery"):
@@ -63,6 +180,16 @@ class FlowCellListCreateApiView(FlowCellApiViewMixin, ListCreateAPIView):
             status = self.request.query_params.get(key, None)
             if status:
                 queryset = queryset.filter(**{key: status})
+        if self.request.method in SAFE_METHODS:
+            filters = FlowCellListFilterSerializer(
+                data=self.request.query_params, context={"project": self.get_project()}
+            )
+            filters.is_valid(raise_exception=True)
+            if filters.validated_data.get("ordering") and self.paginator.is_requested(self.request):
+                raise serializers.ValidationError(
+                    {"ordering": "Paginated lists are ordered by modification date"}
+                )
+            queryset = filters.filter_queryset(queryset)
         return queryset
 
     def perform_create(self, serializer):
@@ -70,11 +197,37 @@ class FlowCellListCreateApiView(FlowCellApiViewMixin, ListCreateAPIView):
         flow_cell_created(serializer.instance)
 
 
-class FlowCellUpdateDestroyApiView(FlowCellApiViewMixin, RetrieveUpdateDestroyAPIView):
+class FlowCellUpdateDestroyApiView(
+    ConditionalGetMixin, FlowCellApiViewMixin, RetrieveUpdateDestroyAPIView
+):
     permission_classes = (SodarObjectInProjectPermissions,)
     serializer_class = FlowCellSerializer
     lookup_url_kwarg = "flowcell"
     lookup_field = "sodar_uuid"
+    last_modified_stamps = True
+
+    def get_modification_stamps(self):
+        """Return the latest modifications of the flow cell, its objects, and their deletions.
+
+        The demultiplexing operator has no modification date, its name is part of the stamps.
+        """
+        project = self.get_project()
+        return (
+            FlowCell.objects.filter(project=project, sodar_uuid=self.kwargs["flowcell"])
+            .values_list(
+                "date_modified",
+                "sequencing_machine__date_modified",
+                "demux_operator__username",
+                last_modified(
+                    Tombstone.objects.filter(
+                        project_uuid=project.sodar_uuid, flowcell_uuid=OuterRef("sodar_uuid")
+                    ),
+                    "date_deleted",
+                ),
+                *self.get_nested_stamps(None),
+            )
+            .first()
+        )
 
     def perform_update(self, serializer):
         original = FlowCell.objects.get(pk=serializer.instance.pk)
@@ -89,9 +242,8 @@ class FlowCellResolveApiView(FlowCellApiViewMixin, ModelViewSet):
     serializer_class = FlowCellSerializer
 
     def resolve(self, _request, project, instrument_id, run_no, flowcell_id):
-        project = Project.objects.get(sodar_uuid=project)
         flowcell = get_object_or_404(
-            FlowCell.objects.filter(project=project),
+            FlowCell.objects.filter(project=self.get_project()),
             sequencing_machine__vendor_id=instrument_id,
             run_number=run_no,
             vendor_id=flowcell_id,
@@ -100,13 +252,127 @@ class FlowCellResolveApiView(FlowCellApiViewMixin, ModelViewSet):
         return Response(self.get_serializer(flowcell).data)
 
 
-class LaneIndexHistogramApiViewMixin(ProjectMixin):
-    """Common functionality for LaneIndexHistogram API views."""
+#: Format of the tokens of the changes API.
+CHANGES_TOKEN_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
-    def get_flowcell(self):
-        return FlowCell.objects.filter(project=self.get_project()).get(
-            sodar_uuid=self.kwargs["flowcell"]
+
+class ChangesTokenExpired(exceptions.APIException):
+    status_code = 410
+    default_detail = (
+        "The since token is older than the retention of deletions, resynchronize fully."
+    )
+    default_code = "token_expired"
+
+
+class FlowCellChangesApiView(ProjectMixin, APIView):
+    """List flow cells, libraries, index histograms, and messages changed or deleted since a token.
+
+    Without the ``since`` query parameter, all objects are listed.  The response contains the token for
+    the next request.  Consecutive responses overlap by ``settings.FLOWCELLS_CHANGES_OVERLAP`` seconds
+    such that changes committed late are not missed.
+    """
+
+    permission_classes = (SodarObjectInProjectPermissions,)
+    throttle_kind = KIND_LIST
+
+    def get_queryset(self):
+        return FlowCell.objects.filter(project=self.get_project())
+
+    def get_since(self, now):
+        """Return ``datetime`` from the ``since`` query parameter or ``None`` if not given."""
+        value = self.request.query_params.get("since")
+        if value is None:
+            return None
+        try:
+            since = parse_datetime(value)
+        except ValueError:
+            since = None
+        if since is None or timezone.is_naive(since):
+            raise serializers.ValidationError({"since": "Invalid token"})
+        if since < now - datetime.timedelta(days=settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS):
+            raise ChangesTokenExpired()
+        return since
+
+    def get(self, request, *args, **kwargs):
+        now = timezone.now()
+        since = self.get_since(now)
+        project = self.get_project()
+        flowcells = (
+            self.get_queryset()
+            .select_related("project", "sequencing_machine", "demux_operator")
+            .defer(*FLOWCELL_ERROR_CACHE_FIELDS)
+        )
+        libraries = Library.objects.filter(flow_cell__project=project).select_related(
+            "flow_cell", "barcode", "barcode2"
         )
+        index_histograms = LaneIndexHistogram.objects.filter(
+            flowcell__project=project
+        ).select_related("flowcell")
+        messages = (
+            Message.objects.filter(flow_cell__project=project)
+            .select_related("flow_cell", "author", "attachment_folder")
+            .prefetch_related("attachment_folder__filesfolders_file_children")
+        )
+        if since is None:
+            deleted = Tombstone.objects.none()
+        else:
+            flowcells = flowcells.filter(date_modified__gte=since)
+            libraries = libraries.filter(date_modified__gte=since)
+            index_histograms = index_histograms.filter(date_modified__gte=since)
+            messages = messages.filter(date_modified__gte=since)
+            deleted = Tombstone.objects.filter(
+                project_uuid=project.sodar_uuid, date_deleted__gte=since
+            )
+        context = {"project": project}
+        result = {
+            "token": (
+                now - datetime.timedelta(seconds=settings.FLOWCELLS_CHANGES_OVERLAP)
+            ).strftime(CHANGES_TOKEN_FORMAT),
+            "flowcells": FlowCellChangeSerializer(
+                flowcells.order_by("date_modified", "pk"), many=True, context=context
+            ).data,
+            "libraries": LibrarySerializer(
+                libraries.order_by("date_modified", "pk"), many=True, context=context
+            ).data,
+            "index_histograms": LaneIndexHistogramSerializer(
+                index_histograms.order_by("date_modified", "pk"), many=True, context=context
+            ).data,
+            "messages": MessageSerializer(
+                messages.order_by("date_modified", "pk"), many=True, context=context
+            ).data,
+        }
+        # Objects may be deleted and re-created with the same UUID, e.g., libraries on sample sheet edits.
+        live = {
+            str(item["sodar_uuid"])
+            for key in ("flowcells", "libraries", "index_histograms", "messages")
+            for item in result[key]
+        }
+        result["deleted"] = [
+            item
+            for item in TombstoneSerializer(deleted, many=True).data
+            if str(item["object_uuid"]) not in live
+        ]
+        return Response(result)
+
+
+class FlowCellObjectApiViewMixin(ProjectMixin):
+    """Common functionality for API views of objects of a flow cell.
+
+    Makes the flow cell available through ``get_flowcell()``, looked up once per request.
+    """
+
+    def get_flowcell(self):
+        """Return the flow cell object."""
+        if "_flowcell" not in self.__dict__:
+            self._flowcell = FlowCell.objects.filter(project=self.get_project()).get(
+                sodar_uuid=self.kwargs["flowcell"]
+            )
+            self._flowcell.project = self.get_project()
+        return self._flowcell
+
+
+class LaneIndexHistogramApiViewMixin(FlowCellObjectApiViewMixin):
+    """Common functionality for LaneIndexHistogram API views."""
 
     def get_serializer_context(self):
         result = super().get_serializer_context()
@@ -123,6 +389,19 @@ class LaneIndexHistogramListCreateApiView(LaneIndexHistogramApiViewMixin, ListCr
     serializer_class = LaneIndexHistogramSerializer
 
 
+class LaneIndexHistogramBatchApiView(LaneIndexHistogramApiViewMixin, GenericAPIView):
+    """Create or update all index histograms of a flow cell in one ``POST`` request with a list."""
+
+    permission_classes = (SodarObjectInProjectPermissions,)
+    serializer_class = LaneIndexHistogramSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=HTTP_201_CREATED)
+
+
 class LaneIndexHistogramUpdateDestroyApiView(
     LaneIndexHistogramApiViewMixin, RetrieveUpdateDestroyAPIView
 ):
@@ -131,15 +410,95 @@ class LaneIndexHistogramUpdateDestroyApiView(
     lookup_url_kwarg = "indexhistogram"
     lookup_field = "sodar_uuid"
 
+    def perform_destroy(self, instance):
+        flowcell_pk, lane, index_read_no = (
+            instance.flowcell.pk,
+            instance.lane,
+            instance.index_read_no,
+        )
+        super().perform_destroy(instance)
+        schedule_error_cache_update(flowcell_pk, lanes=[lane], index_read_nos=[index_read_no])
 
-class MessageApiViewMixin(ProjectMixin):
-    """Common functionality for Message API views."""
 
-    def get_flowcell(self):
-        return FlowCell.objects.filter(project=self.get_project()).get(
-            sodar_uuid=self.kwargs["flowcell"]
+class LibraryListUpsertApiView(FlowCellObjectApiViewMixin, ListAPIView):
+    """List the libraries of a flow cell or replace them with the sample sheet rows in a ``PUT`` request.
+
+    See ``libraries.upsert_libraries()`` for the matching of rows to libraries.
+    """
+
+    permission_classes = (SodarObjectInProjectPermissions,)
+    serializer_class = LibrarySerializer
+
+    def get_queryset(self):
+        return Library.objects.filter(flow_cell=self.get_flowcell()).select_related(
+            "flow_cell", "barcode", "barcode2"
         )
 
+    def put(self, request, *args, **kwargs):
+        rows = LibraryUpsertSerializer(data=request.data, many=True)
+        rows.is_valid(raise_exception=True)
+        flowcell = self.get_flowcell()
+        try:
+            with transaction.atomic():
+                changed_lanes = upsert_libraries(flowcell, rows.validated_data)
+        except ValidationError as e:
+            raise serializers.ValidationError(e.messages)
+        if changed_lanes:
+            schedule_error_cache_update(flowcell.pk, lanes=list(sorted(changed_lanes)))
+        return self.list(request, *args, **kwargs)
+
+
+class PlainTextRenderer(BaseRenderer):
+    """Renderer allowing clients to accept plain text, the sample sheets are returned as they are."""
+
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render the error payloads as text, the ``detail`` message or one line per field error."""
+        if data is None:
+            return b""
+        if isinstance(data, dict) and "detail" in data:
+            lines = [str(data["detail"])]
+        elif isinstance(data, dict):
+            lines = [
+                "%s: %s" % (key, message)
+                for key, messages in data.items()
+                for message in (messages if isinstance(messages, list) else [messages])
+            ]
+        else:
+            lines = [str(data)]
+        return "".join("%s\n" % line for line in lines).encode(self.charset)
+
+
+class FlowCellSampleSheetApiView(FlowCellObjectApiViewMixin, GenericAPIView):
+    """Download the sample sheet of a flow cell, see ``samplesheets``.
+
+    The lane is selected with the ``lane`` query parameter.
+    """
+
+    permission_classes = (SodarObjectInProjectPermissions,)
+    renderer_classes = (JSONRenderer, PlainTextRenderer)
+
+    def get_queryset(self):
+        return FlowCell.objects.filter(project=self.get_project())
+
+    def get(self, request, *args, **kwargs):
+        name = self.kwargs["sheet_format"]
+        if name not in SAMPLE_SHEET_FORMATS:
+            raise exceptions.NotFound("Unknown sample sheet format")
+        flowcell = self.get_flowcell()
+        try:
+            lane = get_sheet_lane(flowcell, name, request.query_params.get("lane"))
+        except ValueError as e:
+            raise serializers.ValidationError({"lane": [str(e)]})
+        return sample_sheet_response(request, flowcell, name, lane)
+
+
+class MessageApiViewMixin(FlowCellObjectApiViewMixin):
+    """Common functionality for Message API views."""
+
     def get_serializer_context(self):
         result = super().get_serializer_context()
         result["project"] = self.get_project()
@@ -172,17 +531,18 @@ class MessageUpdateDestroyApiView(MessageApiViewMixin, RetrieveUpdateDestroyAPIV
             message_created(serializer.instance)
 
 
-class AttachmentApiViewMixin(ProjectMixin):
+class AttachmentApiViewMixin(FlowCellObjectApiViewMixin):
     """Common functionality for filesfolders File attachment API views."""
 
-    def get_flowcell(self):
-        return FlowCell.objects.filter(project=self.get_project()).get(
-            sodar_uuid=self.kwargs["flowcell"]
-        )
-
     def get_message(self):
-        flow_cell = self.get_flowcell()
-        return flow_cell.messages.get(sodar_uuid=self.kwargs["message"])
+        """Return the message object, looked up once per request."""
+        if "_message" not in self.__dict__:
+            self._message = (
+                self.get_flowcell()
+                .messages.select_related("attachment_folder")
+                .get(sodar_uuid=self.kwargs["message"])
+            )
+        return self._message
 
     def get_serializer_context(self):
         result = super().get_serializer_context()
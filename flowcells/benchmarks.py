@@ -0,0 +1,703 @@
+"""Micro-benchmarks for performance critical code in the flowcells app.
+
+Benchmarks are registered with the ``@benchmark`` decorator and run through the ``flowcells_benchmark``
+management command.  Each benchmark is a function that receives an ``output`` callable for reporting
+and a ``scale`` factor for the size of the synthetic data set.
+"""
+
+import contextlib
+import datetime
+import itertools
+import json
+import random
+import time
+import timeit
+import tracemalloc
+import uuid
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from projectroles.models import Project, SODAR_CONSTANTS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from barcodes.models import BarcodeSet, BarcodeSetEntry
+from sequencers.models import SequencingMachine, MACHINE_MODEL_HISEQ2000, INDEX_WORKFLOW_A
+from .models import (
+    FlowCell,
+    LaneIndexHistogram,
+    Library,
+    prefix_match,
+    STATUS_COMPLETE,
+    STATUS_IN_PROGRESS,
+    THRESH_MIN_INDEX_FRAC,
+)
+from .api.serializers import FlowCellReadSerializer, FlowCellSerializer
+from .api.views import CHANGES_TOKEN_FORMAT, FlowCellApiViewMixin
+from .libraries import upsert_libraries
+from .histogram_codec import jsonb_key, pack_histogram, unpack_histogram
+from .seq_index import PrefixIndex, one_mismatch_neighbours
+
+#: Registered benchmarks, name to function.
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Decorator for registering a benchmark function under ``name``."""
+
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+
+    return decorator
+
+
+def best_of(func, repeat=5, number=1):
+    """Return best wall-clock time of ``repeat`` runs of ``number`` calls to ``func`` in seconds."""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number
+
+
+def random_seqs(rng, count, length, alphabet="ACGT"):
+    """Return ``count`` distinct random sequences of the given ``length``."""
+    result = set()
+    while len(result) < count:
+        result.add("".join(rng.choice(alphabet) for _ in range(length)))
+    return list(sorted(result))
+
+
+@contextlib.contextmanager
+def rolled_back():
+    """Context manager running the block in a transaction that is rolled back afterwards."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def make_flowcell(rng, scale=1, num_lanes=8, num_unexpected=0, machine=None):
+    """Create a flow cell with libraries and index histograms of realistic size and return it.
+
+    Each lane gets ``96 * scale`` libraries with dual indices and each lane and index read gets a histogram
+    with the library barcodes, ``num_unexpected`` frequent sequences not in the sample sheet, and
+    ``1000 * scale`` background sequences.  Also creates the project and sequencing machine unless
+    ``machine`` is given.  Use in a ``rolled_back()`` block.
+    """
+    suffix = uuid.uuid4().hex[:8]
+    if machine is None:
+        project = Project.objects.create(
+            title="Benchmark %s" % suffix, type=SODAR_CONSTANTS["PROJECT_TYPE_PROJECT"]
+        )
+        machine = SequencingMachine.objects.create(
+            project=project,
+            vendor_id="B%s" % suffix,
+            label="Benchmark machine",
+            machine_model=MACHINE_MODEL_HISEQ2000,
+            slot_count=2,
+            dual_index_workflow=INDEX_WORKFLOW_A,
+        )
+    flowcell = FlowCell.objects.create(
+        project=machine.project,
+        run_date=datetime.date(2019, 1, 18),
+        sequencing_machine=machine,
+        run_number=1,
+        slot="A",
+        vendor_id="F%s" % suffix,
+        label="benchmark",
+        num_lanes=num_lanes,
+        planned_reads="151T8B8B151T",
+    )
+    libraries = []
+    histograms = []
+    for lane in range(1, num_lanes + 1):
+        barcodes = [random_seqs(rng, 96 * scale, 8) for _ in range(2)]
+        for i, (seq, seq2) in enumerate(zip(*barcodes)):
+            libraries.append(
+                Library(
+                    flow_cell=flowcell,
+                    rank=len(libraries),
+                    name="lib_%d_%d" % (lane, i),
+                    barcode_seq=seq,
+                    barcode_seq2=seq2,
+                    lane_numbers=[lane],
+                )
+            )
+        for index_read_no, seqs in enumerate(barcodes, 1):
+            histogram = {seq: rng.randint(1000, 10000) for seq in seqs}
+            histogram.update(
+                {seq: rng.randint(50000, 100000) for seq in random_seqs(rng, num_unexpected, 8)}
+            )
+            histogram.update(
+                {seq: rng.randint(1, 100) for seq in random_seqs(rng, 1000 * scale, 8)}
+            )
+            histograms.append(
+                LaneIndexHistogram(
+                    flowcell=flowcell,
+                    lane=lane,
+                    index_read_no=index_read_no,
+                    sample_size=sum(histogram.values()),
+                    histogram=histogram,
+                )
+            )
+    Library.objects.bulk_create(libraries)
+    LaneIndexHistogram.objects.bulk_create(histograms)
+    return FlowCell.objects.get(pk=flowcell.pk).update_error_caches().save_error_caches()
+
+
+def report(output, label, baseline, optimized):
+    """Write timings for ``baseline`` and ``optimized`` implementation and speedup to ``output``."""
+    output(
+        "%-24s baseline %10.3f ms  optimized %10.3f ms  speedup %6.1fx"
+        % (label, baseline * 1000, optimized * 1000, baseline / max(optimized, 1e-9))
+    )
+
+
+@benchmark("prefix-match")
+def bench_prefix_match(output, scale=1):
+    """Compare ``prefix_match()`` with ``PrefixIndex`` for one lane and index read.
+
+    Simulates a 384-plex sample sheet and an index histogram with thousands of observed sequences, half of
+    which come from the sample sheet.  Index construction is included in the optimized timing.
+    """
+    rng = random.Random(42)
+    expected = random_seqs(rng, 384 * scale, 8)
+    observed = random_seqs(rng, 2000 * scale, 8) + [seq + "AT" for seq in expected]
+    rng.shuffle(observed)
+
+    def run_baseline():
+        return [prefix_match(seq, expected) for seq in observed]
+
+    def run_optimized():
+        index = PrefixIndex(expected)
+        return [index.match(seq) for seq in observed]
+
+    assert run_baseline() == run_optimized()
+    report(
+        output,
+        "%d x %d queries" % (len(observed), len(expected)),
+        best_of(run_baseline, repeat=3),
+        best_of(run_optimized, repeat=3),
+    )
+
+
+@benchmark("adapter-siblings")
+def bench_adapter_siblings(output, scale=1):
+    """Compare the pairwise scan formerly done by the ``get_adapter_siblings`` tag for each histogram entry
+    with building the neighbour lists by hashing once and looking them up.
+    """
+    rng = random.Random(42)
+    seqs = random_seqs(rng, 1500 * scale, 8)
+    seqs += [seq[:7] + rng.choice("ACGT") for seq in seqs[: 150 * scale]]
+    seqs = list(sorted(set(seqs)))
+
+    def run_baseline():
+        return [
+            [other for other in seqs if len([x for x, y in zip(seq, other) if x != y]) <= 1]
+            for seq in seqs
+        ]
+
+    def run_optimized():
+        neighbours = one_mismatch_neighbours(seqs)
+        return [list(sorted([seq] + neighbours[seq])) for seq in seqs]
+
+    assert run_baseline() == run_optimized()
+    report(
+        output,
+        "%d sequences" % len(seqs),
+        best_of(run_baseline, repeat=1),
+        best_of(run_optimized, repeat=3),
+    )
+
+
+@benchmark("histogram-codec")
+def bench_histogram_codec(output, scale=1):
+    """Compare size and decoding time of JSON and packed index histograms."""
+    rng = random.Random(42)
+    histogram = {seq: rng.randint(1, 100000) for seq in random_seqs(rng, 20000 * scale, 8)}
+    histogram.update({seq: rng.randint(1, 100) for seq in random_seqs(rng, 100, 8, "ACGTN")})
+    as_json = json.dumps({seq: histogram[seq] for seq in sorted(histogram, key=jsonb_key)})
+    packed = pack_histogram(histogram)
+    assert json.loads(as_json) == unpack_histogram(packed)
+    output(
+        "%-24s JSON %10d bytes  packed %10d bytes  ratio %6.1fx"
+        % ("%d entries" % len(histogram), len(as_json), len(packed), len(as_json) / len(packed))
+    )
+    report(
+        output,
+        "decode",
+        best_of(lambda: json.loads(as_json)),
+        best_of(lambda: unpack_histogram(packed)),
+    )
+
+
+@benchmark("flowcell-patch")
+def bench_flowcell_patch(output, scale=1):
+    """Compare latency of status-only API PATCH requests of a flow cell.
+
+    The baseline uses the former ``FlowCell.save()`` that rebuilt the error caches on every call.  All data
+    is created in a transaction that is rolled back.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        flowcell = make_flowcell(rng, scale)
+        user = get_user_model().objects.create(
+            username="benchmark-%s" % uuid.uuid4().hex[:8], is_superuser=True
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse(
+            "api:flowcells",
+            kwargs={"project": flowcell.project.sodar_uuid, "flowcell": flowcell.sodar_uuid},
+        )
+        statuses = itertools.cycle((STATUS_IN_PROGRESS, STATUS_COMPLETE))
+
+        def run():
+            response = client.patch(url, {"status_conversion": next(statuses)}, format="json")
+            assert response.status_code == 200, response.content
+
+        def legacy_save(self, *args, **kwargs):
+            self.update_error_caches()
+            return models.Model.save(self, *args, **kwargs)
+
+        with mock.patch.object(FlowCell, "save", legacy_save):
+            baseline = best_of(run, repeat=5)
+        report(
+            output,
+            "PATCH, %d libraries" % flowcell.libraries.count(),
+            baseline,
+            best_of(run, repeat=5),
+        )
+
+
+def legacy_build_index_errors(flowcell):
+    """The former per-entry implementation of ``FlowCell._build_index_errors()`` for all histograms."""
+    libraries = {}
+    for library in flowcell._get_error_cache_libraries():
+        for lane_number in library.lane_numbers:
+            libraries.setdefault(lane_number, []).append(library)
+    result = {}
+    for hist in flowcell.index_histograms.all():
+        if not flowcell.has_sheet_for_lane(hist.lane):
+            continue
+        expected_index = PrefixIndex(
+            flowcell._get_expected_index_seqs(libraries.get(hist.lane, ()), hist.index_read_no)
+        )
+        sample_size = hist.sample_size
+        for seq, count in hist.histogram.items():
+            errors = []
+            if not seq or seq in flowcell.get_known_contaminations():
+                continue
+            if not expected_index.match(seq) and "N" not in seq:
+                if (
+                    hist.lane
+                    not in flowcell.lanes_suppress_no_sample_found_for_observed_index_warning
+                ):
+                    errors += [
+                        "found barcode {} on lane {} and index read {} in BCLs but not in sample sheet".format(
+                            seq, hist.lane, hist.index_read_no
+                        )
+                    ]
+            if errors and (count / sample_size >= THRESH_MIN_INDEX_FRAC):
+                result[(hist.lane, hist.index_read_no, seq)] = errors
+    return list(result.items())
+
+
+@benchmark("index-errors")
+def bench_index_errors(output, scale=1):
+    """Compare the former per-entry loop with the vectorized analysis for building the index errors.
+
+    Uses a ``384 * scale``-plex sample sheet on 8 lanes.  The histograms are decoded before timing.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        flowcell = make_flowcell(rng, 4 * scale, num_unexpected=5)
+        flowcell = FlowCell.objects.prefetch_related(
+            "index_histograms", "libraries__barcode", "libraries__barcode2"
+        ).get(pk=flowcell.pk)
+        num_entries = sum(len(hist.histogram) for hist in flowcell.index_histograms.all())
+        flowcell._get_error_cache_libraries()
+        flowcell.get_known_contaminations()
+
+        def run_baseline():
+            return legacy_build_index_errors(flowcell)
+
+        def run_optimized():
+            return flowcell._build_index_errors()
+
+        assert run_baseline() == run_optimized()
+        report(
+            output,
+            "%d entries" % num_entries,
+            best_of(run_baseline, repeat=5),
+            best_of(run_optimized, repeat=5),
+        )
+
+
+@benchmark("flowcell-list")
+def bench_flowcell_list(output, scale=1):
+    """Compare size and latency of the full flow cell list with sparse and paginated requests.
+
+    Creates ``20 * scale`` flow cells in one project with 4 lanes each.  All data is created in a
+    transaction that is rolled back.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        flowcell = make_flowcell(rng, num_lanes=4)
+        for _ in range(20 * scale - 1):
+            make_flowcell(rng, num_lanes=4, machine=flowcell.sequencing_machine)
+        user = get_user_model().objects.create(
+            username="benchmark-%s" % uuid.uuid4().hex[:8], is_superuser=True
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse("api:flowcells", kwargs={"project": flowcell.project.sodar_uuid})
+        sizes = {}
+
+        def get(label, params):
+            def run():
+                response = client.get(url, params)
+                assert response.status_code == 200, response.content
+                sizes[label] = len(response.content)
+
+            return run
+
+        baseline = best_of(get("full", {}), repeat=3)
+        for label, params in (
+            ("fields", {"fields": "sodar_uuid,vendor_id,status_conversion"}),
+            ("expand=libraries", {"expand": "libraries"}),
+            ("page_size=5", {"page_size": 5}),
+        ):
+            report(output, label, baseline, best_of(get(label, params), repeat=3))
+        for label, size in sizes.items():
+            output("%-24s %10d bytes" % (label, size))
+
+
+@benchmark("flowcell-changes")
+def bench_flowcell_changes(output, scale=1):
+    """Compare polling the full flow cell list with polling the changes since a token.
+
+    Creates ``20 * scale`` flow cells in one project with 4 lanes each and changes one library between the
+    polls.  All data is created in a transaction that is rolled back.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        flowcell = make_flowcell(rng, num_lanes=4)
+        for _ in range(20 * scale - 1):
+            make_flowcell(rng, num_lanes=4, machine=flowcell.sequencing_machine)
+        for model in (FlowCell, Library, LaneIndexHistogram):
+            model.objects.update(date_modified=F("date_modified") - datetime.timedelta(hours=1))
+        token = (timezone.now() - datetime.timedelta(minutes=1)).strftime(CHANGES_TOKEN_FORMAT)
+        library = flowcell.libraries.first()
+        library.name = "changed"
+        library.save()
+        user = get_user_model().objects.create(
+            username="benchmark-%s" % uuid.uuid4().hex[:8], is_superuser=True
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        kwargs = {"project": flowcell.project.sodar_uuid}
+        list_url = reverse("api:flowcells", kwargs=kwargs)
+        changes_url = reverse("api:flowcells-changes", kwargs=kwargs)
+
+        def run_baseline():
+            response = client.get(list_url)
+            assert response.status_code == 200, response.content
+
+        def run_optimized():
+            response = client.get(changes_url, {"since": token})
+            assert response.status_code == 200, response.content
+            assert [item["name"] for item in response.data["libraries"]] == ["changed"]
+
+        report(
+            output,
+            "%d flow cells" % FlowCell.objects.filter(project=flowcell.project).count(),
+            best_of(run_baseline, repeat=3),
+            best_of(run_optimized, repeat=3),
+        )
+
+
+def legacy_update_libraries(flowcell, rows):
+    """The former ``FlowCellRecreateLibrariesMixin._update_libraries()`` without the error cache update."""
+    old_libraries = {}
+    for library in flowcell.libraries.all():
+        old_libraries.setdefault(library.name, []).append(library)
+    flowcell.libraries.all().delete()
+    project_barcodes = BarcodeSetEntry.objects.filter(barcode_set__project=flowcell.project)
+    for rank, info in enumerate(rows):
+        library = Library(
+            flow_cell=flowcell,
+            rank=rank,
+            name=info["name"],
+            project_id=info["project_id"],
+            barcode=project_barcodes.get(sodar_uuid=info["barcode"]) if info["barcode"] else None,
+            barcode_seq=info["barcode_seq"],
+            barcode2=project_barcodes.get(sodar_uuid=info["barcode2"])
+            if info["barcode2"]
+            else None,
+            barcode_seq2=info["barcode_seq2"],
+            lane_numbers=info["lane_numbers"],
+            demux_reads=info["demux_reads"],
+        )
+        if old_libraries.get(library.name):
+            library.sodar_uuid = old_libraries[library.name].pop(0).sodar_uuid
+        library.save()
+
+
+@benchmark("library-upsert")
+def bench_library_upsert(output, scale=1):
+    """Compare the former re-creation of all libraries on sample sheet edits with the bulk upsert.
+
+    Uses a ``384 * scale``-row sample sheet with barcodes from a barcode set and edits 10 rows.  All data is
+    created in a transaction that is rolled back.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        flowcell = make_flowcell(rng, num_lanes=1)
+        barcode_set = BarcodeSet.objects.create(
+            project=flowcell.project, name="Benchmark", short_name="benchmark"
+        )
+        entries = BarcodeSetEntry.objects.bulk_create(
+            BarcodeSetEntry(barcode_set=barcode_set, rank=i, name="bc%d" % i, sequence=seq)
+            for i, seq in enumerate(random_seqs(rng, 384 * scale, 8))
+        )
+        rows = [
+            {
+                "name": "lib_%d" % i,
+                "project_id": "",
+                "barcode": str(entry.sodar_uuid),
+                "barcode_seq": "",
+                "barcode2": str(entries[-i - 1].sodar_uuid),
+                "barcode_seq2": "",
+                "lane_numbers": [1],
+                "demux_reads": "",
+            }
+            for i, entry in enumerate(entries)
+        ]
+        upsert_libraries(flowcell, rows)
+        edited = [dict(row, lane_numbers=[1, 2]) if i < 10 else row for i, row in enumerate(rows)]
+        timings = []
+        for func in (legacy_update_libraries, upsert_libraries):
+            # Alternate between the original and the edited sample sheet.
+            sheets = itertools.cycle((edited, rows))
+            with CaptureQueriesContext(connection) as queries:
+                func(flowcell, next(sheets))
+            num_queries = len(queries)
+            timings.append(best_of(lambda: func(flowcell, next(sheets)), repeat=4))
+            output("%-24s %d queries" % (func.__name__, num_queries))
+        report(output, "%d rows, 10 edited" % len(rows), *timings)
+
+
+@benchmark("histogram-batch")
+def bench_histogram_batch(output, scale=1):
+    """Compare uploading the index histograms of a flow cell one by one with one batch request.
+
+    Uses 8 lanes and 2 index reads with ``1000 * scale`` sequences per histogram.  Scheduling of error
+    cache updates is counted but not executed.  All data is created in a transaction that is rolled back.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        flowcell = make_flowcell(rng, num_lanes=8)
+        histograms = [
+            {
+                "lane": hist.lane,
+                "index_read_no": hist.index_read_no,
+                "sample_size": hist.sample_size,
+                "histogram": hist.histogram,
+            }
+            for hist in flowcell.index_histograms.all()[:16]
+        ]
+        user = get_user_model().objects.create(
+            username="benchmark-%s" % uuid.uuid4().hex[:8], is_superuser=True
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        kwargs = {"project": flowcell.project.sodar_uuid, "flowcell": flowcell.sodar_uuid}
+        single_url = reverse("api:indexhistos", kwargs=kwargs)
+        batch_url = reverse("api:indexhistos-batch", kwargs=kwargs)
+
+        def run_baseline():
+            for histogram in histograms:
+                response = client.post(single_url, histogram, format="json")
+                assert response.status_code == 201, response.content
+
+        def run_optimized():
+            response = client.post(batch_url, histograms, format="json")
+            assert response.status_code == 200, response.content
+
+        timings = []
+        for func in (run_baseline, run_optimized):
+            with mock.patch("flowcells.api.serializers.schedule_error_cache_update") as schedule:
+                with CaptureQueriesContext(connection) as queries:
+                    func()
+                output(
+                    "%-24s %d requests, %d queries, %d error cache update(s) scheduled"
+                    % (
+                        "single" if func is run_baseline else "batch",
+                        len(histograms) if func is run_baseline else 1,
+                        len(queries),
+                        schedule.call_count,
+                    )
+                )
+                timings.append(best_of(func, repeat=3))
+        report(output, "%d histograms" % len(histograms), *timings)
+
+
+@benchmark("conditional-get")
+def bench_conditional_get(output, scale=1):
+    """Compare polling the flow cell list and one flow cell with and without ``If-None-Match``.
+
+    Creates ``20 * scale`` flow cells in one project with 4 lanes each.  All data is created in a
+    transaction that is rolled back.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        flowcell = make_flowcell(rng, num_lanes=4)
+        for _ in range(20 * scale - 1):
+            make_flowcell(rng, num_lanes=4, machine=flowcell.sequencing_machine)
+        user = get_user_model().objects.create(
+            username="benchmark-%s" % uuid.uuid4().hex[:8], is_superuser=True
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        urls = {
+            "list": reverse("api:flowcells", kwargs={"project": flowcell.project.sodar_uuid}),
+            "detail": reverse(
+                "api:flowcells",
+                kwargs={"project": flowcell.project.sodar_uuid, "flowcell": flowcell.sodar_uuid},
+            ),
+        }
+        for label, url in urls.items():
+            etag = client.get(url)["ETag"]
+
+            def run_baseline():
+                response = client.get(url)
+                assert response.status_code == 200, response.content
+
+            def run_optimized():
+                response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                assert response.status_code == 304, response.status_code
+
+            report(output, label, best_of(run_baseline, repeat=3), best_of(run_optimized, repeat=3))
+
+
+@benchmark("list-stream")
+def bench_list_stream(output, scale=1):
+    """Compare time to first byte and peak memory of the flow cell list with and without streaming.
+
+    Creates ``40 * scale`` flow cells in one project with 8 lanes each.  The peak memory is measured in a
+    separate run as tracing slows down the requests.  All data is created in a transaction that is rolled
+    back.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        flowcell = make_flowcell(rng, num_lanes=8)
+        for _ in range(40 * scale - 1):
+            make_flowcell(rng, num_lanes=8, machine=flowcell.sequencing_machine)
+        user = get_user_model().objects.create(
+            username="benchmark-%s" % uuid.uuid4().hex[:8], is_superuser=True
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        url = reverse("api:flowcells", kwargs={"project": flowcell.project.sodar_uuid})
+
+        def run(params):
+            """Return times to first byte and to the end of the response."""
+            start = time.perf_counter()
+            response = client.get(url, params)
+            assert response.status_code == 200, response.status_code
+            if response.streaming:
+                pieces = iter(response.streaming_content)
+                next(pieces)
+                first_byte = time.perf_counter() - start
+                for _ in pieces:
+                    pass
+            else:
+                first_byte = time.perf_counter() - start
+            return first_byte, time.perf_counter() - start
+
+        for label, params in (("regular", {}), ("stream", {"stream": "1"})):
+            first_byte, total = min(run(params) for _ in range(3))
+            tracemalloc.start()
+            run(params)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            output(
+                "%-24s first byte %8.3f ms  total %8.3f ms  peak %8.1f MB"
+                % (label, 1000 * first_byte, 1000 * total, peak / 2**20)
+            )
+
+
+@benchmark("flowcell-read")
+def bench_flowcell_read(output, scale=1):
+    """Compare serializing the flow cell list with ``FlowCellSerializer`` and ``FlowCellReadSerializer``.
+
+    Creates ``1000 * scale`` flow cells in one project with 8 libraries and 2 index histograms of 20
+    sequences each and checks that both give the same JSON.  All data is created in a transaction that
+    is rolled back.
+    """
+    rng = random.Random(42)
+    with rolled_back():
+        first = make_flowcell(rng, num_lanes=1)
+        project, machine = first.project, first.sequencing_machine
+        flowcells = FlowCell.objects.bulk_create(
+            FlowCell(
+                project=project,
+                run_date=datetime.date(2019, 1, 18),
+                sequencing_machine=machine,
+                run_number=i,
+                slot="A",
+                vendor_id="F%05d" % i,
+                label="benchmark",
+                num_lanes=1,
+                planned_reads="151T8B8B151T",
+            )
+            for i in range(1000 * scale - 1)
+        )
+        barcodes = random_seqs(rng, 8, 8)
+        Library.objects.bulk_create(
+            Library(
+                flow_cell=flowcell, rank=i, name="lib_%d" % i, barcode_seq=seq, lane_numbers=[1]
+            )
+            for flowcell in flowcells
+            for i, seq in enumerate(barcodes)
+        )
+        LaneIndexHistogram.objects.bulk_create(
+            LaneIndexHistogram(
+                flowcell=flowcell,
+                lane=1,
+                index_read_no=index_read_no,
+                sample_size=1000,
+                histogram={seq: rng.randint(1, 100) for seq in barcodes + random_seqs(rng, 12, 8)},
+            )
+            for flowcell in flowcells
+            for index_read_no in (1, 2)
+        )
+        queryset = FlowCell.objects.filter(project=project)
+        context = {"project": project}
+        prefetched = queryset.select_related(
+            "project", "sequencing_machine", "demux_operator"
+        ).prefetch_related(*FlowCellApiViewMixin.prefetch_lookups)
+        renderer = JSONRenderer()
+        results = {}
+
+        def run(label, serializer_class, queryset, render):
+            def func():
+                data = serializer_class(queryset.all(), many=True, context=context).data
+                if render:
+                    results[label] = renderer.render(data)
+
+            return func
+
+        for render in (False, True):
+            report(
+                output,
+                "%d flow cells%s" % (queryset.count(), " + JSON" if render else ""),
+                best_of(run("baseline", FlowCellSerializer, prefetched, render), repeat=3),
+                best_of(
+                    run("optimized", FlowCellReadSerializer, queryset.only("pk"), render), repeat=3
+                ),
+            )
+        assert results["baseline"] == results["optimized"]
@@ -0,0 +1,150 @@
+"""Compact binary encoding of index histograms.
+
+An index histogram is a ``dict`` from index sequence to count.  The packed format stores the sequences
+2-bit encoded (or as raw UTF-8 if they contain other characters than ``ACGT``) and the counts as an array
+of fixed-width unsigned integers.  The layout is as follows, all integers not in the count array are
+unsigned LEB128 varints.
+
+- format version (one byte, ``PACKED_HISTOGRAM_VERSION``)
+- number of entries ``n``
+- width of each count in bytes (1, 2, 4, or 8)
+- ``n`` counts, little endian
+- runs of sequences, each consisting of the number of sequences in the run, the header
+  ``(length << 1) | is_raw``, and the sequences of the run (``ceil(length / 4)`` bytes each if
+  2-bit encoded, ``length`` bytes each if raw)
+
+The entries are stored in the order that PostgreSQL uses for the keys of ``jsonb`` objects (by length
+in bytes first and then bytewise).  Thus, a decoded histogram iterates in the same order as one loaded from
+a ``JSONField`` and renders to the same JSON.
+"""
+
+import array
+import sys
+
+#: Version of the packed format.
+PACKED_HISTOGRAM_VERSION = 1
+
+#: Bases that can be 2-bit encoded.
+_BASES = "ACGT"
+
+#: Set of the bases that can be 2-bit encoded.
+_BASE_SET = frozenset(_BASES)
+
+#: Translation of bases to base-4 digits.
+_BASE_DIGITS = str.maketrans(_BASES, "0123")
+
+#: Byte value to the four bases encoded in it.
+_UNPACK_BYTE = tuple(
+    "".join(_BASES[(value >> shift) & 3] for shift in (6, 4, 2, 0)) for value in range(256)
+)
+
+#: Array type codes by item size for the count array.
+_COUNT_TYPECODES = {array.array(typecode).itemsize: typecode for typecode in "QLIHB"}
+
+
+def _write_varint(out, value):
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _pack_seq(seq):
+    stride = (len(seq) + 3) // 4
+    if not stride:
+        return b""
+    value = int(seq.translate(_BASE_DIGITS), 4) << (2 * (4 * stride - len(seq)))
+    return value.to_bytes(stride, "big")
+
+
+def jsonb_key(seq):
+    """Sort key giving the order of keys in PostgreSQL ``jsonb`` objects."""
+    encoded = seq.encode("utf-8")
+    return len(encoded), encoded
+
+
+def pack_histogram(histogram):
+    """Return ``bytes`` with the packed ``histogram`` or ``None`` if it cannot be packed.
+
+    Only ``dict``s from ``str`` to non-negative ``int`` below ``2**64`` can be packed.
+    """
+    if not isinstance(histogram, dict):
+        return None
+    for seq, count in histogram.items():
+        if not isinstance(seq, str) or type(count) is not int or not 0 <= count < 2**64:
+            return None
+    seqs = sorted(histogram, key=jsonb_key)
+    max_count = max(histogram.values(), default=0)
+    width = next(width for width in (1, 2, 4, 8) if max_count < 2 ** (8 * width))
+    counts = array.array(_COUNT_TYPECODES[width], (histogram[seq] for seq in seqs))
+    if sys.byteorder == "big":
+        counts.byteswap()
+
+    out = bytearray([PACKED_HISTOGRAM_VERSION])
+    _write_varint(out, len(seqs))
+    _write_varint(out, width)
+    out += counts.tobytes()
+    # Split sequences into runs of equal length and encoding.
+    runs = []
+    for seq in seqs:
+        if _BASE_SET.issuperset(seq):
+            header, payload = len(seq) << 1, _pack_seq(seq)
+        else:
+            payload = seq.encode("utf-8")
+            header = (len(payload) << 1) | 1
+        if not runs or runs[-1][0] != header:
+            runs.append((header, []))
+        runs[-1][1].append(payload)
+    for header, payloads in runs:
+        _write_varint(out, len(payloads))
+        _write_varint(out, header)
+        out += b"".join(payloads)
+    return bytes(out)
+
+
+def unpack_histogram(data):
+    """Return histogram ``dict`` from ``data`` written by ``pack_histogram()``."""
+    data = bytes(data)
+    if not data or data[0] != PACKED_HISTOGRAM_VERSION:
+        raise ValueError("Unknown packed histogram format")
+    count, pos = _read_varint(data, 1)
+    width, pos = _read_varint(data, pos)
+    counts = array.array(_COUNT_TYPECODES[width])
+    counts.frombytes(data[pos : pos + count * width])
+    if sys.byteorder == "big":
+        counts.byteswap()
+    pos += count * width
+
+    seqs = []
+    while len(seqs) < count:
+        run, pos = _read_varint(data, pos)
+        header, pos = _read_varint(data, pos)
+        length = header >> 1
+        if header & 1:
+            chunk = data[pos : pos + run * length]
+            pos += run * length
+            seqs += [chunk[i : i + length].decode("utf-8") for i in range(0, run * length, length)]
+        else:
+            stride = (length + 3) // 4
+            chunk = data[pos : pos + run * stride]
+            pos += run * stride
+            text = "".join([_UNPACK_BYTE[byte] for byte in chunk])
+            step = 4 * stride
+            seqs += [text[i : i + length] for i in range(0, run * step, step)] if step else [""]
+    return dict(zip(seqs, counts.tolist()))
@@ -0,0 +1,145 @@
+"""Bulk update of the libraries of a flow cell from sample sheet rows.
+
+Used by the flow cell forms and the library API.  The existing libraries are matched to the rows by UUID
+or, failing that, by name such that the library UUIDs are stable across sample sheet edits.  Matched
+libraries are updated with one ``bulk_update()`` if changed, the others are created with one
+``bulk_create()`` and the unmatched existing ones deleted with one ``delete()``.
+"""
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from barcodes.models import BarcodeSetEntry
+from .models import (
+    Library,
+    REFERENCE_OTHER,
+    deferred_summary_updates,
+    invalidate_row_fragments,
+)
+
+#: The ``Library`` fields set from the sample sheet rows.
+LIBRARY_ROW_FIELDS = (
+    "rank",
+    "name",
+    "project_id",
+    "reference",
+    "barcode",
+    "barcode_seq",
+    "barcode2",
+    "barcode_seq2",
+    "lane_numbers",
+    "demux_reads",
+)
+
+
+def library_error_key(library):
+    """Return tuple with the ``library`` attributes that the error caches depend on."""
+    return (
+        library.name,
+        library.barcode_id,
+        library.barcode_seq,
+        library.barcode2_id,
+        library.barcode_seq2,
+        tuple(library.lane_numbers),
+        library.demux_reads,
+        library.suppress_barcode1_not_observed_error,
+        library.suppress_barcode2_not_observed_error,
+    )
+
+
+def _row_values(library):
+    return tuple(
+        getattr(library, Library._meta.get_field(name).attname) for name in LIBRARY_ROW_FIELDS
+    )
+
+
+def resolve_barcodes(project, rows):
+    """Return dict from UUID string to ``BarcodeSetEntry`` of ``project`` for the barcodes of ``rows``.
+
+    Raises ``ValidationError`` if a barcode is not found.
+    """
+    uuids = {str(row[key]) for row in rows for key in ("barcode", "barcode2") if row.get(key)}
+    result = {
+        str(entry.sodar_uuid): entry
+        for entry in BarcodeSetEntry.objects.filter(
+            barcode_set__project=project, sodar_uuid__in=uuids
+        )
+    }
+    if uuids - set(result):
+        raise ValidationError("Unknown barcode(s): %s" % ", ".join(sorted(uuids - set(result))))
+    return result
+
+
+def upsert_libraries(flowcell, rows):
+    """Make the libraries of ``flowcell`` match the sample sheet ``rows``.
+
+    Each row is a dict with the keys of ``LIBRARY_ROW_FIELDS`` except for ``rank``, which is the row's
+    position, only ``name`` and ``lane_numbers`` are required.  ``barcode`` and ``barcode2`` are UUIDs of
+    barcode set entries of the flow cell's project or ``None``.  A row with ``sodar_uuid`` updates this library of the flow cell, the other rows update the
+    first remaining library with the same name or create a new one.  Libraries without a row are deleted.
+
+    Raises ``ValidationError`` on unknown barcodes or library UUIDs.  Return the set of lanes with changes
+    relevant to the error caches.
+    """
+    barcodes = resolve_barcodes(flowcell.project, rows)
+    existing = list(flowcell.libraries.order_by("rank", "pk"))
+    by_uuid = {str(library.sodar_uuid): library for library in existing}
+    matched = {}
+    for rank, row in enumerate(rows):
+        if row.get("sodar_uuid"):
+            library = by_uuid.pop(str(row["sodar_uuid"]), None)
+            if library is None:
+                raise ValidationError("Unknown or duplicate library: %s" % row["sodar_uuid"])
+            matched[rank] = library
+    by_name = {}
+    for library in by_uuid.values():
+        by_name.setdefault(library.name, []).append(library)
+    for rank, row in enumerate(rows):
+        if rank not in matched and by_name.get(row["name"]):
+            matched[rank] = by_name[row["name"]].pop(0)
+
+    now = timezone.now()
+    changed_lanes = set()
+    to_create = []
+    to_update = []
+    for rank, row in enumerate(rows):
+        library = matched.get(rank)
+        if library is None:
+            library = Library(flow_cell=flowcell)
+            before = None
+        else:
+            before = (library_error_key(library), _row_values(library), library.lane_numbers)
+        library.rank = rank
+        library.name = row["name"]
+        library.project_id = row.get("project_id")
+        library.reference = row.get("reference", REFERENCE_OTHER)
+        library.barcode = barcodes[str(row["barcode"])] if row.get("barcode") else None
+        library.barcode_seq = row.get("barcode_seq")
+        library.barcode2 = barcodes[str(row["barcode2"])] if row.get("barcode2") else None
+        library.barcode_seq2 = row.get("barcode_seq2")
+        library.lane_numbers = row["lane_numbers"]
+        library.demux_reads = row.get("demux_reads")
+        if before is None:
+            to_create.append(library)
+            changed_lanes |= set(library.lane_numbers)
+        elif before[1] != _row_values(library):
+            library.date_modified = now
+            to_update.append(library)
+            if before[0] != library_error_key(library):
+                changed_lanes |= set(before[2]) | set(library.lane_numbers)
+    removed = [library for libraries in by_name.values() for library in libraries]
+    for library in removed:
+        changed_lanes |= set(library.lane_numbers)
+
+    # The summary is updated once for all deleted libraries.
+    with deferred_summary_updates() as summaries:
+        if removed:
+            Library.objects.filter(pk__in=[library.pk for library in removed]).delete()
+        if to_update:
+            Library.objects.bulk_update(to_update, LIBRARY_ROW_FIELDS + ("date_modified",))
+        if to_create:
+            Library.objects.bulk_create(to_create)
+        if to_update or to_create:
+            invalidate_row_fragments(flowcell.pk)
+            summaries.add(flowcell.pk)
+    return changed_lanes
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flowcells.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = "Run micro-benchmarks of the flowcells app"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "names",
+            nargs="*",
+            help="Names of benchmarks to run (default: all), one of %s"
+            % ", ".join(sorted(BENCHMARKS)),
+        )
+        parser.add_argument(
+            "--scale", type=int, default=1, help="Scale factor for the synthetic data size"
+        )
+
+    def handle(self, *args, **options):
+        names = options["names"] or sorted(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError("Unknown benchmark(s): %s" % ", ".join(unknown))
+        for name in names:
+            self.stdout.write("== %s ==" % name)
+            BENCHMARKS[name](self.stdout.write, scale=options["scale"])
@@ -0,0 +1,40 @@
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+
+from flowcells.rebuild import DEFAULT_CHUNK_SIZE, ErrorCacheRebuilder
+
+
+class Command(BaseCommand):
+    help = "Rebuild the error caches of all flow cells with missing or outdated caches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help="Number of flow cells to load and write at once",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help="Number of worker processes (default: number of CPUs)",
+        )
+        parser.add_argument(
+            "--after-pk",
+            type=int,
+            default=None,
+            help="Resume after the flow cell with this primary key (as reported in the progress)",
+        )
+
+    def handle(self, *args, **options):
+        rebuilder = ErrorCacheRebuilder(
+            chunk_size=options["chunk_size"],
+            processes=options["processes"],
+            progress=self.stdout.write,
+        )
+        rebuilder.run(options["after_pk"])
+        self.stdout.write(
+            "Updated %d flow cell(s), %d failed" % (rebuilder.num_updated, rebuilder.num_failed)
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from flowcells.models import get_drifted_summary_pks, update_flowcell_summaries
+
+
+class Command(BaseCommand):
+    help = "Find flow cells with missing or outdated summaries and rebuild their summaries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--check",
+            action="store_true",
+            default=False,
+            help="Only report the flow cells with drifted summaries and fail if there are any",
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            pks = get_drifted_summary_pks()
+            if pks and not options["check"]:
+                update_flowcell_summaries(*pks, create=True)
+        if not options["check"]:
+            self.stdout.write("Rebuilt the summaries of %d flow cell(s)" % len(pks))
+        elif pks:
+            raise CommandError(
+                "Drifted summaries of %d flow cell(s) with primary keys %s"
+                % (len(pks), ", ".join(map(str, pks)))
+            )
+        else:
+            self.stdout.write("All flow cell summaries are up to date")
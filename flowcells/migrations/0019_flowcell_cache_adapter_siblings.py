@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-18 08:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flowcells", "0018_auto_20220309_1122"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="flowcell",
+            name="cache_adapter_siblings",
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 3.2.12 on 2026-10-18 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+from flowcells.histogram_codec import pack_histogram, unpack_histogram
+
+#: Number of histograms to convert at once.
+BATCH_SIZE = 100
+
+
+def pack_histograms(apps, _schema_editor):
+    """Convert JSON histograms to the packed format where possible."""
+    if not settings.FLOWCELLS_HISTOGRAM_PACKED:
+        return
+    LaneIndexHistogram = apps.get_model("flowcells", "LaneIndexHistogram")
+    batch = []
+    for histogram in LaneIndexHistogram.objects.filter(histogram_json__isnull=False).iterator():
+        packed = pack_histogram(histogram.histogram_json)
+        if packed is not None:
+            histogram.histogram_packed = packed
+            histogram.histogram_json = None
+            batch.append(histogram)
+        if len(batch) >= BATCH_SIZE:
+            LaneIndexHistogram.objects.bulk_update(batch, ["histogram_packed", "histogram_json"])
+            batch = []
+    LaneIndexHistogram.objects.bulk_update(batch, ["histogram_packed", "histogram_json"])
+
+
+def unpack_histograms(apps, _schema_editor):
+    """Convert packed histograms back to JSON."""
+    LaneIndexHistogram = apps.get_model("flowcells", "LaneIndexHistogram")
+    batch = []
+    for histogram in LaneIndexHistogram.objects.filter(histogram_packed__isnull=False).iterator():
+        histogram.histogram_json = unpack_histogram(histogram.histogram_packed)
+        histogram.histogram_packed = None
+        batch.append(histogram)
+        if len(batch) >= BATCH_SIZE:
+            LaneIndexHistogram.objects.bulk_update(batch, ["histogram_packed", "histogram_json"])
+            batch = []
+    LaneIndexHistogram.objects.bulk_update(batch, ["histogram_packed", "histogram_json"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flowcells", "0019_flowcell_cache_adapter_siblings"),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name="laneindexhistogram", old_name="histogram", new_name="histogram_json"
+        ),
+        migrations.AlterField(
+            model_name="laneindexhistogram",
+            name="histogram_json",
+            field=models.JSONField(
+                blank=True,
+                default=None,
+                help_text="The index histogram information",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="laneindexhistogram",
+            name="histogram_packed",
+            field=models.BinaryField(
+                blank=True,
+                default=None,
+                help_text="The packed index histogram information",
+                null=True,
+            ),
+        ),
+        migrations.RunPython(pack_histograms, unpack_histograms),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 06:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flowcells", "0020_laneindexhistogram_histogram_packed"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="laneindexhistogram",
+            name="other_count",
+            field=models.PositiveBigIntegerField(
+                default=0, help_text="Total count of the sequences not stored in the histogram"
+            ),
+        ),
+        migrations.AddField(
+            model_name="laneindexhistogram",
+            name="other_num_sequences",
+            field=models.PositiveIntegerField(
+                default=0, help_text="Number of sequences not stored in the histogram"
+            ),
+        ),
+    ]
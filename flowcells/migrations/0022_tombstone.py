@@ -0,0 +1,77 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flowcells", "0021_laneindexhistogram_other"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Tombstone",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                (
+                    "date_deleted",
+                    models.DateTimeField(auto_now_add=True, help_text="DateTime of deletion"),
+                ),
+                (
+                    "project_uuid",
+                    models.UUIDField(help_text="SODAR UUID of the project of the deleted object"),
+                ),
+                (
+                    "object_type",
+                    models.CharField(
+                        choices=[
+                            ("flowcell", "Flow cell"),
+                            ("library", "Library"),
+                            ("index_histogram", "Index histogram"),
+                            ("message", "Message"),
+                        ],
+                        help_text="Type of the deleted object",
+                        max_length=32,
+                    ),
+                ),
+                ("object_uuid", models.UUIDField(help_text="SODAR UUID of the deleted object")),
+                (
+                    "flowcell_uuid",
+                    models.UUIDField(help_text="SODAR UUID of the flow cell of the deleted object"),
+                ),
+            ],
+            options={
+                "ordering": ("date_deleted", "pk"),
+            },
+        ),
+        migrations.AddIndex(
+            model_name="flowcell",
+            index=models.Index(
+                fields=["project", "date_modified"], name="flowcells_f_project_007857_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="laneindexhistogram",
+            index=models.Index(fields=["date_modified"], name="flowcells_l_date_mo_57f163_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="library",
+            index=models.Index(fields=["date_modified"], name="flowcells_l_date_mo_8836a0_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["date_modified"], name="flowcells_m_date_mo_8940bf_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="tombstone",
+            index=models.Index(
+                fields=["project_uuid", "date_deleted"], name="flowcells_t_project_fa63e7_idx"
+            ),
+        ),
+    ]
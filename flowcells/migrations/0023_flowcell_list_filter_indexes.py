@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flowcells", "0022_tombstone"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="flowcell",
+            index=models.Index(
+                fields=["project", "run_date"], name="flowcells_f_project_3e9a53_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="flowcell",
+            index=models.Index(
+                fields=["project", "sequencing_machine", "run_date"],
+                name="flowcells_f_project_11ad7d_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="flowcell",
+            index=models.Index(
+                fields=["project", "vendor_id"], name="flowcells_f_project_979ad4_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="flowcell",
+            index=models.Index(fields=["project", "label"], name="flowcells_f_project_a8e0ea_idx"),
+        ),
+    ]
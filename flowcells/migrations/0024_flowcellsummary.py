@@ -0,0 +1,109 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:02
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+#: Create the summaries of the existing flow cells, see ``models.get_summary_expressions()``.
+CREATE_SUMMARIES = """
+INSERT INTO flowcells_flowcellsummary (
+    flowcell_id,
+    num_libraries,
+    lanes_with_sheets,
+    has_suppressed_reverse_index_errors,
+    num_sent_messages,
+    num_index_histograms,
+    num_index_errors,
+    num_reverse_index_errors,
+    num_sample_sheet_errors
+)
+SELECT
+    fc.id,
+    (SELECT COUNT(*) FROM flowcells_library lib WHERE lib.flow_cell_id = fc.id),
+    ARRAY(
+        SELECT DISTINCT unnest(lib.lane_numbers) AS lane
+        FROM flowcells_library lib
+        WHERE lib.flow_cell_id = fc.id
+        ORDER BY lane
+    ),
+    EXISTS(
+        SELECT 1 FROM flowcells_library lib
+        WHERE lib.flow_cell_id = fc.id
+        AND (lib.suppress_barcode1_not_observed_error OR lib.suppress_barcode2_not_observed_error)
+    ),
+    (SELECT COUNT(*) FROM flowcells_message msg WHERE msg.flow_cell_id = fc.id AND msg.state = 'sent'),
+    (SELECT COUNT(*) FROM flowcells_laneindexhistogram hist WHERE hist.flowcell_id = fc.id),
+    COALESCE(jsonb_array_length(fc.cache_index_errors), 0),
+    COALESCE(jsonb_array_length(fc.cache_reverse_index_errors), 0),
+    COALESCE(jsonb_array_length(fc.cache_sample_sheet_errors), 0)
+FROM flowcells_flowcell fc
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("flowcells", "0023_flowcell_list_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FlowCellSummary",
+            fields=[
+                (
+                    "flowcell",
+                    models.OneToOneField(
+                        help_text="The summarized flow cell",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="flowcells.flowcell",
+                    ),
+                ),
+                ("num_libraries", models.IntegerField(default=0, help_text="Number of libraries")),
+                (
+                    "lanes_with_sheets",
+                    django.contrib.postgres.fields.ArrayField(
+                        base_field=models.IntegerField(),
+                        blank=True,
+                        default=list,
+                        help_text="Sorted lane numbers with libraries",
+                        size=None,
+                    ),
+                ),
+                (
+                    "has_suppressed_reverse_index_errors",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Whether a library has suppressed errors about barcodes not observed",
+                    ),
+                ),
+                (
+                    "num_sent_messages",
+                    models.IntegerField(default=0, help_text="Number of sent messages"),
+                ),
+                (
+                    "num_index_histograms",
+                    models.IntegerField(default=0, help_text="Number of index histograms"),
+                ),
+                (
+                    "num_index_errors",
+                    models.IntegerField(default=0, help_text="Number of cached index errors"),
+                ),
+                (
+                    "num_reverse_index_errors",
+                    models.IntegerField(
+                        default=0, help_text="Number of libraries with cached reverse index errors"
+                    ),
+                ),
+                (
+                    "num_sample_sheet_errors",
+                    models.IntegerField(
+                        default=0, help_text="Number of libraries with cached sample sheet errors"
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunSQL(CREATE_SUMMARIES, migrations.RunSQL.noop),
+    ]
@@ -1,23 +1,35 @@
+import contextlib
+import copy
+import functools
 import re
+import threading
 import uuid as uuid_object
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.postgres.fields import ArrayField
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.db.models import JSONField, Q
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
 from django.urls import reverse
 
 from mail_factory import factory
+import numpy as np
 import pagerange
 from projectroles.models import Project, PROJECT_TAG_STARRED
 from filesfolders.models import Folder
 
 from . import bases_mask
+from .analysis import HistogramTable, SeqSet
+from .histogram_codec import jsonb_key, pack_histogram, unpack_histogram
+from .seq_index import PrefixIndex, one_mismatch_neighbours
 from digestiflow.users.models import User
-from digestiflow.utils import revcomp
+from digestiflow.utils import object_count, revcomp
 from barcodes.models import BarcodeSetEntry
 from sequencers.models import SequencingMachine, INDEX_WORKFLOW_B
 
@@ -34,7 +46,10 @@ def pretty_range(value):
 
 
 def prefix_match(query, db):
-    """Naive implementation of "is seq prefix of one in expecteds or vice versa"."""
+    """Naive implementation of "is seq prefix of one in expecteds or vice versa".
+
+    Use ``seq_index.PrefixIndex`` when querying the same ``db`` more than once.
+    """
     for entry in db:
         min_len = min(len(query), len(entry))
         if query[:min_len] == entry[:min_len]:
@@ -148,7 +163,54 @@ RTA_VERSION_CHOICES = (
 
 
 #: Current version of error cache computation code.
-FLOWCELL_ERROR_CACHE_VERSION = 3
+FLOWCELL_ERROR_CACHE_VERSION = 4
+
+#: Fields of ``FlowCell`` written by ``FlowCell.save_error_caches()``.
+FLOWCELL_ERROR_CACHE_FIELDS = (
+    "cache_index_errors",
+    "cache_reverse_index_errors",
+    "cache_sample_sheet_errors",
+    "cache_adapter_siblings",
+    "error_caches_version",
+)
+
+
+#: Fields of ``FlowCell`` that all error caches depend on, changing one triggers a full rebuild on saving.
+FLOWCELL_ERROR_CACHE_DEPENDENCIES = (
+    "planned_reads",
+    "demux_reads",
+    "num_lanes",
+    "sequencing_machine_id",
+)
+
+
+def in_error_cache_scope(lane, index_read_no, lanes=None, index_read_nos=None):
+    """Return whether the error cache partition ``(lane, index_read_no)`` is selected.
+
+    ``None`` for ``lanes`` or ``index_read_nos`` selects all lanes or index reads, respectively.
+    """
+    return (lanes is None or lane in lanes) and (
+        index_read_nos is None or index_read_no in index_read_nos
+    )
+
+
+def merge_library_errors(library_uuids, cached, fresh, replaced):
+    """Merge library error list of pairs ``fresh`` into ``cached``.
+
+    Entries of ``cached`` whose library UUID is in ``replaced`` are dropped and the result only contains the
+    entries for ``library_uuids``, in this order.
+    """
+    errors = {key: value for key, value in (cached or []) if key not in replaced}
+    errors.update(fresh)
+    return [(key, errors[key]) for key in library_uuids if key in errors]
+
+
+class SummaryDeferringQuerySet(models.QuerySet):
+    """QuerySet updating the flow cell summaries once in ``delete()`` instead of once per deleted object"""
+
+    def delete(self):
+        with deferred_summary_updates():
+            return super().delete()
 
 
 class FlowCellManager(models.Manager):
@@ -389,17 +451,48 @@ class FlowCell(models.Model):
     #: and ``"barcode2"`` to the list of error messages for the library and the given barcode.
     cache_sample_sheet_errors = JSONField(null=True, blank=True, default=None)
 
+    #: Cache for the adapter sequences of all index histograms.  A ``dict`` that maps each sequence to the
+    #: sorted list of the other sequences with at most one mismatch, see ``get_adapter_siblings()``.
+    cache_adapter_siblings = JSONField(null=True, blank=True, default=None)
+
     #: Search-enabled manager.
     objects = FlowCellManager()
 
     def get_cached_adapter_seqs(self, clear=False):
         if not hasattr(self, "_cached_adapter_seqs") or clear:
-            seqs = set()
-            for hist in self.index_histograms.all():
-                seqs |= hist.histogram.keys()
-            self._cached_adapter_seqs = tuple(sorted(seqs))
+            if self.cache_adapter_siblings is not None and not clear:
+                self._cached_adapter_seqs = tuple(sorted(self.cache_adapter_siblings))
+            else:
+                self._cached_adapter_seqs = tuple(sorted(self._collect_adapter_seqs()))
         return self._cached_adapter_seqs
 
+    def _collect_adapter_seqs(self):
+        """Return set of the sequences in all index histograms."""
+        seqs = set()
+        for hist in self.index_histograms.all():
+            seqs |= hist.histogram.keys()
+        return seqs
+
+    def get_adapter_siblings(self, seq):
+        """Return sorted list of adapter sequences with at most one mismatch to ``seq``.
+
+        Sequences are compared up to the length of the shorter one, ``seq`` itself is included if it is an
+        adapter sequence.  Uses the ``cache_adapter_siblings`` if ``seq`` is in there and computes them from
+        the index histograms otherwise.
+        """
+        siblings = self.cache_adapter_siblings
+        if siblings is None or seq not in siblings:  # cache missing or outdated
+            if not hasattr(self, "_adapter_siblings"):
+                self._adapter_siblings = one_mismatch_neighbours(self._collect_adapter_seqs())
+            siblings = self._adapter_siblings
+        if seq in siblings:
+            return list(sorted([seq] + siblings[seq]))
+        return [
+            other
+            for other in sorted(siblings)
+            if len([x for x, y in zip(seq, other) if x != y]) <= 1
+        ]
+
     @property
     def is_paired(self):
         """Return whether flow cell contains paired read data."""
@@ -428,10 +521,52 @@ class FlowCell(models.Model):
             kwargs={"project": self.project.sodar_uuid, "flowcell": self.sodar_uuid},
         )
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_field_values()
+        return instance
+
+    def _remember_field_values(self, names=None):
+        """Store copy of the current field values (of the given ``attname``s) for ``get_changed_fields()``."""
+        if not hasattr(self, "_saved_values"):
+            self._saved_values = {}
+        for field in self._meta.concrete_fields:
+            selected = names is None or field.name in names or field.attname in names
+            if selected and field.attname in self.__dict__:
+                self._saved_values[field.attname] = copy.copy(self.__dict__[field.attname])
+
+    def get_changed_fields(self):
+        """Return set of the ``attname``s of the fields changed since loading or saving."""
+        saved = getattr(self, "_saved_values", {})
+        return {
+            field.attname
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+            and (field.attname not in saved or saved[field.attname] != self.__dict__[field.attname])
+        }
+
     def save(self, *args, **kwargs):
-        """Override ``save()`` to update error messages."""
-        self.update_error_caches()
-        return super().save(*args, **kwargs)
+        """Override ``save()`` to update error messages.
+
+        The error caches are only updated for new flow cells and if fields that they depend on changed
+        (``FLOWCELL_ERROR_CACHE_DEPENDENCIES`` and the suppressed lanes).  Existing flow cells are saved with
+        ``update_fields`` limited to the changed fields, unless ``update_fields`` is given explicitly.
+        """
+        if self._state.adding or not hasattr(self, "_saved_values") or kwargs.get("force_insert"):
+            self.update_error_caches()
+        elif kwargs.get("update_fields") is None:
+            changed = self.get_changed_fields()
+            suppress_field = "lanes_suppress_no_sample_found_for_observed_index_warning"
+            if changed & set(FLOWCELL_ERROR_CACHE_DEPENDENCIES):
+                self.update_error_caches()
+            elif suppress_field in changed:
+                lanes = set(self._saved_values.get(suppress_field) or ())
+                self.update_error_caches(lanes=lanes ^ set(getattr(self, suppress_field) or ()))
+            kwargs["update_fields"] = self.get_changed_fields() | {"date_modified"}
+        result = super().save(*args, **kwargs)
+        self._remember_field_values(kwargs.get("update_fields"))
+        return result
 
     def get_full_name(self):
         """Return full flow cell name"""
@@ -466,13 +601,10 @@ class FlowCell(models.Model):
         """Return known contaminations dict, cut down to the sequence lengths of observed sequences."""
         if hasattr(self, "_known_contaminations"):
             return self._known_contaminations
-        self._known_contaminations = {}
-        all_contaminations = list(KnownIndexContamination.objects.all())
+        lengths = set()
         for hist in self.index_histograms.all():
-            for length in set(len(seq) for seq in hist.histogram.keys()):
-                self._known_contaminations.update(
-                    {entry.sequence[:length]: entry for entry in all_contaminations}
-                )
+            lengths.update(len(seq) for seq in hist.histogram.keys())
+        self._known_contaminations = known_contamination_index.get(lengths)
         return self._known_contaminations
 
     def is_error_cache_update_pending(self):
@@ -482,21 +614,123 @@ class FlowCell(models.Model):
                 self.cache_index_errors is None,
                 self.cache_reverse_index_errors is None,
                 self.cache_sample_sheet_errors is None,
+                self.cache_adapter_siblings is None,
                 self.error_caches_version != FLOWCELL_ERROR_CACHE_VERSION,
             )
         )
 
-    def update_error_caches(self):
+    def update_error_caches(self, lanes=None, index_read_nos=None):
         """Update ``cache_*`` properties and return ``self``.
 
         Meant to be called ``obj.update_error_cached().save()``.
+
+        The index errors are partitioned by lane and index read, the (reverse) library errors by the lanes of
+        the libraries.  Pass ``lanes`` and/or ``index_read_nos`` to only recompute the errors of the selected
+        partitions and of the libraries on ``lanes``, keeping the other cached errors.  A full rebuild is done
+        if the caches are missing or outdated.  The adapter siblings are always rebuilt.
         """
-        self.cache_index_errors = self._build_index_errors()
-        self.cache_reverse_index_errors = self._build_reverse_index_errors()
-        self.cache_sample_sheet_errors = self._build_sample_sheet_errors()
+        self._clear_error_cache_memos()
+        if (lanes is None and index_read_nos is None) or self.is_error_cache_update_pending():
+            self.cache_index_errors = self._build_index_errors()
+            self.cache_reverse_index_errors = self._build_reverse_index_errors()
+            self.cache_sample_sheet_errors = self._build_sample_sheet_errors()
+        else:
+            self._update_error_cache_partitions(
+                None if lanes is None else set(lanes),
+                None if index_read_nos is None else set(index_read_nos),
+            )
+        self.cache_adapter_siblings = one_mismatch_neighbours(self._collect_adapter_seqs())
         self.error_caches_version = FLOWCELL_ERROR_CACHE_VERSION
+        self._clear_error_cache_memos()
         return self
 
+    def save_error_caches(self):
+        """Write only the ``cache_*`` fields and their version to the database and return ``self``."""
+        FlowCell.objects.filter(pk=self.pk).update(
+            **{name: getattr(self, name) for name in FLOWCELL_ERROR_CACHE_FIELDS}
+        )
+        invalidate_row_fragments(self.pk)
+        update_flowcell_summaries(self.pk)
+        return self
+
+    def _clear_error_cache_memos(self):
+        """Clear the values memoized while building or reading the error caches."""
+        for name in (
+            "_error_cache_libraries",
+            "_has_sheet_for_lane",
+            "_known_contaminations",
+            "_index_errors",
+            "_reverse_index_errors",
+            "_sample_sheet_errors",
+            "_cached_adapter_seqs",
+            "_adapter_siblings",
+        ):
+            self.__dict__.pop(name, None)
+
+    def _get_error_cache_libraries(self):
+        """Return list of libraries with barcodes pre-fetched, memoized while updating the error caches."""
+        if not hasattr(self, "_error_cache_libraries"):
+            libraries = None
+            if "libraries" in getattr(self, "_prefetched_objects_cache", {}):
+                libraries = list(self.libraries.all())
+            # Use the pre-fetched libraries only if their barcodes are pre-fetched as well.
+            if libraries is None or not all(
+                Library.barcode.is_cached(library) and Library.barcode2.is_cached(library)
+                for library in libraries
+            ):
+                libraries = list(self.libraries.prefetch_related("barcode", "barcode2"))
+            self._error_cache_libraries = libraries
+        return self._error_cache_libraries
+
+    def _update_error_cache_partitions(self, lanes, index_read_nos):
+        """Recompute the errors for the given ``lanes`` and ``index_read_nos`` only."""
+        libraries = self._get_error_cache_libraries()
+        library_uuids = [library.sodar_uuid_str for library in libraries]
+        # Index errors of the other partitions are kept, ordering is by lane and index read as in full rebuild.
+        if libraries:
+            kept = [
+                (key, errors)
+                for key, errors in self.cache_index_errors
+                if not in_error_cache_scope(key[0], key[1], lanes, index_read_nos)
+            ]
+            self.cache_index_errors = sorted(
+                kept + self._build_index_errors(lanes, index_read_nos),
+                key=lambda item: (item[0][0], item[0][1]),
+            )
+        else:
+            self.cache_index_errors = []
+        # Libraries on the selected lanes are affected, libraries without lanes are always re-checked.
+        affected = [
+            library
+            for library in libraries
+            if lanes is None or not library.lane_numbers or lanes & set(library.lane_numbers)
+        ]
+        affected_uuids = {library.sodar_uuid_str for library in affected}
+        self.cache_reverse_index_errors = merge_library_errors(
+            library_uuids,
+            self.cache_reverse_index_errors if self.index_histograms.all() else [],
+            self._build_reverse_index_errors(affected),
+            affected_uuids,
+        )
+        # Sample sheet errors of a library depend on all libraries sharing a lane with it.
+        affected_lanes = {lane for library in affected for lane in library.lane_numbers}
+        context = [
+            library
+            for library in libraries
+            if library.sodar_uuid_str in affected_uuids
+            or affected_lanes & set(library.lane_numbers)
+        ]
+        self.cache_sample_sheet_errors = merge_library_errors(
+            library_uuids,
+            self.cache_sample_sheet_errors,
+            [
+                (key, value)
+                for key, value in self._build_sample_sheet_errors(context)
+                if key in affected_uuids
+            ],
+            affected_uuids,
+        )
+
     def get_index_errors(self):
         """Return the index errors from the cached value.
 
@@ -509,65 +743,105 @@ class FlowCell(models.Model):
             self._index_errors = {tuple(k): v for k, v in (self.cache_index_errors or [])}
             return self._index_errors
 
-    def _build_index_errors(self):
+    def _build_index_errors(self, lanes=None, index_read_nos=None):
         """Analyze index histograms for problems and inconsistencies with sample sheet.
 
-        Finds index histogram sequences that are not present in the sample sheet.
+        Finds index histogram sequences that are not present in the sample sheet.  Only the histograms
+        selected by ``lanes`` and ``index_read_nos`` are analyzed (default is all).  The entries of all
+        histograms are checked together with the vectorized operations from ``analysis``.
 
         Return map (list of pairs) from lane number, index read, and sequence to list of errors.
         """
         # Short-circuit if sample sheet is empty.
-        if not self.libraries.all():
+        if not self._get_error_cache_libraries():
             return []
         # Pre-fetch libraries.
         libraries = {}
-        for library in self.libraries.prefetch_related("barcode", "barcode2"):
+        for library in self._get_error_cache_libraries():
             for lane_number in library.lane_numbers:
                 libraries.setdefault(lane_number, []).append(library)
-        #
+        # Load histograms, there are no errors for lanes without sheet or with suppressed warnings.
+        table = HistogramTable(
+            hist
+            for hist in self.index_histograms.all()
+            if in_error_cache_scope(hist.lane, hist.index_read_no, lanes, index_read_nos)
+            and self.has_sheet_for_lane(hist.lane)
+            and hist.lane not in self.lanes_suppress_no_sample_found_for_observed_index_warning
+        )
+        expected = [
+            self._get_expected_index_seqs(libraries.get(hist.lane, ()), hist.index_read_no)
+            for hist in table.histograms
+        ]
+        unexpected = self._find_unexpected_index_seqs(table, expected)
         # Build error messages
-        result = {}
-        for hist in self.index_histograms.all():
-            if not self.has_sheet_for_lane(hist.lane):
-                continue  # no errors if no sheet for lane
-            # Collect sequences we expect to see for this lane and read number
-            expected_seqs = set()
-            for library in libraries.get(hist.lane, ()):
-                if hist.index_read_no == 1:
-                    barcode = library.barcode
-                    barcode_seq = library.barcode_seq
-                else:
-                    barcode = library.barcode2
-                    barcode_seq = library.barcode_seq2
-                the_seq = barcode.sequence if barcode else barcode_seq
-                if not the_seq:
-                    continue
-                if (
-                    hist.index_read_no == 2
-                    and self.sequencing_machine.dual_index_workflow == INDEX_WORKFLOW_B
-                ):
-                    the_seq = revcomp(the_seq)
-                for split_seq in the_seq.split(","):  # could be adapter list, e.g., for chromium
-                    expected_seqs.add(split_seq)
-            # Collect errors and write into result
-            sample_size = hist.sample_size
-            for seq, count in hist.histogram.items():
-                errors = []
-                if not seq or seq in self.get_known_contaminations():
-                    continue  # contamination are not errors, will be displayed in template
-                if not prefix_match(seq, expected_seqs) and "N" not in seq:
-                    if (
-                        hist.lane
-                        not in self.lanes_suppress_no_sample_found_for_observed_index_warning
-                    ):
-                        errors += [
+        result = []
+        for hist, rows in zip(table.histograms, table.slices):
+            for row in np.flatnonzero(unexpected[rows]) + rows.start:
+                seq = table.seqs[row]
+                result.append(
+                    (
+                        (hist.lane, hist.index_read_no, seq),
+                        [
                             "found barcode {} on lane {} and index read {} in BCLs but not in sample sheet".format(
                                 seq, hist.lane, hist.index_read_no
                             )
-                        ]
-                if errors and (count / sample_size >= THRESH_MIN_INDEX_FRAC):
-                    result[(hist.lane, hist.index_read_no, seq)] = errors
-        return list(result.items())
+                        ],
+                    )
+                )
+        return result
+
+    def _get_expected_index_seqs(self, libraries, index_read_no):
+        """Return set of sequences expected for ``index_read_no`` of ``libraries``."""
+        result = set()
+        for library in libraries:
+            if index_read_no == 1:
+                barcode = library.barcode
+                barcode_seq = library.barcode_seq
+            else:
+                barcode = library.barcode2
+                barcode_seq = library.barcode_seq2
+            the_seq = barcode.sequence if barcode else barcode_seq
+            if not the_seq:
+                continue
+            if (
+                index_read_no == 2
+                and self.sequencing_machine.dual_index_workflow == INDEX_WORKFLOW_B
+            ):
+                the_seq = revcomp(the_seq)
+            for split_seq in the_seq.split(","):  # could be adapter list, e.g., for chromium
+                result.add(split_seq)
+        return result
+
+    def _find_unexpected_index_seqs(self, table, expected):
+        """Return boolean array with whether the entries of ``table`` are frequent enough and neither known
+        contaminations nor in the ``expected`` sequences (list of sets, one for each histogram).
+
+        Sequences with an "N" are never unexpected.
+        """
+        contaminations = self.get_known_contaminations()
+        contamination_set = SeqSet(contaminations)
+        expected_sets = [SeqSet(seqs) for seqs in expected]
+        expected_indices = {}
+        result = np.zeros(len(table), dtype=bool)
+        rows = np.flatnonzero(table.fraction() >= THRESH_MIN_INDEX_FRAC)
+        for length, (selected, codes, valid) in table.encode(rows).items():
+            # Fall back to ``PrefixIndex`` for the sequences that cannot be encoded.
+            for row in selected[~valid]:
+                seq = table.seqs[row]
+                if not seq or "N" in seq or seq in contaminations:
+                    continue
+                hist_no = table.hist_no[row]
+                if hist_no not in expected_indices:
+                    expected_indices[hist_no] = PrefixIndex(expected[hist_no])
+                result[row] = not expected_indices[hist_no].match(seq)
+            selected, codes = selected[valid], codes[valid]
+            found = contamination_set.contains(codes, length)
+            hist_nos = table.hist_no[selected]
+            for hist_no in np.unique(hist_nos):
+                in_hist = hist_nos == hist_no
+                found[in_hist] |= expected_sets[hist_no].match_prefix(codes[in_hist], length)
+            result[selected[~found]] = True
+        return result
 
     def get_reverse_index_errors(self):
         """Return index errors from the cached value.
@@ -581,11 +855,12 @@ class FlowCell(models.Model):
             self._reverse_index_errors = {k: v for k, v in (self.cache_reverse_index_errors or [])}
             return self._reverse_index_errors
 
-    def _build_reverse_index_errors(self):
+    def _build_reverse_index_errors(self, libraries=None):
         """Analyze sample sheet for inconsistencies with index histograms.
 
         That is, instead of looking up indices from histograms in sample sheet (as done in ``get_index_errors()``),
         look at sample sheet and look whether sample sheet sequences can be found in the adapter histograms.
+        Only ``libraries`` are checked if given.
 
         Returns an error message mapping (list of pairs) from library UUID to pair of list of error messages (for first
         and second index).
@@ -593,34 +868,36 @@ class FlowCell(models.Model):
         # Short-circuit if there are no index histograms.
         if not self.index_histograms.all():
             return []
-        # Pre-fetch the lane histograms
-        lane_histos = {}
+        # Pre-fetch the lane histograms and build one index of seen sequences per lane and index read
+        lane_seqs = {}
         for histo in self.index_histograms.all():
-            lane_histos.setdefault(histo.lane, {}).setdefault(histo.index_read_no, []).append(histo)
+            lane_seqs.setdefault((histo.lane, histo.index_read_no), set()).update(
+                histo.histogram.keys()
+            )
+        lane_indices = {key: PrefixIndex(seqs) for key, seqs in lane_seqs.items()}
+        empty_index = PrefixIndex()
         # Perform the checking
         result = {}
-        for library in self.libraries.prefetch_related("barcode", "barcode2").all():
+        if libraries is None:
+            libraries = self._get_error_cache_libraries()
+        for library in libraries:
             error_lanes = []
             error_lanes2 = []
             # Collect sequences seen for this lane and read number
             for lane_number in library.lane_numbers:
                 # Check for error in barcode
                 if library.get_barcode_seq():
-                    seen_seqs = set()
-                    for hist in lane_histos.get(lane_number, {}).get(1, []):
-                        seen_seqs |= set(hist.histogram.keys())
+                    seen_index = lane_indices.get((lane_number, 1), empty_index)
                     if (
-                        not prefix_match(library.get_barcode_seq(), seen_seqs)
+                        not seen_index.match(library.get_barcode_seq())
                         and not library.suppress_barcode1_not_observed_error
                     ):
                         error_lanes.append(lane_number)
                 # Check for error in barcode2
                 if library.get_barcode_seq2():
-                    seen_seqs2 = set()
-                    for hist in lane_histos.get(lane_number, {}).get(2, []):
-                        seen_seqs2 |= set(hist.histogram.keys())
+                    seen_index2 = lane_indices.get((lane_number, 2), empty_index)
                     if (
-                        not prefix_match(library.get_barcode_seq2(), seen_seqs2)
+                        not seen_index2.match(library.get_barcode_seq2())
                         and not library.suppress_barcode2_not_observed_error
                     ):
                         error_lanes2.append(lane_number)
@@ -756,9 +1033,12 @@ class FlowCell(models.Model):
             self._sample_sheet_errors = {k: v for k, v in (self.cache_sample_sheet_errors or [])}
             return self._sample_sheet_errors
 
-    def _build_sample_sheet_errors(self):
+    def _build_sample_sheet_errors(self, libraries=None):
         """Analyze the sample sheet for problems and inconsistencies.
 
+        Only ``libraries`` are considered if given, the result is complete for all libraries that share all
+        of their lanes only with libraries from ``libraries``.
+
         Returns map (list of pairs) from library UUID to dict with field names to list of error messages.
         """
         # Resulting error map, empty if no errors
@@ -771,7 +1051,8 @@ class FlowCell(models.Model):
         by_barcode2 = {}  # (lane, barcode) => library
 
         # Gather information about libraries, directly validate names and lane numbers
-        for library in self.libraries.prefetch_related("barcode", "barcode2").all():
+        libraries = self._get_error_cache_libraries() if libraries is None else libraries
+        for library in libraries:
             by_uuid[library.sodar_uuid_str] = library
             # Directly check for invalid characters
             if not re.match("^[a-zA-Z0-9_-]+$", library.name):
@@ -847,20 +1128,15 @@ class FlowCell(models.Model):
                         pretty_range(lanes),
                     )
                 )
-        return list(result.items())
+        return [(key, result[key]) for key in by_uuid if key in result]
 
     def is_user_watching(self, user):
         """Return whether the given user is watching."""
-        try:  # use a little hack to prevent query if prefetched
-            tags = self._prefetched_objects_cache["tags"]
-            # Ok, it's pefetched
-            return bool(
-                [tag for tag in tags if tag.user == user and tag.name == FLOWCELL_TAG_WATCHING]
-            )
-        except (AttributeError, KeyError) as e:
-            print(e)
-            # Not prefetched
+        # Use the pre-fetched tags if any, without a query.
+        tags = getattr(self, "_prefetched_objects_cache", {}).get("tags")
+        if tags is None:
             return self.tags.filter(user=user, name=FLOWCELL_TAG_WATCHING).exists()
+        return any(tag.user_id == user.pk and tag.name == FLOWCELL_TAG_WATCHING for tag in tags)
 
     def __str__(self):
         return "FlowCell %s" % self.get_full_name()
@@ -872,6 +1148,13 @@ class FlowCell(models.Model):
             models.Index(fields=["project", "status_sequencing"]),
             models.Index(fields=["project", "status_conversion"]),
             models.Index(fields=["project", "status_delivery"]),
+            models.Index(fields=["project", "date_modified"]),
+            # Filters and orderings of the flow cell list API, the demultiplexing operator is selective
+            # enough with the index of its foreign key.
+            models.Index(fields=["project", "run_date"]),
+            models.Index(fields=["project", "sequencing_machine", "run_date"]),
+            models.Index(fields=["project", "vendor_id"]),
+            models.Index(fields=["project", "label"]),
         )
 
 
@@ -997,7 +1280,7 @@ REFERENCE_CHOICES = (
 )
 
 
-class LibraryManager(models.Manager):
+class LibraryManager(models.Manager.from_queryset(SummaryDeferringQuerySet)):
     """Manager for custom table-level Library queries"""
 
     def find(self, search_terms, keywords=None):
@@ -1097,6 +1380,7 @@ class Library(models.Model):
 
     class Meta:
         ordering = ["flow_cell", "rank", "name"]
+        indexes = (models.Index(fields=["date_modified"]),)
 
     @staticmethod
     def get_project_filter_key():
@@ -1139,6 +1423,37 @@ class Library(models.Model):
         )
 
 
+def reduce_histogram(histogram, sample_size, min_index_fraction, top_k, keep=()):
+    """Reduce index ``histogram`` to its ``top_k`` sequences and those above the index fraction threshold.
+
+    The threshold is the smaller of ``min_index_fraction`` and ``THRESH_MIN_INDEX_FRAC`` such that no
+    sequence relevant for the index errors is dropped.  Sequences that are a prefix of one of the sequences
+    ``keep`` or vice versa, e.g., the barcodes of the sample sheet, are kept as well, such that the reverse
+    index errors do not report them as not observed.  Returns triple of reduced histogram, the total count
+    of the dropped sequences, and their number.  The histogram is returned unchanged if ``top_k`` is ``0`` or
+    it is not a ``dict`` with ``int`` counts.
+    """
+    if (
+        not top_k
+        or not isinstance(histogram, dict)
+        or not all(type(count) is int for count in histogram.values())
+        or len(histogram) <= top_k
+    ):
+        return histogram, 0, 0
+    threshold = min(min_index_fraction, THRESH_MIN_INDEX_FRAC) * sample_size
+    ranked = sorted(histogram, key=lambda seq: (-histogram[seq], jsonb_key(seq)))
+    keep_index = PrefixIndex(keep) if keep else None
+    kept = set(ranked[:top_k])
+    kept.update(
+        seq
+        for seq in ranked[top_k:]
+        if histogram[seq] >= threshold or (keep_index and keep_index.match(seq))
+    )
+    reduced = {seq: count for seq, count in histogram.items() if seq in kept}
+    dropped = [count for seq, count in histogram.items() if seq not in kept]
+    return reduced, sum(dropped), len(dropped)
+
+
 class LaneIndexHistogram(models.Model):
     """Information about the index sequence distribution on a lane for a FlowCell"""
 
@@ -1169,8 +1484,15 @@ class LaneIndexHistogram(models.Model):
     #: The sample size used.
     sample_size = models.PositiveIntegerField(null=False, help_text="Number of index reads read")
 
-    #: The histogram information as a dict from sequence to count.
-    histogram = JSONField(help_text="The index histogram information")
+    #: The histogram information as JSON, only used if it is not packed, see ``histogram``.
+    histogram_json = JSONField(
+        null=True, blank=True, default=None, help_text="The index histogram information"
+    )
+
+    #: The histogram information packed with ``histogram_codec.pack_histogram()``.
+    histogram_packed = models.BinaryField(
+        null=True, blank=True, default=None, help_text="The packed index histogram information"
+    )
 
     #: The threshold on fraction for including an adapter.
     min_index_fraction = models.FloatField(
@@ -1178,6 +1500,49 @@ class LaneIndexHistogram(models.Model):
         help_text="Minimal fraction that an adapter must have to appear in index histogram",
     )
 
+    #: Total count of the sequences dropped from the histogram by ``reduce_histogram()``.
+    other_count = models.PositiveBigIntegerField(
+        default=0, help_text="Total count of the sequences not stored in the histogram"
+    )
+
+    #: Number of the sequences dropped from the histogram by ``reduce_histogram()``.
+    other_num_sequences = models.PositiveIntegerField(
+        default=0, help_text="Number of sequences not stored in the histogram"
+    )
+
+    #: Manager updating the flow cell summaries once on bulk deletion.
+    objects = SummaryDeferringQuerySet.as_manager()
+
+    @property
+    def histogram(self):
+        """The histogram information as a dict from sequence to count, decoded on first access."""
+        if "_histogram" not in self.__dict__:
+            if self.histogram_packed is not None:
+                self._histogram = unpack_histogram(self.histogram_packed)
+            else:
+                self._histogram = self.histogram_json
+        return self._histogram
+
+    @histogram.setter
+    def histogram(self, value):
+        self._histogram = value
+        self._store_histogram()
+
+    def _store_histogram(self):
+        """Write ``histogram`` to ``histogram_packed`` or, if packing is disabled or impossible, to
+        ``histogram_json``."""
+        packed = None
+        if settings.FLOWCELLS_HISTOGRAM_PACKED:
+            packed = pack_histogram(self._histogram)
+        self.histogram_packed = packed
+        self.histogram_json = self._histogram if packed is None else None
+
+    def save(self, *args, **kwargs):
+        """Override ``save()`` to store changes to the decoded ``histogram``."""
+        if "_histogram" in self.__dict__:
+            self._store_histogram()
+        return super().save(*args, **kwargs)
+
     def __str__(self):
         return "Index Histogram index {} lane {} flowcell {}".format(
             self.index_read_no, self.lane, self.flowcell.get_full_name()
@@ -1186,6 +1551,7 @@ class LaneIndexHistogram(models.Model):
     class Meta:
         unique_together = ("flowcell", "lane", "index_read_no")
         ordering = ("flowcell", "lane", "index_read_no")
+        indexes = (models.Index(fields=["date_modified"]),)
 
 
 #: Message state for draft
@@ -1207,7 +1573,7 @@ FORMAT_MARKDOWN = "text/markdown"
 FORMAT_CHOICES = ((FORMAT_PLAIN, "Plain Text"), (FORMAT_MARKDOWN, "Markdown"))
 
 
-class MessageManager(models.Manager):
+class MessageManager(models.Manager.from_queryset(SummaryDeferringQuerySet)):
     """Manager for custom table-level Message queries"""
 
     def find(self, search_terms, keywords=None):
@@ -1330,6 +1696,7 @@ class Message(models.Model):
 
     class Meta:
         ordering = ("date_created",)
+        indexes = (models.Index(fields=["date_modified"]),)
 
     def get_absolute_url(self):
         if self.state == MSG_STATE_DRAFT:
@@ -1402,3 +1769,474 @@ class KnownIndexContamination(models.Model):
 
     def __str__(self):
         return "{}: {}".format(self.sequence, self.title)
+
+
+#: Cache key of the token identifying the current state of the known contaminations.
+KNOWN_CONTAMINATIONS_TOKEN_KEY = "flowcells:known_contaminations:token"
+
+
+class KnownContaminationIndex:
+    """Process-wide index of the ``KnownIndexContamination`` objects by truncation length.
+
+    The contaminations are loaded once per process and the dict from sequences truncated to a length to the
+    contaminations is built once per length.  Changes to the contaminations replace the token stored under
+    ``KNOWN_CONTAMINATIONS_TOKEN_KEY`` in the shared cache (see ``invalidate()``), on which all processes
+    reload.  If the cache is unavailable, there is no token and the contaminations are loaded on each use.
+
+    Pass ``contaminations`` for a fixed index that neither uses the cache nor the database.
+    """
+
+    def __init__(self, contaminations=None):
+        #: Triple of token, list of contaminations, and dict from truncation lengths to dicts.
+        self._state = None
+        #: Whether the index is fixed.
+        self._fixed = contaminations is not None
+        if self._fixed:
+            self._state = (None, list(contaminations), {})
+
+    def _get_token(self):
+        """Return the token from the shared cache or ``None`` if the cache is unavailable."""
+        token = cache.get(KNOWN_CONTAMINATIONS_TOKEN_KEY)
+        if token is None:
+            cache.add(KNOWN_CONTAMINATIONS_TOKEN_KEY, uuid_object.uuid4().hex, None)
+            token = cache.get(KNOWN_CONTAMINATIONS_TOKEN_KEY)
+        return token
+
+    def _get_state(self):
+        if self._fixed:
+            return self._state
+        token = self._get_token()
+        state = self._state
+        if state is None or token is None or state[0] != token:
+            state = (token, list(KnownIndexContamination.objects.all()), {})
+            self._state = state
+        return state
+
+    def get(self, lengths):
+        """Return dict from the contamination sequences cut down to each of ``lengths`` to the contaminations."""
+        _, contaminations, by_lengths = self._get_state()
+        key = tuple(sorted(lengths))
+        if key not in by_lengths:
+            result = {}
+            for length in key:
+                result.update({entry.sequence[:length]: entry for entry in contaminations})
+            by_lengths[key] = result
+        return by_lengths[key]
+
+    def invalidate(self):
+        """Drop the index in this process at once and in all processes when the transaction commits."""
+        self._state = None
+        transaction.on_commit(
+            lambda: cache.set(KNOWN_CONTAMINATIONS_TOKEN_KEY, uuid_object.uuid4().hex, None)
+        )
+
+
+#: The process-wide ``KnownContaminationIndex``.
+known_contamination_index = KnownContaminationIndex()
+
+
+@receiver(post_save, sender=KnownIndexContamination)
+@receiver(post_delete, sender=KnownIndexContamination)
+def known_contamination_changed(**kwargs):
+    """Invalidate ``known_contamination_index`` on changes to ``KnownIndexContamination``."""
+    known_contamination_index.invalidate()
+
+
+#: Tombstone object type for flow cells.
+TOMBSTONE_FLOWCELL = "flowcell"
+
+#: Tombstone object type for libraries.
+TOMBSTONE_LIBRARY = "library"
+
+#: Tombstone object type for index histograms.
+TOMBSTONE_INDEX_HISTOGRAM = "index_histogram"
+
+#: Tombstone object type for messages.
+TOMBSTONE_MESSAGE = "message"
+
+#: Choices for tombstone object types.
+TOMBSTONE_CHOICES = (
+    (TOMBSTONE_FLOWCELL, "Flow cell"),
+    (TOMBSTONE_LIBRARY, "Library"),
+    (TOMBSTONE_INDEX_HISTOGRAM, "Index histogram"),
+    (TOMBSTONE_MESSAGE, "Message"),
+)
+
+
+class Tombstone(models.Model):
+    """Record of a deleted flow cell or flow cell child object for the "changes" API.
+
+    Tombstones are purged after ``settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS``.
+    """
+
+    #: DateTime of deletion
+    date_deleted = models.DateTimeField(auto_now_add=True, help_text="DateTime of deletion")
+
+    #: The SODAR UUID of the project of the deleted object, no foreign key as projects may be deleted with
+    #: their flow cells.
+    project_uuid = models.UUIDField(help_text="SODAR UUID of the project of the deleted object")
+
+    #: The type of the deleted object.
+    object_type = models.CharField(
+        max_length=32, choices=TOMBSTONE_CHOICES, help_text="Type of the deleted object"
+    )
+
+    #: The SODAR UUID of the deleted object.
+    object_uuid = models.UUIDField(help_text="SODAR UUID of the deleted object")
+
+    #: The SODAR UUID of the flow cell of the deleted object.
+    flowcell_uuid = models.UUIDField(help_text="SODAR UUID of the flow cell of the deleted object")
+
+    class Meta:
+        ordering = ("date_deleted", "pk")
+        indexes = (models.Index(fields=["project_uuid", "date_deleted"]),)
+
+    def __str__(self):
+        return "Tombstone(%s, %s)" % (self.object_type, self.object_uuid)
+
+
+@receiver(post_delete, sender=FlowCell)
+def flow_cell_deleted(instance, **kwargs):
+    """Record tombstone for deleted ``FlowCell``."""
+    Tombstone.objects.create(
+        project_uuid=instance.project.sodar_uuid,
+        object_type=TOMBSTONE_FLOWCELL,
+        object_uuid=instance.sodar_uuid,
+        flowcell_uuid=instance.sodar_uuid,
+    )
+
+
+@functools.lru_cache(maxsize=1024)
+def _flowcell_tombstone_uuids(flowcell_pk):
+    """Return SODAR UUIDs of the flow cell with the given pk and its project.
+
+    Cached as flow cells of large sample sheets are deleted with hundreds of libraries.
+    """
+    return (
+        FlowCell.objects.filter(pk=flowcell_pk)
+        .values_list("sodar_uuid", "project__sodar_uuid")
+        .get()
+    )
+
+
+@receiver(post_delete, sender=Library)
+@receiver(post_delete, sender=LaneIndexHistogram)
+@receiver(post_delete, sender=Message)
+def flow_cell_child_deleted(sender, instance, **kwargs):
+    """Record tombstone for deleted ``Library``, ``LaneIndexHistogram``, or ``Message``."""
+    if sender is LaneIndexHistogram:
+        flowcell_uuid, project_uuid = _flowcell_tombstone_uuids(instance.flowcell_id)
+    else:
+        flowcell_uuid, project_uuid = _flowcell_tombstone_uuids(instance.flow_cell_id)
+    Tombstone.objects.create(
+        project_uuid=project_uuid,
+        object_type={
+            Library: TOMBSTONE_LIBRARY,
+            LaneIndexHistogram: TOMBSTONE_INDEX_HISTOGRAM,
+            Message: TOMBSTONE_MESSAGE,
+        }[sender],
+        object_uuid=instance.sodar_uuid,
+        flowcell_uuid=flowcell_uuid,
+    )
+
+
+#: Format of the cache keys of the tokens of the cached flow cell list rows, by flow cell primary key.
+ROW_TOKEN_KEY = "flowcells:row:token:%d"
+
+
+def invalidate_row_fragments(*pks):
+    """Invalidate the cached list rows of the flow cells with primary keys ``pks``.
+
+    The rows are cached under their flow cell's token, see ``flowcells.rows``.  The tokens are replaced
+    when the transaction commits such that rows rendered from the old data in the meantime are dropped as
+    well.
+    """
+    transaction.on_commit(
+        lambda: cache.set_many(
+            {ROW_TOKEN_KEY % pk: uuid_object.uuid4().hex for pk in pks},
+            settings.FLOWCELLS_ROW_CACHE_TIMEOUT,
+        )
+    )
+
+
+@receiver(post_save, sender=FlowCell)
+@receiver(post_save, sender=FlowCellTag)
+@receiver(post_delete, sender=FlowCellTag)
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+@receiver(post_save, sender=LaneIndexHistogram)
+@receiver(post_delete, sender=LaneIndexHistogram)
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def flow_cell_row_changed(sender, instance, **kwargs):
+    """Invalidate the cached list row of the flow cell of ``instance`` on changes."""
+    if sender is FlowCell:
+        invalidate_row_fragments(instance.pk)
+    elif sender in (FlowCellTag, LaneIndexHistogram):
+        invalidate_row_fragments(instance.flowcell_id)
+    else:
+        invalidate_row_fragments(instance.flow_cell_id)
+
+
+@receiver(post_save, sender=SequencingMachine)
+@receiver(post_save, sender=User)
+def flow_cell_row_related_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    """Invalidate the cached list rows showing the sequencer or demultiplexing operator ``instance``."""
+    if created:
+        return
+    if sender is User:
+        if update_fields is not None and "username" not in update_fields:
+            return  # e.g., only ``last_login`` on logging in
+        flowcells = FlowCell.objects.filter(demux_operator=instance)
+    else:
+        flowcells = FlowCell.objects.filter(sequencing_machine=instance)
+    pks = list(flowcells.values_list("pk", flat=True))
+    if pks:
+        invalidate_row_fragments(*pks)
+
+
+class FlowCellSummary(models.Model):
+    """Summary of a flow cell's libraries, messages, index histograms, and error caches for the lists.
+
+    The summaries are maintained by ``update_flowcell_summaries()`` in the transaction that changes the flow
+    cell or its objects, such that the flow cell lists do not need to query the related tables.  Use the
+    ``flowcells_summaries`` management command for finding and fixing summaries that drifted off.
+    """
+
+    #: The summarized flow cell.
+    flowcell = models.OneToOneField(
+        FlowCell,
+        primary_key=True,
+        related_name="summary",
+        on_delete=models.CASCADE,
+        help_text="The summarized flow cell",
+    )
+
+    #: Number of libraries.
+    num_libraries = models.IntegerField(default=0, help_text="Number of libraries")
+
+    #: Sorted lane numbers with libraries.
+    lanes_with_sheets = ArrayField(
+        models.IntegerField(),
+        default=list,
+        blank=True,
+        help_text="Sorted lane numbers with libraries",
+    )
+
+    #: Whether a library has suppressed errors about barcodes not observed.
+    has_suppressed_reverse_index_errors = models.BooleanField(
+        default=False,
+        help_text="Whether a library has suppressed errors about barcodes not observed",
+    )
+
+    #: Number of sent messages.
+    num_sent_messages = models.IntegerField(default=0, help_text="Number of sent messages")
+
+    #: Number of index histograms.
+    num_index_histograms = models.IntegerField(default=0, help_text="Number of index histograms")
+
+    #: Number of cached index errors.
+    num_index_errors = models.IntegerField(default=0, help_text="Number of cached index errors")
+
+    #: Number of libraries with cached reverse index errors.
+    num_reverse_index_errors = models.IntegerField(
+        default=0, help_text="Number of libraries with cached reverse index errors"
+    )
+
+    #: Number of libraries with cached sample sheet errors.
+    num_sample_sheet_errors = models.IntegerField(
+        default=0, help_text="Number of libraries with cached sample sheet errors"
+    )
+
+    def __str__(self):
+        return "FlowCellSummary(%s)" % self.flowcell_id
+
+
+class SortedArraySubquery(models.Subquery):
+    """Subquery expression collecting the distinct values of the single column of its rows in a sorted array.
+
+    Sorted outside the subquery, as the ordering of subqueries is dropped.
+    """
+
+    template = "ARRAY(SELECT DISTINCT value FROM (%(subquery)s) AS subquery(value) ORDER BY value)"
+    output_field = ArrayField(models.IntegerField())
+
+
+def _cache_length(name):
+    """Return expression with the number of entries in the error cache ``name`` of the flow cell."""
+    return models.Subquery(
+        FlowCell.objects.filter(pk=models.OuterRef("pk")).values(
+            value=Coalesce(
+                models.Func(
+                    models.F(name),
+                    function="jsonb_array_length",
+                    output_field=models.IntegerField(),
+                ),
+                0,
+            )
+        )
+    )
+
+
+def get_summary_expressions():
+    """Return dict with the expressions computing the fields of ``FlowCellSummary`` from its flow cell.
+
+    The expressions refer to the summary (or flow cell) primary key with ``OuterRef``.
+    """
+    libraries = Library.objects.filter(flow_cell=models.OuterRef("pk"))
+    return {
+        "num_libraries": Coalesce(object_count(libraries), 0),
+        "lanes_with_sheets": SortedArraySubquery(
+            libraries.annotate(
+                lane=models.Func(
+                    models.F("lane_numbers"), function="unnest", output_field=models.IntegerField()
+                )
+            ).values("lane")
+        ),
+        "has_suppressed_reverse_index_errors": models.Exists(
+            libraries.filter(
+                Q(suppress_barcode1_not_observed_error=True)
+                | Q(suppress_barcode2_not_observed_error=True)
+            )
+        ),
+        "num_sent_messages": Coalesce(
+            object_count(
+                Message.objects.filter(flow_cell=models.OuterRef("pk"), state=MSG_STATE_SENT)
+            ),
+            0,
+        ),
+        "num_index_histograms": Coalesce(
+            object_count(LaneIndexHistogram.objects.filter(flowcell=models.OuterRef("pk"))), 0
+        ),
+        "num_index_errors": _cache_length("cache_index_errors"),
+        "num_reverse_index_errors": _cache_length("cache_reverse_index_errors"),
+        "num_sample_sheet_errors": _cache_length("cache_sample_sheet_errors"),
+    }
+
+
+def update_flowcell_summaries(*pks, create=False):
+    """Recompute the summaries of the flow cells with primary keys ``pks``.
+
+    The summaries are updated in the current transaction, so they commit or roll back together with the
+    changes of the flow cells.  Missing summaries are only created with ``create``, as the objects of flow
+    cells being deleted are deleted (and signalled) before the flow cells.
+
+    The summary rows are locked with ``SELECT ... FOR UPDATE`` first, and then recomputed in one
+    ``UPDATE``.  The order matters: with READ COMMITTED, the subqueries of a statement only see the rows
+    committed when the statement started.  Recomputing in the statement that waits for the lock held by a
+    concurrent change of the same flow cell would miss the objects of that change.  The ``UPDATE`` after
+    the lock is a new statement and sees them.
+    """
+    if create:
+        FlowCellSummary.objects.bulk_create(
+            [FlowCellSummary(flowcell_id=pk) for pk in pks], ignore_conflicts=True
+        )
+    with transaction.atomic(savepoint=False):
+        locked = list(
+            FlowCellSummary.objects.select_for_update()
+            .filter(pk__in=pks)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        if locked:
+            FlowCellSummary.objects.filter(pk__in=locked).update(**get_summary_expressions())
+
+
+def get_drifted_summary_pks():
+    """Return sorted list of primary keys of the flow cells with missing or outdated summaries."""
+    expected = get_summary_expressions()
+    drifted = (
+        FlowCellSummary.objects.annotate(
+            **{"expected_%s" % name: expression for name, expression in expected.items()}
+        )
+        .exclude(**{name: models.F("expected_%s" % name) for name in expected})
+        .values_list("pk", flat=True)
+    )
+    missing = FlowCell.objects.filter(summary__isnull=True).values_list("pk", flat=True)
+    return sorted(set(drifted) | set(missing))
+
+
+#: Thread-local state of ``deferred_summary_updates()``.
+_deferred_summaries = threading.local()
+
+
+@contextlib.contextmanager
+def deferred_summary_updates():
+    """Context manager collecting the summary updates of ``flow_cell_summary_changed()``.
+
+    The summaries are updated at once on leaving the context, e.g., after deleting many libraries with
+    signals.  The context yields the ``set`` of collected primary keys, for adding further flow cells.
+    """
+    if getattr(_deferred_summaries, "pks", None) is not None:
+        yield _deferred_summaries.pks
+        return
+    _deferred_summaries.pks = pks = set()
+    try:
+        yield pks
+    finally:
+        _deferred_summaries.pks = None
+    if pks:
+        update_flowcell_summaries(*sorted(pks))
+
+
+#: Thread-local primary keys of the flow cells being deleted, see ``flow_cell_deleting()``.
+_deleting_flowcells = threading.local()
+
+
+@receiver(pre_delete, sender=FlowCell)
+def flow_cell_deleting(sender, instance, **kwargs):
+    """Remember that the flow cell is being deleted, such that its summary is not updated.
+
+    Django sends ``pre_delete`` for all objects before deleting any of them, and deletes the libraries,
+    histograms, and messages of a flow cell before the flow cell itself.  This also holds for deleting a
+    query set of flow cells.
+    """
+    if getattr(_deleting_flowcells, "pks", None) is None:
+        _deleting_flowcells.pks = set()
+    _deleting_flowcells.pks.add(instance.pk)
+
+
+@receiver(post_delete, sender=FlowCell)
+def flow_cell_deletion_done(sender, instance, **kwargs):
+    """Forget the deleted flow cell, see ``flow_cell_deleting()``."""
+    _deleting_flowcells.pks.discard(instance.pk)
+
+
+def _is_flowcell_deleting(pk):
+    """Return whether the flow cell with the given ``pk`` is being deleted, see ``flow_cell_deleting()``."""
+    pks = getattr(_deleting_flowcells, "pks", None)
+    if pks and not connection.in_atomic_block:
+        pks.clear()  # left behind by a deletion that failed, deletions are atomic
+    return bool(pks) and pk in pks
+
+
+@receiver(post_save, sender=FlowCell)
+@receiver(post_save, sender=Library)
+@receiver(post_delete, sender=Library)
+@receiver(post_save, sender=LaneIndexHistogram)
+@receiver(post_delete, sender=LaneIndexHistogram)
+@receiver(post_save, sender=Message)
+@receiver(post_delete, sender=Message)
+def flow_cell_summary_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    """Update the summary of the flow cell of ``instance`` on changes.
+
+    Deleting many objects updates the summaries once with ``SummaryDeferringQuerySet``, objects of deleted
+    flow cells do not update them at all.
+    """
+    if sender is FlowCell:
+        if created:
+            update_flowcell_summaries(instance.pk, create=True)
+            return
+        if update_fields is not None and not set(update_fields) & set(FLOWCELL_ERROR_CACHE_FIELDS):
+            return  # only the error cache counts are summarized from the flow cell itself
+        pk = instance.pk
+    elif sender is LaneIndexHistogram:
+        pk = instance.flowcell_id
+    else:
+        pk = instance.flow_cell_id
+    if _is_flowcell_deleting(pk):
+        return  # the summary is deleted as well
+    if getattr(_deferred_summaries, "pks", None) is None:
+        update_flowcell_summaries(pk)
+    else:
+        _deferred_summaries.pks.add(pk)
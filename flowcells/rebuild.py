@@ -0,0 +1,170 @@
+"""Bulk rebuild of the error caches of flow cells with missing or outdated caches.
+
+Used after bumping ``models.FLOWCELL_ERROR_CACHE_VERSION``.  The flow cells are streamed in chunks of
+increasing primary key, each chunk is loaded with all data needed for building the caches in a few
+queries, the caches are computed (optionally in a pool of worker processes), and written back with
+one ``bulk_update()`` per chunk.  Flow cells that are up to date are not touched, thus an interrupted
+rebuild is resumed by starting it again (optionally after the last reported primary key).
+"""
+
+import logging
+import multiprocessing
+import time
+
+import django
+from django.db import connections, transaction
+from django.db.models import Q
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+#: Default number of flow cells to process per chunk.
+DEFAULT_CHUNK_SIZE = 50
+
+
+def outdated_error_caches_queryset():
+    """Return ``QuerySet`` of the flow cells with missing or outdated error caches."""
+    return models.FlowCell.objects.filter(
+        Q(error_caches_version__isnull=True)
+        | Q(error_caches_version__lt=models.FLOWCELL_ERROR_CACHE_VERSION)
+    )
+
+
+def load_chunk(after_pk=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Return list of the next ``chunk_size`` outdated flow cells after ``after_pk``.
+
+    The flow cells come with everything pre-fetched that is needed for building the error caches without
+    further queries, except for the known contaminations.
+    """
+    queryset = outdated_error_caches_queryset()
+    if after_pk is not None:
+        queryset = queryset.filter(pk__gt=after_pk)
+    return list(
+        queryset.order_by("pk")
+        .select_related("sequencing_machine")
+        .prefetch_related("index_histograms", "libraries__barcode", "libraries__barcode2")[
+            :chunk_size
+        ]
+    )
+
+
+def compute_error_caches(flowcell):
+    """Build the error caches of ``flowcell``.
+
+    Return triple of primary key, dict with the values of ``models.FLOWCELL_ERROR_CACHE_FIELDS`` (or
+    ``None`` on failure), and error message (or ``None`` on success).
+    """
+    try:
+        flowcell.update_error_caches()
+    except Exception as e:
+        return flowcell.pk, None, "%s: %s" % (e.__class__.__name__, e)
+    return (
+        flowcell.pk,
+        {name: getattr(flowcell, name) for name in models.FLOWCELL_ERROR_CACHE_FIELDS},
+        None,
+    )
+
+
+def _init_worker(contaminations):
+    """Set up worker process of the pool, ``contaminations`` is a list of field dicts."""
+    django.setup()
+    models.known_contamination_index = models.KnownContaminationIndex(
+        [models.KnownIndexContamination(**values) for values in contaminations]
+    )
+
+
+class ErrorCacheRebuilder:
+    """Rebuild the outdated error caches in chunks with ``processes`` worker processes.
+
+    With one process, the caches are computed in the calling process.  Progress is reported after each
+    chunk by calling ``progress`` with a message.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, processes=1, progress=logger.info):
+        #: Number of flow cells per chunk.
+        self.chunk_size = chunk_size
+        #: Number of worker processes.
+        self.processes = processes
+        #: Callable for progress messages.
+        self.progress = progress
+        #: Number of flow cells updated.
+        self.num_updated = 0
+        #: Number of flow cells that failed.
+        self.num_failed = 0
+
+    def run(self, after_pk=None, deadline=None):
+        """Rebuild the caches of the outdated flow cells with primary key greater than ``after_pk``.
+
+        Stops after the first chunk that ends after ``deadline`` (a ``time.monotonic()`` value).  Return the
+        primary key of the last flow cell processed if stopped early, ``None`` when done.
+        """
+        queryset = outdated_error_caches_queryset()
+        if after_pk is not None:
+            queryset = queryset.filter(pk__gt=after_pk)
+        total = queryset.count()
+        self.progress("Rebuilding error caches of %d flow cell(s)" % total)
+        start = time.monotonic()
+        done = 0
+        pool = None
+        if self.processes > 1:
+            contaminations = list(
+                models.KnownIndexContamination.objects.values(
+                    "id", "sodar_uuid", "title", "sequence", "description", "factory_default"
+                )
+            )
+            # The workers must not share the database connections of this process.
+            connections.close_all()
+            pool = multiprocessing.Pool(self.processes, _init_worker, (contaminations,))
+        try:
+            while True:
+                chunk = load_chunk(after_pk, self.chunk_size)
+                if not chunk:
+                    return None
+                self._process_chunk(chunk, pool)
+                after_pk = chunk[-1].pk
+                done += len(chunk)
+                self._report(done, total, time.monotonic() - start, after_pk)
+                if deadline is not None and time.monotonic() > deadline:
+                    return after_pk
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _process_chunk(self, chunk, pool):
+        if pool is None:
+            results = list(map(compute_error_caches, chunk))
+        else:
+            results = pool.map(compute_error_caches, chunk)
+        by_pk = {flowcell.pk: flowcell for flowcell in chunk}
+        updated = []
+        for pk, caches, error in results:
+            if error:
+                self.num_failed += 1
+                logger.warning("Could not rebuild error caches of flow cell %d: %s", pk, error)
+            else:
+                for name, value in caches.items():
+                    setattr(by_pk[pk], name, value)
+                updated.append(by_pk[pk])
+        with transaction.atomic():
+            # Skip flow cells updated in the meantime.
+            outdated = set(
+                outdated_error_caches_queryset()
+                .filter(pk__in=[flowcell.pk for flowcell in updated])
+                .select_for_update()
+                .values_list("pk", flat=True)
+            )
+            updated = [flowcell for flowcell in updated if flowcell.pk in outdated]
+            models.FlowCell.objects.bulk_update(updated, models.FLOWCELL_ERROR_CACHE_FIELDS)
+            models.invalidate_row_fragments(*[flowcell.pk for flowcell in updated])
+            models.update_flowcell_summaries(*[flowcell.pk for flowcell in updated])
+        self.num_updated += len(updated)
+
+    def _report(self, done, total, elapsed, last_pk):
+        rate = done / max(elapsed, 1e-9)
+        remaining = max(total - done, 0) / rate if rate else 0
+        self.progress(
+            "%d/%d flow cell(s) done, %.1f/s, ETA %s, last pk %d"
+            % (done, total, rate, time.strftime("%H:%M:%S", time.gmtime(remaining)), last_pk)
+        )
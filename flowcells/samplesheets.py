@@ -0,0 +1,307 @@
+"""Generation of the sample sheets of flow cells for the demultiplexing software.
+
+Sample sheets are generated on demand by the download views (``views.FlowCellSampleSheetView`` and
+``api.views.FlowCellSampleSheetApiView``) and streamed line by line.  The complete sheets are kept in the
+cache under the modification stamps of the flow cell, its sequencer, libraries, and barcodes (see
+``get_sample_sheet_stamps()``), so unchanged sheets are not generated again.
+
+The formats are listed in ``SAMPLE_SHEET_FORMATS``.  Picard barcode files are written for one lane, all
+other formats for all lanes unless a lane is given.
+"""
+
+import hashlib
+import typing
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import OuterRef
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+
+from digestiflow.utils import last_modified, object_count
+from .models import FlowCell, Library
+
+#: Prefix of the cache keys of the generated sample sheets.
+CACHE_PREFIX = "flowcells:samplesheet"
+
+
+class SampleSheetFormat(typing.NamedTuple):
+    """Description of a sample sheet format."""
+
+    #: Title to display.
+    title: str
+    #: Suffix of the downloaded file name.
+    suffix: str
+    #: Function yielding the lines of the sheet for flow cell, libraries, and lane (or ``None``).
+    build: typing.Callable
+    #: Whether the sheet can only be generated for one lane.
+    per_lane: bool = False
+
+
+def _join(delimiter, row):
+    return delimiter.join(map(str, row)) + "\n"
+
+
+def _join_lines(delimiter, rows):
+    """Yield ``rows`` joined by ``delimiter`` and separated by newlines, without a trailing newline."""
+    for i, row in enumerate(rows):
+        yield ("\n" if i else "") + delimiter.join(map(str, row))
+
+
+def _iter_lanes(libraries, lane):
+    """Yield pairs of lane number and library, restricted to ``lane`` unless ``None``."""
+    for lib in libraries:
+        for lane_no in sorted(lib.lane_numbers):
+            if lane is None or lane_no == lane:
+                yield lane_no, lib
+
+
+def build_bcl2fastq_v1(flowcell, libraries, lane):
+    """Yield lines of a tab-separated bcl2fastq v1 (``configureBclToFastq.pl``) sample sheet.
+
+    The last line has no trailing newline and a missing operator is written as "None", as in the sheets
+    shown on the flow cell page before.
+    """
+    header = [
+        "FCID",
+        "Lane",
+        "SampleID",
+        "SampleRef",
+        "Index",
+        "Description",
+        "Control",
+        "Recipe",
+        "Operator",
+        "SampleProject",
+    ]
+    recipe = "PE_Indexing" if flowcell.is_paired else "SE_indexing"
+
+    def rows():
+        yield header
+        for lane_no, lib in _iter_lanes(libraries, lane):
+            if lib.get_barcode_seq2():
+                barcode = "{}-{}".format(lib.get_barcode_seq(), lib.get_barcode_seq2())
+            else:
+                barcode = lib.get_barcode_seq()
+            yield [
+                flowcell.vendor_id,
+                lane_no,
+                lib.name,
+                lib.reference,
+                barcode,
+                "",
+                "N",  # not PhiX
+                recipe,
+                flowcell.operator,
+                "Project",
+            ]
+
+    yield from _join_lines("\t", rows())
+
+
+def build_bcl2fastq_v2(flowcell, libraries, lane):
+    """Yield lines of a bcl2fastq v2 (Illumina Experiment Manager) sample sheet.
+
+    A missing operator is written as "None", as in the sheets shown on the flow cell page before.
+    """
+    yield from (
+        _join(",", row)
+        for row in (
+            ["[Header]"],
+            ["IEMFileVersion", "4"],
+            ["Investigator Name", flowcell.operator],
+            ["Experiment Name", "Project"],
+            ["Date", flowcell.run_date.strftime("%y/%m/%d")],
+            ["Workflow", "GenerateFASTQ"],
+            ["Applications", "FASTQ Only"],
+            ["Assay", "TruSeq HT"],
+            ["Description", ""],
+            [],
+            ["[Reads]"],
+        )
+    )
+    for count, letter in flowcell.get_planned_reads_tuples():
+        if letter == "T":
+            yield _join(",", [count])
+    yield from (
+        _join(",", row)
+        for row in (
+            [],
+            ["[Data]"],
+            [
+                "Lane",
+                "Sample_ID",
+                "Sample_Name",
+                "Sample_Plate",
+                "Sample_Well",
+                "i7_Index_ID",
+                "index",
+                "Sample_Project",
+                "Description",
+            ],
+        )
+    )
+    for lane_no, lib in _iter_lanes(libraries, lane):
+        yield _join(
+            ",",
+            [
+                lane_no,
+                lib.name,
+                "",
+                "",
+                "",
+                lib.barcode.name if lib.barcode else "",
+                lib.barcode.sequence if lib.barcode else "",
+                "Project",
+                "",
+            ],
+        )
+
+
+def build_bcl_convert(flowcell, libraries, lane):
+    """Yield lines of a BCL Convert (sample sheet v2) sample sheet.
+
+    BCL Convert reverse-complements the second index itself for the dual indexing workflow B, so it is
+    written as entered.
+    """
+    yield "[Header]\n"
+    yield "FileFormatVersion,2\n"
+    yield _join(",", ["RunName", flowcell.vendor_id])
+    yield "\n[Reads]\n"
+    counts = {"T": [], "B": []}
+    for count, letter in flowcell.get_planned_reads_tuples():
+        counts.setdefault(letter, []).append(count)
+    for prefix, letter in (("Read", "T"), ("Index", "B")):
+        for number, count in enumerate(counts[letter][:2], 1):
+            yield _join(",", ["%s%dCycles" % (prefix, number), count])
+    yield "\n[BCLConvert_Settings]\n"
+    yield "FastqCompressionFormat,gzip\n"
+    yield "\n[BCLConvert_Data]\n"
+    yield "Lane,Sample_ID,Index,Index2\n"
+    for lane_no, lib in _iter_lanes(libraries, lane):
+        yield _join(
+            ",",
+            [
+                lane_no,
+                lib.name,
+                lib.get_barcode_seq() or "",
+                lib.get_barcode_seq2(revcomp_if_needed=False) or "",
+            ],
+        )
+
+
+def build_picard(flowcell, libraries, lane):
+    """Yield lines of a Picard ``ExtractIlluminaBarcodes`` barcode file for ``lane``."""
+    rows = [
+        (lib.get_barcode_seq() or "", lib.get_barcode_seq2() or "", lib.name)
+        for _, lib in _iter_lanes(libraries, lane)
+    ]
+    if any(seq2 for _, seq2, _ in rows):
+        yield "barcode_sequence_1\tbarcode_sequence_2\tbarcode_name\tlibrary_name\n"
+        for seq, seq2, name in rows:
+            yield _join("\t", [seq, seq2, name, name])
+    else:
+        yield "barcode_sequence_1\tbarcode_name\tlibrary_name\n"
+        for seq, _, name in rows:
+            yield _join("\t", [seq, name, name])
+
+
+#: The sample sheet formats by the names used in the URLs.
+SAMPLE_SHEET_FORMATS = {
+    "bcl2fastq-v1": SampleSheetFormat("bcl2fastq v1", "_bcl2fastq_v1.csv", build_bcl2fastq_v1),
+    "bcl2fastq-v2": SampleSheetFormat("bcl2fastq v2", "_bcl2fastq_v2.csv", build_bcl2fastq_v2),
+    "bcl-convert": SampleSheetFormat("BCL Convert", "_bcl_convert.csv", build_bcl_convert),
+    "picard": SampleSheetFormat("Picard", "_picard_barcodes.txt", build_picard, per_lane=True),
+}
+
+
+def get_sheet_lane(flowcell, name, value):
+    """Return the lane number given as string ``value`` for the sample sheet of ``flowcell`` in format
+    ``name``, ``None`` for all lanes.
+
+    Raise ``ValueError`` if the lane is invalid or missing for a format written per lane.
+    """
+    if not value:
+        if SAMPLE_SHEET_FORMATS[name].per_lane:
+            raise ValueError("The %s format requires a lane." % SAMPLE_SHEET_FORMATS[name].title)
+        return None
+    try:
+        lane = int(value)
+    except ValueError:
+        lane = 0
+    if not 1 <= lane <= flowcell.num_lanes:
+        raise ValueError("Lane must be a number between 1 and %d." % flowcell.num_lanes)
+    return lane
+
+
+def get_sample_sheet_stamps(flowcell):
+    """Return tuple of values changing with the sample sheets of ``flowcell``, computed in one query.
+
+    These are the modification dates of the flow cell, its sequencer (index workflow), libraries, and
+    barcodes, and the number of libraries (for deletions).
+    """
+    libraries = Library.objects.filter(flow_cell=OuterRef("pk"))
+    return (
+        FlowCell.objects.filter(pk=flowcell.pk)
+        .values_list(
+            "date_modified",
+            "sequencing_machine__date_modified",
+            last_modified(libraries),
+            object_count(libraries),
+            last_modified(libraries, "barcode__date_modified"),
+            last_modified(libraries, "barcode2__date_modified"),
+        )
+        .first()
+    )
+
+
+def iter_sample_sheet(flowcell, name, lane=None, stamps=None):
+    """Yield the lines of the sample sheet of ``flowcell`` in format ``name``, see module documentation.
+
+    ``flowcell`` should come with its sequencer.  The sheet is taken from the cache if the ``stamps`` (by
+    default from ``get_sample_sheet_stamps()``) did not change, otherwise it is generated from the libraries
+    loaded in one query and stored in the cache once complete.
+    """
+    if stamps is None:
+        stamps = get_sample_sheet_stamps(flowcell)
+    key = "%s:%s:%s" % (
+        CACHE_PREFIX,
+        name,
+        hashlib.sha1(repr((flowcell.pk, lane, tuple(stamps))).encode("utf-8")).hexdigest(),
+    )
+    content = cache.get(key)
+    if content is not None:
+        yield content
+        return
+    # The related manager sets ``flow_cell`` of the libraries, so the sequencer is not loaded per library.
+    libraries = flowcell.libraries.select_related("barcode", "barcode2")
+    lines = []
+    for line in SAMPLE_SHEET_FORMATS[name].build(flowcell, libraries, lane):
+        lines.append(line)
+        yield line
+    cache.set(key, "".join(lines), settings.FLOWCELLS_SAMPLE_SHEET_CACHE_TIMEOUT)
+
+
+def sample_sheet_response(request, flowcell, name, lane=None):
+    """Return streaming response with the sample sheet of ``flowcell`` for download.
+
+    The response carries an ``ETag`` derived from the stamps and conditional requests with an unchanged
+    sheet are answered with status 304.
+    """
+    stamps = get_sample_sheet_stamps(flowcell)
+    key = repr((flowcell.pk, name, lane, tuple(stamps)))
+    etag = '"%s"' % hashlib.sha1(key.encode("utf-8")).hexdigest()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = StreamingHttpResponse(
+            iter_sample_sheet(flowcell, name, lane, stamps),
+            content_type="text/plain; charset=utf-8",
+        )
+        filename = "%s%s%s" % (
+            flowcell.vendor_id,
+            "" if lane is None else "_L%03d" % lane,
+            SAMPLE_SHEET_FORMATS[name].suffix,
+        )
+        response["Content-Disposition"] = 'attachment; filename="%s"' % filename
+    response["ETag"] = etag
+    return response
@@ -0,0 +1,89 @@
+"""Index structures for fast lookups of barcode sequences."""
+
+import bisect
+
+
+class PrefixIndex:
+    """Index over barcode sequences for answering "is ``query`` a prefix of an entry or vice versa".
+
+    Answers the same question as ``flowcells.models.prefix_match()`` but instead of scanning all entries,
+    the entries are kept in a sorted array and a hash set.  A query is answered by looking up each prefix
+    of the query that has the length of an indexed sequence in the hash set (entry is prefix of query) and
+    a single ``bisect`` in the sorted array (query is prefix of entry).  Thus, a query takes
+    ``O(k + log n)`` time with ``k`` being the number of distinct entry lengths (usually one or two).
+
+    Build one index per lane and index read and re-use it for all queries.
+    """
+
+    def __init__(self, entries=()):
+        #: Sorted array of the distinct entries.
+        self._sorted = tuple(sorted(set(entries)))
+        #: Hash set of the distinct entries.
+        self._set = frozenset(self._sorted)
+        #: Sorted distinct lengths of the entries.
+        self._lengths = tuple(sorted({len(entry) for entry in self._sorted}))
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def __contains__(self, query):
+        return self.match(query)
+
+    def match(self, query):
+        """Return whether ``query`` is a prefix of an indexed sequence or vice versa."""
+        if not self._sorted:
+            return False
+        # Is an indexed sequence a prefix of the query (this includes equality)?
+        for length in self._lengths:
+            if length > len(query):
+                break
+            if query[:length] in self._set:
+                return True
+        # Is the query a prefix of an indexed sequence?  If so, the smallest indexed sequence not
+        # smaller than the query starts with it.
+        idx = bisect.bisect_left(self._sorted, query)
+        return idx < len(self._sorted) and self._sorted[idx].startswith(query)
+
+
+def one_mismatch_neighbours(seqs):
+    """Return dict from each sequence of ``seqs`` to sorted list of its neighbours in ``seqs``.
+
+    Two sequences are neighbours if they differ in at most one position when compared up to the length of
+    the shorter one (the sequence itself is not listed).  Instead of comparing all pairs, each sequence is
+    hashed with each of its positions replaced by a wildcard and, for sequences of different length, the
+    same is done for its prefixes of the lengths present in ``seqs``.  Sequences sharing a key are
+    neighbours, thus the running time is ``O(n * k * l)`` with ``n`` sequences of length ``l`` and ``k``
+    distinct lengths instead of ``O(n^2 * l)``.
+    """
+    seqs = set(seqs)
+    lengths = sorted({len(seq) for seq in seqs})
+
+    def keys(prefix):
+        yield prefix
+        for i in range(len(prefix)):
+            yield prefix[:i] + "*" + prefix[i + 1 :]
+
+    buckets = {}
+    for seq in seqs:
+        for length in lengths:
+            if length > len(seq):
+                break
+            for key in keys(seq[:length]):
+                buckets.setdefault((length, key), []).append(seq)
+
+    result = {}
+    for seq in seqs:
+        neighbours = set()
+        for length in lengths:
+            if length > len(seq):
+                break
+            for key in keys(seq[:length]):
+                if length == len(seq):  # compare to longer or equally long sequences
+                    neighbours.update(buckets[(length, key)])
+                else:  # compare to shorter sequences
+                    neighbours.update(
+                        other for other in buckets[(length, key)] if len(other) == length
+                    )
+        neighbours.discard(seq)
+        result[seq] = list(sorted(neighbours))
+    return result
@@ -1,16 +1,222 @@
+import contextlib
+import datetime
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
-from django.db.models import Q
+from django.utils import timezone
 from celery.schedules import crontab
 
 from config.celery import app
-from . import models
+from . import models, rebuild
 
+logger = logging.getLogger(__name__)
 
-@app.task(bind=True)
-def flowcell_update_error_caches(_self, flowcell_pk):
-    """Update the (reverse) index and sample sheet caches of the flowcell with the given pk."""
+#: Time (in seconds) that the state of a pending error cache update is kept after the quiet period.
+ERROR_CACHE_UPDATE_GRACE_PERIOD = 5 * 60
+
+#: Time (in seconds) after which the lock of a pending error cache update state expires.
+ERROR_CACHE_UPDATE_LOCK_TIMEOUT = 10
+
+#: Time (in seconds) between attempts to take the lock of a pending error cache update state.
+ERROR_CACHE_UPDATE_LOCK_POLL = 0.01
+
+#: Time (in seconds) after which a bulk rebuild task stops starting new chunks and continues in a new task,
+#: below the soft time limit of the tasks.
+BULK_REBUILD_TIME_BUDGET = 45
+
+
+def _error_cache_update_key(flowcell_pk):
+    """Return cache key for the pending error cache update state of the flow cell with the given pk."""
+    return "flowcells:error_cache_update:%d" % flowcell_pk
+
+
+@contextlib.contextmanager
+def _error_cache_update_lock(flowcell_pk):
+    """Hold the lock of the pending error cache update state of the flow cell with the given pk.
+
+    The state is read, changed, and written back by ``schedule_error_cache_update()`` and the task, which
+    must not interleave.  The lock is taken with the atomic ``cache.add()`` and expires after
+    ``ERROR_CACHE_UPDATE_LOCK_TIMEOUT`` seconds, after which waiters go ahead without it.  If the cache is
+    unavailable, ``cache.add()`` returns ``None`` with the ``IGNORE_EXCEPTIONS`` option of django-redis and
+    the caller goes ahead at once instead of waiting for the timeout.  The state cannot be read then either,
+    such that each request enqueues its own task.
+    """
+    key = _error_cache_update_key(flowcell_pk) + ":lock"
+    owner = str(uuid.uuid4())
+    deadline = time.monotonic() + ERROR_CACHE_UPDATE_LOCK_TIMEOUT
+    while True:
+        added = cache.add(key, owner, ERROR_CACHE_UPDATE_LOCK_TIMEOUT)
+        if added:
+            break
+        elif added is None:
+            logger.warning(
+                "Cache unavailable, proceeding without error cache update lock of flow cell %d",
+                flowcell_pk,
+            )
+            break
+        elif time.monotonic() > deadline:
+            logger.warning(
+                "Proceeding without error cache update lock of flow cell %d", flowcell_pk
+            )
+            break
+        time.sleep(ERROR_CACHE_UPDATE_LOCK_POLL)
+    try:
+        yield
+    finally:
+        if cache.get(key) == owner:
+            cache.delete(key)
+
+
+def _merge_scope(lhs, rhs):
+    """Merge two lists of lanes or index read numbers with ``None`` meaning "all"."""
+    if lhs is None or rhs is None:
+        return None
+    return list(sorted(set(lhs) | set(rhs)))
+
+
+def _enqueue_error_cache_update(flowcell_pk, state):
+    """Enqueue the task for the pending update ``state`` after the quiet period."""
+    flowcell_update_error_caches.apply_async(
+        (flowcell_pk,),
+        {
+            "lanes": state["lanes"],
+            "index_read_nos": state["index_read_nos"],
+            "token": state["token"],
+        },
+        countdown=settings.FLOWCELLS_ERROR_CACHE_UPDATE_DELAY,
+    )
+
+
+def schedule_error_cache_update(flowcell_pk, lanes=None, index_read_nos=None):
+    """Schedule an update of the error caches of the flow cell with the given pk.
+
+    At most one update is pending per flow cell.  It runs after the quiet period of
+    ``settings.FLOWCELLS_ERROR_CACHE_UPDATE_DELAY`` seconds and all requests arriving until then are
+    absorbed by it, merging their ``lanes`` and ``index_read_nos``.  Requests arriving while the update is
+    running are merged as well, the task then runs again for them.  A state that is older than its timeout
+    is left behind by a task that was killed and replaced by a new one.
+
+    Return whether a new task was enqueued.
+    """
+    key = _error_cache_update_key(flowcell_pk)
+    timeout = settings.FLOWCELLS_ERROR_CACHE_UPDATE_DELAY + ERROR_CACHE_UPDATE_GRACE_PERIOD
+    with _error_cache_update_lock(flowcell_pk):
+        pending = cache.get(key)
+        if pending is not None and time.time() - pending["created"] > timeout:
+            logger.warning("Replacing orphaned error cache update of flow cell %d", flowcell_pk)
+            lanes = _merge_scope(pending["lanes"], lanes)
+            index_read_nos = _merge_scope(pending["index_read_nos"], index_read_nos)
+            pending = None
+        if pending is None:
+            state = {
+                "token": str(uuid.uuid4()),
+                "lanes": _merge_scope(lanes, []),
+                "index_read_nos": _merge_scope(index_read_nos, []),
+                "absorbed": 0,
+                "revision": 0,
+                "created": time.time(),
+            }
+        else:
+            state = dict(
+                pending,
+                lanes=_merge_scope(pending["lanes"], lanes),
+                index_read_nos=_merge_scope(pending["index_read_nos"], index_read_nos),
+                absorbed=pending["absorbed"] + 1,
+                revision=pending["revision"] + 1,
+            )
+        cache.set(key, state, timeout)
+    # Enqueued outside of the lock as eager tasks take it themselves.
+    if pending is None:
+        _enqueue_error_cache_update(flowcell_pk, state)
+    return pending is None
+
+
+def _update_error_caches(flowcell_pk, lanes, index_read_nos):
+    """Update the error caches of the flow cell with the given pk for the given partitions."""
     with transaction.atomic():
-        models.FlowCell.objects.get(pk=flowcell_pk).update_error_caches().save()
+        flowcell = models.FlowCell.objects.select_for_update().get(pk=flowcell_pk)
+        flowcell.update_error_caches(lanes=lanes, index_read_nos=index_read_nos).save_error_caches()
+
+
+@app.task(bind=True)
+def flowcell_update_error_caches(_self, flowcell_pk, lanes=None, index_read_nos=None, token=None):
+    """Update the (reverse) index and sample sheet caches of the flowcell with the given pk.
+
+    Pass ``lanes`` and/or ``index_read_nos`` for only updating the errors of these partitions.  The
+    ``token`` is passed by ``schedule_error_cache_update()``, the task then takes the merged partitions
+    from the pending update state and is dropped if it does not own the state any more.  The state is
+    kept while the update runs.  It is removed afterwards if unchanged, otherwise the task is enqueued
+    again for the requests merged in the meantime.  This also happens if the update fails, such that
+    later requests are not merged into the state of a task that is gone.
+
+    Return number of absorbed update requests or ``None`` if dropped or the flow cell does not exist.
+    """
+    absorbed = 0
+    revision = None
+    if token is not None:
+        key = _error_cache_update_key(flowcell_pk)
+        with _error_cache_update_lock(flowcell_pk):
+            state = cache.get(key)
+        if state is None:
+            # State expired, the merged partitions are unknown.
+            lanes = index_read_nos = None
+        elif state["token"] != token:
+            logger.info("Dropping stale error cache update for flow cell %d", flowcell_pk)
+            return None
+        else:
+            lanes, index_read_nos, absorbed, revision = (
+                state["lanes"],
+                state["index_read_nos"],
+                state["absorbed"],
+                state["revision"],
+            )
+    requeue = True
+    try:
+        _update_error_caches(flowcell_pk, lanes, index_read_nos)
+    except models.FlowCell.DoesNotExist:
+        logger.info("Dropping error cache update for deleted flow cell %d", flowcell_pk)
+        requeue = False
+        absorbed = None
+    finally:
+        if revision is not None:
+            _release_error_cache_update(flowcell_pk, token, revision, requeue)
+    if absorbed:
+        logger.info(
+            "Error cache update for flow cell %d absorbed %d request(s)", flowcell_pk, absorbed
+        )
+    return absorbed
+
+
+def _release_error_cache_update(flowcell_pk, token, revision, requeue):
+    """Remove the pending update state owned by ``token`` after the task ran.
+
+    If ``requeue`` and requests were merged into the state since ``revision``, the task is enqueued again
+    for them instead.
+    """
+    key = _error_cache_update_key(flowcell_pk)
+    state = None
+    with _error_cache_update_lock(flowcell_pk):
+        pending = cache.get(key)
+        if pending is not None and pending["token"] == token:
+            if not requeue or pending["revision"] == revision:
+                cache.delete(key)
+            else:
+                # Merge requests arrived while running, these may not be seen by the update.
+                state = dict(
+                    pending, token=str(uuid.uuid4()), absorbed=0, revision=0, created=time.time()
+                )
+                cache.set(
+                    key,
+                    state,
+                    settings.FLOWCELLS_ERROR_CACHE_UPDATE_DELAY + ERROR_CACHE_UPDATE_GRACE_PERIOD,
+                )
+    if state is not None:
+        logger.info("Requeueing error cache update for flow cell %d", flowcell_pk)
+        _enqueue_error_cache_update(flowcell_pk, state)
 
 
 @app.task(bind=True)
@@ -19,20 +225,48 @@ def flowcell_update_outdated_error_caches(_self):
 
     Returns list of background tasks.
     """
-    objects = models.FlowCell.objects.filter(
-        Q(error_caches_version__isnull=True)
-        | Q(error_caches_version__lt=models.FLOWCELL_ERROR_CACHE_VERSION)
-    )
+    objects = rebuild.outdated_error_caches_queryset()
     result = []
     for obj in objects:
         result.append(flowcell_update_error_caches.delay(obj.pk))
     return tuple(result)
 
 
+@app.task(bind=True)
+def flowcell_rebuild_outdated_error_caches(self, after_pk=None):
+    """Rebuild the error caches of all flow cells with missing or outdated caches in chunks.
+
+    Unlike ``flowcell_update_outdated_error_caches()``, this does not spawn one task per flow cell.  After
+    ``BULK_REBUILD_TIME_BUDGET`` seconds, the task continues in a new task starting after the last
+    processed flow cell.
+
+    Return the number of updated flow cells.
+    """
+    rebuilder = rebuild.ErrorCacheRebuilder()
+    last_pk = rebuilder.run(after_pk, deadline=time.monotonic() + BULK_REBUILD_TIME_BUDGET)
+    if last_pk is not None:
+        self.apply_async(kwargs={"after_pk": last_pk})
+    return rebuilder.num_updated
+
+
+@app.task(bind=True)
+def flowcell_purge_tombstones(_self):
+    """Delete the tombstones older than ``settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS``.
+
+    Return the number of deleted tombstones.
+    """
+    threshold = timezone.now() - datetime.timedelta(
+        days=settings.FLOWCELLS_TOMBSTONE_RETENTION_DAYS
+    )
+    return models.Tombstone.objects.filter(date_deleted__lt=threshold).delete()[0]
+
+
 @app.on_after_finalize.connect
 def setup_periodic_tasks(sender, **_kwargs):
     """Register periodic tasks"""
     # Update the error message caches hourly, if necessary.
     sender.add_periodic_task(
-        schedule=crontab(minute=11), sig=flowcell_update_outdated_error_caches.s()
+        schedule=crontab(minute=11), sig=flowcell_rebuild_outdated_error_caches.s()
     )
+    # Purge expired tombstones daily.
+    sender.add_periodic_task(schedule=crontab(hour=3, minute=17), sig=flowcell_purge_tombstones.s())
@@ -68,6 +68,15 @@ $(function () {
     content: urlPopOverContent,
   })
   $('*[data-toggle-url]').click(urlToggle)
+
+  // Tabs of the flow cell detail page are loaded later.
+  $(document).on('flowcell-tab-loaded', function (event, container) {
+    container.find('.popover-form-container *[data-popover-url]').popover({
+      html: true,
+      content: urlPopOverContent,
+    })
+    container.find('*[data-toggle-url]').click(urlToggle)
+  })
 })
 
 
@@ -98,4 +107,11 @@ $(function () {
     html: true,
     content: urlPopOverContent,
   })
+
+  $(document).on('flowcell-tab-loaded', function (event, container) {
+    container.find('.index-histograms-table *[data-popover-url]').popover({
+      html: true,
+      content: urlPopOverContent,
+    })
+  })
 })
@@ -1,10 +1,12 @@
 import itertools
 
 from django import template
+from django.conf import settings
 from django.db.models import Q
 from django.utils.safestring import mark_safe
 
 from .. import bases_mask
+from ..rows import load_row_data, select_row_data
 from ..models import (
     FlowCell,
     REFERENCE_CHOICES,
@@ -83,9 +85,24 @@ def count_barcode_reads(flow_cell):
 
 
 @register.simple_tag
-def get_details_flowcells(project):
-    """Return sequencers for the project details page"""
-    return FlowCell.objects.filter(project=project)[:5]
+def get_details_flowcells(project, user):
+    """Return flow cells for the project details page, with the row data for ``user``"""
+    return load_row_data(list(select_row_data(FlowCell.objects.filter(project=project))[:5]), user)
+
+
+@register.simple_tag
+def get_row_cache_timeout():
+    """Return the timeout of the cached flow cell list rows"""
+    return settings.FLOWCELLS_ROW_CACHE_TIMEOUT
+
+
+@register.simple_tag
+def get_row_data(flowcell, user):
+    """Return the ``FlowCellRowData`` of ``flowcell`` for ``user``, loaded for the single flow cell unless
+    loaded for the whole list"""
+    if not hasattr(flowcell, "row_data"):
+        load_row_data([flowcell], user)
+    return flowcell.row_data
 
 
 REF_CHOICE_MAP = dict(REFERENCE_CHOICES)
@@ -282,10 +299,4 @@ def format_basemask(x):
 
 @register.simple_tag
 def get_adapter_siblings(flowcell, seq):
-    max_dist = 1
-    seqs = flowcell.get_cached_adapter_seqs()
-    result = []
-    for s in seqs:
-        if len([x for x, y in zip(seq, s) if x != y]) <= max_dist:
-            result.append(s)
-    return result
+    return flowcell.get_adapter_siblings(seq)
@@ -117,17 +117,18 @@ class SetupFlowCellMixin:
         return {"file": tmpf}
 
     def make_flow_cell(self, **kwargs):
-        return FlowCell.objects.create(
-            project=self.project,
-            run_date=datetime.date.today(),
-            sequencing_machine=self.hiseq2000,
-            run_number=3,
-            slot="A",
-            vendor_id="Hasdfasdf",
-            label="a_third_flow_cell",
-            description="Let's see, the third.",
-            **kwargs,
-        )
+        values = {
+            "project": self.project,
+            "run_date": datetime.date.today(),
+            "sequencing_machine": self.hiseq2000,
+            "run_number": 3,
+            "slot": "A",
+            "vendor_id": "Hasdfasdf",
+            "label": "a_third_flow_cell",
+            "description": "Let's see, the third.",
+        }
+        values.update(kwargs)
+        return FlowCell.objects.create(**values)
 
     def make_library(self, flow_cell=None):
         return (flow_cell or self.flow_cell).libraries.create(
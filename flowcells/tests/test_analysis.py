@@ -0,0 +1,111 @@
+import random
+
+import numpy as np
+from test_plus.test import TestCase
+
+from ..analysis import encode_seqs, HistogramTable, SeqSet
+from ..models import LaneIndexHistogram
+from ..seq_index import PrefixIndex
+
+
+class EncodeSeqsTest(TestCase):
+    """Tests for ``encode_seqs()``"""
+
+    def testEncode(self):
+        codes, valid = encode_seqs(["AAAA", "ACGT", "TTTT", "ACNT", "ACäT"], 4)
+        self.assertEqual(codes[:3].tolist(), [0, 0b00011011, 0b11111111])
+        self.assertEqual(valid.tolist(), [True, True, True, False, False])
+
+    def testEncodeLong(self):
+        codes, valid = encode_seqs(["T" * 32], 32)
+        self.assertEqual(codes.tolist(), [2**64 - 1])
+        self.assertEqual(valid.tolist(), [True])
+
+
+class SeqSetTest(TestCase):
+    """Tests for ``SeqSet``"""
+
+    def _query(self, seq_set, seqs, method):
+        codes, valid = encode_seqs(seqs, len(seqs[0]))
+        assert valid.all()
+        return getattr(seq_set, method)(codes, len(seqs[0])).tolist()
+
+    def testContains(self):
+        seq_set = SeqSet(["ACGT", "ACG", "ACNT"])
+        self.assertEqual(self._query(seq_set, ["ACGT", "ACGA"], "contains"), [True, False])
+        self.assertEqual(self._query(seq_set, ["ACG", "ACA"], "contains"), [True, False])
+        self.assertEqual(self._query(seq_set, ["AC"], "contains"), [False])
+
+    def testMatchPrefix(self):
+        seq_set = SeqSet(["ACGT", "TTNNA"])
+        self.assertEqual(
+            self._query(seq_set, ["ACGTA", "ACGAA", "TTCAA"], "match_prefix"),
+            [True, False, False],
+        )
+        self.assertEqual(
+            self._query(seq_set, ["AC", "TT", "GG"], "match_prefix"), [True, True, False]
+        )
+
+    def testMatchPrefixEmpty(self):
+        self.assertEqual(self._query(SeqSet([""]), ["ACGT"], "match_prefix"), [True])
+        self.assertEqual(self._query(SeqSet([]), ["ACGT"], "match_prefix"), [False])
+
+    def testEquivalentToPrefixIndex(self):
+        """Test that ``match_prefix()`` agrees with ``PrefixIndex`` on random data"""
+        rng = random.Random(1)
+
+        def make(alphabet):
+            return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 6)))
+
+        for _ in range(50):
+            entries = [make("ACGN") for _ in range(rng.randint(0, 10))]
+            index = PrefixIndex(entries)
+            seq_set = SeqSet(entries)
+            for length in range(1, 7):
+                queries = list({make("ACG").ljust(length, "A")[:length] for _ in range(20)})
+                codes, _ = encode_seqs(queries, length)
+                self.assertEqual(
+                    seq_set.match_prefix(codes, length).tolist(),
+                    [index.match(query) for query in queries],
+                    (queries, entries),
+                )
+                self.assertEqual(
+                    seq_set.contains(codes, length).tolist(),
+                    [query in entries for query in queries],
+                )
+
+
+class HistogramTableTest(TestCase):
+    """Tests for ``HistogramTable``"""
+
+    def setUp(self):
+        self.histograms = [
+            LaneIndexHistogram(
+                lane=1, index_read_no=1, sample_size=100, histogram={"ACGT": 50, "AC": 10}
+            ),
+            LaneIndexHistogram(lane=2, index_read_no=2, sample_size=10, histogram={"ACNT": 5}),
+        ]
+
+    def testColumns(self):
+        table = HistogramTable(self.histograms)
+        self.assertEqual(len(table), 3)
+        self.assertEqual(table.seqs, ["ACGT", "AC", "ACNT"])
+        self.assertEqual(table.slices, [slice(0, 2), slice(2, 3)])
+        self.assertEqual(table.lane.tolist(), [1, 1, 2])
+        self.assertEqual(table.index_read_no.tolist(), [1, 1, 2])
+        self.assertEqual(table.hist_no.tolist(), [0, 0, 1])
+        self.assertEqual(table.fraction().tolist(), [0.5, 0.1, 0.5])
+
+    def testEncode(self):
+        table = HistogramTable(self.histograms)
+        encoded = table.encode(np.arange(3))
+        self.assertEqual(list(sorted(encoded)), [2, 4])
+        rows, codes, valid = encoded[4]
+        self.assertEqual(rows.tolist(), [0, 2])
+        self.assertEqual(codes[0], 0b00011011)
+        self.assertEqual(valid.tolist(), [True, False])
+
+    def testEmpty(self):
+        table = HistogramTable([])
+        self.assertEqual(len(table), 0)
+        self.assertEqual(table.encode(np.flatnonzero(table.fraction() > 0)), {})
@@ -0,0 +1,91 @@
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+from test_plus.test import TestCase
+
+from barcodes.tests import SetupBarcodeSetMixin
+from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
+from sequencers.tests import SetupSequencingMachineMixin
+
+from ..api.serializers import FlowCellReadSerializer, FlowCellSerializer
+from ..models import FlowCell
+from ..tests import SetupFlowCellMixin
+
+
+class FlowCellReadSerializerTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Contract tests for the ``values()`` based flow cell serializer, its output must be the output of
+    ``FlowCellSerializer``"""
+
+    def setUp(self):
+        super().setUp()
+        other = self.make_flow_cell(
+            demux_operator=self.user,
+            manual_label=None,
+            lanes_suppress_no_sample_sheet_warning=[2],
+        )
+        other.libraries.create(name="no barcodes", lane_numbers=[1], rank=1)
+        other.libraries.create(
+            name="first barcode", barcode=self.barcode_set_entry, lane_numbers=[1, 2], rank=0
+        )
+        with override_settings(FLOWCELLS_HISTOGRAM_PACKED=False):
+            other.index_histograms.create(
+                lane=2, index_read_no=2, sample_size=100, histogram={"ACGT": 60, "TTTT": 40}
+            )
+        other.messages.create(author=self.user, subject="subject", body="body")
+        self.factory = APIRequestFactory()
+
+    def render(self, serializer_class, data=None, instance=None):
+        """Return JSON of the flow cells of the project (or ``instance``) rendered through
+        ``serializer_class`` for a request with the query parameters ``data``."""
+        context = {"request": Request(self.factory.get("/", data or {})), "project": self.project}
+        if instance is None:
+            queryset = FlowCell.objects.filter(project=self.project)
+            serializer = serializer_class(queryset, many=True, context=context)
+        else:
+            serializer = serializer_class(instance, context=context)
+        return JSONRenderer().render(serializer.data)
+
+    def testList(self):
+        """Test that the full list matches"""
+        expected = self.render(FlowCellSerializer)
+        self.assertIn(b'"demux_operator":"author"', expected)
+        self.assertEqual(self.render(FlowCellReadSerializer), expected)
+
+    def testListOfInstances(self):
+        """Test that the list of flow cell objects, e.g., a page, matches"""
+        flowcells = list(FlowCell.objects.filter(project=self.project).only("pk"))
+        context = {"request": Request(self.factory.get("/")), "project": self.project}
+        self.assertEqual(
+            JSONRenderer().render(
+                FlowCellReadSerializer(flowcells, many=True, context=context).data
+            ),
+            self.render(FlowCellSerializer),
+        )
+
+    def testListSparse(self):
+        """Test that the list matches with sparse fieldsets"""
+        for data in (
+            {"fields": "sodar_uuid,run_date,demux_operator,libraries"},
+            {"expand": "messages,index_histograms"},
+            {"expand": ""},
+            {"fields": "vendor_id", "expand": "libraries"},
+        ):
+            self.assertEqual(
+                self.render(FlowCellReadSerializer, data), self.render(FlowCellSerializer, data)
+            )
+
+    def testDetail(self):
+        """Test that the representation of a single flow cell matches"""
+        for flowcell in FlowCell.objects.all():
+            self.assertEqual(
+                self.render(FlowCellReadSerializer, instance=flowcell),
+                self.render(FlowCellSerializer, instance=flowcell),
+            )
@@ -1,16 +1,59 @@
 # TODO: check timeline events
 
+import datetime
 import json
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.utils import timezone
+from django.test.utils import CaptureQueriesContext
 from test_plus.test import APITestCase
 
 from barcodes.tests import SetupBarcodeSetMixin
 from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin, AuthenticatedRequestMixin
 from filesfolders.models import File
+from sequencers.models import SequencingMachine
 from sequencers.tests import SetupSequencingMachineMixin
-from ..models import FlowCell, LaneIndexHistogram, Message
+from ..models import (
+    FlowCell,
+    LaneIndexHistogram,
+    Library,
+    Message,
+    Tombstone,
+    TOMBSTONE_INDEX_HISTOGRAM,
+)
+from ..api.views import FlowCellListCreateApiView
 from ..tests import SetupFlowCellMixin
 
 
+def backdate_objects():
+    """Move the modification dates of all flow cells, their objects, and sequencers an hour back."""
+    for model in (FlowCell, LaneIndexHistogram, Library, Message, SequencingMachine):
+        model.objects.update(date_modified=F("date_modified") - datetime.timedelta(hours=1))
+
+
+class LookupCountMixin:
+    """Count the queries looking up objects by UUID, each object should be looked up once per request."""
+
+    def countLookups(self, func):
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return {
+            table: len(
+                [
+                    query
+                    for query in queries
+                    if query["sql"].startswith("SELECT")
+                    and '"%s"."sodar_uuid" = ' % table in query["sql"]
+                ]
+            )
+            for table in ("projectroles_project", "flowcells_flowcell", "flowcells_message")
+        }
+
+
 class FlowCellListCreateApiViewTest(
     SetupFlowCellMixin,
     SetupSequencingMachineMixin,
@@ -18,12 +61,20 @@ class FlowCellListCreateApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for creation of barcode sets using REST API"""
 
     url_name = "api:flowcells"
 
+    def testGetLookups(self):
+        """Test that the project is looked up once per request"""
+        lookups = self.countLookups(lambda: self.response_200(self.runGet(self.root)))
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 0, "flowcells_message": 0}
+        )
+
     def testGet(self):
         """Test that querying API for the machine list works (with super user)"""
         response = self.runGet(self.root)
@@ -31,6 +82,246 @@ class FlowCellListCreateApiViewTest(
         data = json.loads(response.content.decode("utf-8"))
         self.assertEqual(len(data), 1)
 
+    def testGetPaginated(self):
+        """Test that the list is paginated by modification date if a page size is given"""
+        other = self.make_flow_cell()
+        response = self.runGet(self.root, data={"page_size": 1})
+        self.response_200(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            [item["sodar_uuid"] for item in data["results"]], [str(self.flow_cell.sodar_uuid)]
+        )
+        self.assertIsNone(data["previous"])
+        with self.login(self.root):
+            response = self.client.get(data["next"])
+        self.response_200(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([item["sodar_uuid"] for item in data["results"]], [str(other.sodar_uuid)])
+        self.assertIsNone(data["next"])
+
+    def testGetStream(self):
+        """Test that the streamed list is the regular list, also when loaded in several chunks"""
+        self.make_flow_cell()
+        for data in ({}, {"fields": "sodar_uuid,vendor_id"}):
+            expected = self.runGet(self.root, data=data).content
+            with mock.patch.object(FlowCellListCreateApiView, "stream_chunk_size", 1):
+                response = self.runGet(self.root, data={"stream": "1", **data})
+                self.response_200(response)
+                self.assertTrue(response.streaming)
+                content = b"".join(response.streaming_content)
+            self.assertEqual(len(json.loads(content.decode("utf-8"))), 2)
+            self.assertEqual(content, expected)
+
+    def testGetStreamEmpty(self):
+        """Test that the streamed list of a project without flow cells is empty"""
+        FlowCell.objects.all().delete()
+        response = self.runGet(self.root, data={"stream": "1"})
+        self.response_200(response)
+        self.assertEqual(b"".join(response.streaming_content), b"[]")
+
+    def testGetFields(self):
+        """Test that only the requested fields are returned"""
+        response = self.runGet(self.root, data={"fields": "sodar_uuid,status_conversion"})
+        self.response_200(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            data, [{"sodar_uuid": str(self.flow_cell.sodar_uuid), "status_conversion": "initial"}]
+        )
+
+    def testGetExpand(self):
+        """Test that nested fields are only returned if expanded"""
+        response = self.runGet(self.root, data={"expand": "libraries"})
+        self.response_200(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertIn("vendor_id", data[0])
+        self.assertEqual(len(data[0]["libraries"]), 1)
+        self.assertNotIn("index_histograms", data[0])
+        self.assertNotIn("messages", data[0])
+
+    def testGetExpandNone(self):
+        """Test that an empty ``expand`` skips all nested fields, without querying them"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.runGet(self.root, data={"expand": ""})
+        self.response_200(response)
+        self.assertFalse(
+            [query for query in queries if '"flowcells_library"' in query["sql"]]
+            + [query for query in queries if '"flowcells_laneindexhistogram"' in query["sql"]]
+        )
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertFalse({"libraries", "index_histograms", "messages"} & set(data[0]))
+
+    def testGetUnknownField(self):
+        """Test that unknown fields are rejected"""
+        response = self.runGet(self.root, data={"fields": "sodar_uuid,foo", "expand": "bar"})
+        self.response_400(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            data, {"fields": "Unknown field(s): foo", "expand": "Unknown field(s): bar"}
+        )
+
+    def getUuids(self, data):
+        response = self.runGet(self.root, data={"fields": "sodar_uuid", **data})
+        self.response_200(response)
+        return [item["sodar_uuid"] for item in json.loads(response.content.decode("utf-8"))]
+
+    def testGetFiltered(self):
+        """Test that the list is filtered by the filter query parameters"""
+        other = self.make_flow_cell(
+            run_date=datetime.date(2019, 2, 1),
+            sequencing_machine=SequencingMachine.objects.create(
+                project=self.project, vendor_id="Hzzzzzzzz", label="Other"
+            ),
+            demux_operator=self.user,
+        )
+        first, second = str(self.flow_cell.sodar_uuid), str(other.sodar_uuid)
+        for data, expected in (
+            ({}, [second, first]),
+            ({"run_date_after": "2019-01-19"}, [second]),
+            ({"run_date_before": "2019-01-18"}, [first]),
+            ({"sequencing_machine": "Hzzzzzzzz"}, [second]),
+            ({"vendor_id": "Hasdfghijkl"}, [first]),
+            ({"label": "a_third_flow_cell"}, [second]),
+            ({"demux_operator": "author"}, [second]),
+            ({"demux_operator": "author", "run_date_before": "2019-01-31"}, []),
+        ):
+            self.assertEqual(self.getUuids(data), expected, data)
+        modified = FlowCell.objects.get(pk=self.flow_cell.pk).date_modified
+        self.assertEqual(self.getUuids({"modified_before": modified.isoformat()}), [first])
+        self.assertEqual(
+            self.getUuids({"modified_after": other.date_modified.isoformat()}), [second]
+        )
+
+    def testGetOrdered(self):
+        """Test that the list is ordered by the ``ordering`` query parameter"""
+        other = self.make_flow_cell(run_date=datetime.date(2019, 2, 1))
+        first, second = str(self.flow_cell.sodar_uuid), str(other.sodar_uuid)
+        self.assertEqual(self.getUuids({"ordering": "run_date"}), [first, second])
+        self.assertEqual(self.getUuids({"ordering": "-run_date"}), [second, first])
+        self.assertEqual(self.getUuids({"ordering": "vendor_id"}), [second, first])
+        self.assertEqual(self.getUuids({"ordering": "date_modified"}), [first, second])
+
+    def testGetFilterInvalid(self):
+        """Test that invalid filter and ordering parameters are rejected"""
+        response = self.runGet(self.root, data={"run_date_after": "yesterday", "ordering": "slot"})
+        self.response_400(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(set(data), {"run_date_after", "ordering"})
+        response = self.runGet(self.root, data={"ordering": "run_date", "page_size": 10})
+        self.response_400(response)
+
+    def testGetFilterIndexes(self):
+        """Test that the queries of the filters use the composite indexes of ``FlowCell``"""
+        machines = [
+            SequencingMachine.objects.create(
+                project=self.project, vendor_id="M%03d" % i, label="Machine %d" % i
+            )
+            for i in range(50)
+        ]
+        FlowCell.objects.bulk_create(
+            FlowCell(
+                project=self.project,
+                run_date=datetime.date(2015, 1, 1) + datetime.timedelta(days=i // 2),
+                sequencing_machine=machines[i % len(machines)],
+                run_number=i,
+                slot="A",
+                vendor_id="V%05d" % i,
+                label="label_%05d" % i,
+                demux_operator=self.user if i % 100 == 0 else None,
+            )
+            for i in range(5000)
+        )
+        with connection.cursor() as cursor:
+            for model in (FlowCell, SequencingMachine, get_user_model()):
+                cursor.execute("ANALYZE %s" % model._meta.db_table)
+        indexes = {tuple(index.fields): index.name for index in FlowCell._meta.indexes}
+        tomorrow = timezone.now() + datetime.timedelta(days=1)
+        for data, index, column in (
+            ({"run_date_after": "2021-10-01"}, indexes["project", "run_date"], '"run_date" >='),
+            (
+                {"sequencing_machine": "M007", "run_date_after": "2021-10-01"},
+                indexes["project", "sequencing_machine", "run_date"],
+                'U0."vendor_id" =',
+            ),
+            ({"vendor_id": "V00042"}, indexes["project", "vendor_id"], '"vendor_id" ='),
+            ({"label": "label_00042"}, indexes["project", "label"], '"label" ='),
+            # Served by the index of the foreign key.
+            (
+                {"demux_operator": "author"},
+                r"flowcells_flowcell_demux_operator_id_\w+",
+                'U0."username" =',
+            ),
+            (
+                {"modified_after": tomorrow.isoformat()},
+                indexes["project", "date_modified"],
+                '"date_modified" >=',
+            ),
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                self.getUuids(data)
+            (sql,) = [
+                query["sql"]
+                for query in queries
+                if column in query["sql"].partition(" WHERE ")[2]
+                and '"flowcells_flowcell"."id" IN' not in query["sql"]
+            ]
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN " + sql)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            self.assertRegex(plan, r"Index Scan .*\b%s\b" % index, data)
+
+    def testGetNotModified(self):
+        """Test that a request with the current ETag is answered with 304 without serialization"""
+        response = self.runGet(self.root)
+        self.response_200(response)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.runGet(self.root, extra={"HTTP_IF_NONE_MATCH": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if '"flowcells_library"."' in query["sql"]])
+
+    def testGetModified(self):
+        """Test that the ETag changes with the flow cells, their objects, deletions, and query"""
+        etags = [self.runGet(self.root)["ETag"]]
+        self.library.name = "TWO"
+        self.library.save()
+        etags.append(self.runGet(self.root)["ETag"])
+        self.library.delete()
+        etags.append(self.runGet(self.root)["ETag"])
+        etags.append(self.runGet(self.root, data={"expand": ""})["ETag"])
+        self.assertEqual(len(set(etags)), 4)
+        response = self.runGet(self.root, extra={"HTTP_IF_NONE_MATCH": etags[0]})
+        self.response_200(response)
+        self.assertEqual(response["ETag"], etags[2])
+
+    def testGetModifiedOperator(self):
+        """Test that the ETag changes with the name of a demultiplexing operator"""
+        self.flow_cell.demux_operator = self.user
+        self.flow_cell.save()
+        etag = self.runGet(self.root)["ETag"]
+        self.user.username = "renamed"
+        self.user.save()
+        self.assertNotEqual(self.runGet(self.root)["ETag"], etag)
+
+    def testGetIfModifiedSince(self):
+        """Test that ``If-Modified-Since`` is answered based on the last modification in the project"""
+        backdate_objects()
+        response = self.runGet(self.root)
+        self.response_200(response)
+        last_modified = response["Last-Modified"]
+        response = self.runGet(self.root, extra={"HTTP_IF_MODIFIED_SINCE": last_modified})
+        self.assertEqual(response.status_code, 304)
+        self.flow_cell.delete()
+        response = self.runGet(self.root, extra={"HTTP_IF_MODIFIED_SINCE": last_modified})
+        self.response_200(response)
+        # Changes in the same second would not be visible in the header.
+        self.assertNotIn("Last-Modified", response)
+
+    def testGetNotModifiedAccessDenied(self):
+        """Test that access is denied with the current ETag if role assignment is missing"""
+        etag = self.runGet(self.root)["ETag"]
+        for user in (self.norole, self.unrelated_owner):
+            self.runGet(user, extra={"HTTP_IF_NONE_MATCH": etag})
+            self.response_403()
+
     def testGetAccessDenied(self):
         """Test that access is denied if role assignment is missing"""
         self.runGet(None)
@@ -79,12 +370,23 @@ class FlowCellUpdateApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for detail view, update, delete of barcode sets using REST API"""
 
     url_name = "api:flowcells"
 
+    def testGetLookups(self):
+        """Test that project and flow cell are looked up once per request, besides the modification
+        stamps of the flow cell"""
+        lookups = self.countLookups(
+            lambda: self.response_200(self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid))
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 2, "flowcells_message": 0}
+        )
+
     def testGet(self):
         """Test that querying API for the barcode set list works (with super user)"""
         response = self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid)
@@ -92,6 +394,68 @@ class FlowCellUpdateApiViewTest(
         data = json.loads(response.content.decode("utf-8"))
         self.assertEqual(data["sodar_uuid"], str(self.flow_cell.sodar_uuid))
 
+    def testGetNotModified(self):
+        """Test that a request with the current ETag is answered with 304 without serialization"""
+        response = self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid)
+        self.response_200(response)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.runGet(
+                self.root,
+                flowcell=self.flow_cell.sodar_uuid,
+                extra={"HTTP_IF_NONE_MATCH": response["ETag"]},
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if '"flowcells_library"."' in query["sql"]])
+
+    def testGetModified(self):
+        """Test that the ETag changes with the flow cell, its objects, their deletion, and the query"""
+
+        def get_etag(**kwargs):
+            return self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid, **kwargs)["ETag"]
+
+        etags = [get_etag()]
+        self.flow_cell.description = "changed"
+        self.flow_cell.save()
+        etags.append(get_etag())
+        self.library.name = "TWO"
+        self.library.save()
+        etags.append(get_etag())
+        self.library.delete()
+        etags.append(get_etag())
+        etags.append(get_etag(data={"fields": "sodar_uuid"}))
+        self.assertEqual(len(set(etags)), 5)
+
+    def testGetModifiedOperator(self):
+        """Test that the ETag changes with the name of the demultiplexing operator"""
+        self.flow_cell.demux_operator = self.user
+        self.flow_cell.save()
+        etag = self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid)["ETag"]
+        self.user.username = "renamed"
+        self.user.save()
+        self.assertNotEqual(
+            self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid)["ETag"], etag
+        )
+
+    def testGetIfModifiedSince(self):
+        """Test that ``If-Modified-Since`` is answered based on the last modification of the flow cell"""
+        backdate_objects()
+        response = self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid)
+        self.response_200(response)
+        last_modified = response["Last-Modified"]
+        response = self.runGet(
+            self.root,
+            flowcell=self.flow_cell.sodar_uuid,
+            extra={"HTTP_IF_MODIFIED_SINCE": last_modified},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.library.delete()
+        response = self.runGet(
+            self.root,
+            flowcell=self.flow_cell.sodar_uuid,
+            extra={"HTTP_IF_MODIFIED_SINCE": last_modified},
+        )
+        self.response_200(response)
+
     def testGetAccessDenied(self):
         """Test that access is denied if role assignment is missing"""
         self.runGet(None, flowcell=self.flow_cell.sodar_uuid)
@@ -172,12 +536,29 @@ class FlowCellResolveApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for resolving a flow cell by instrument name, run no, and flowcell name"""
 
     url_name = "api:flowcells-resolve"
 
+    def testGetLookups(self):
+        """Test that the project is looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_200(
+                self.runGet(
+                    self.root,
+                    instrument_id=self.hiseq2000.vendor_id,
+                    run_no=self.flow_cell.run_number,
+                    flowcell_id=self.flow_cell.vendor_id,
+                )
+            )
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 0, "flowcells_message": 0}
+        )
+
     def testGet(self):
         """Test that resolving flow cell works (as super user)"""
         response = self.runGet(
@@ -222,6 +603,282 @@ class FlowCellResolveApiViewTest(
             self.assertEqual(data["sodar_uuid"], str(self.flow_cell.sodar_uuid))
 
 
+class FlowCellChangesApiViewTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    AuthenticatedRequestMixin,
+    LookupCountMixin,
+    APITestCase,
+):
+    """Tests for listing changes of flow cells and their objects since a token"""
+
+    url_name = "api:flowcells-changes"
+
+    def testGetLookups(self):
+        """Test that the project is looked up once per request"""
+        lookups = self.countLookups(lambda: self.response_200(self.runGet(self.root)))
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 0, "flowcells_message": 0}
+        )
+
+    def _get_changes(self, since=None):
+        response = self.runGet(self.root, data={} if since is None else {"since": since})
+        self.response_200(response)
+        return json.loads(response.content.decode("utf-8"))
+
+    def _age(self, days=0, seconds=0):
+        """Move the modification and deletion dates of all objects into the past"""
+        delta = datetime.timedelta(days=days, seconds=seconds)
+        for model in (FlowCell, Library, LaneIndexHistogram, Message):
+            model.objects.update(date_modified=F("date_modified") - delta)
+        Tombstone.objects.update(date_deleted=F("date_deleted") - delta)
+
+    def testGetAll(self):
+        """Test that all objects are listed without a token"""
+        data = self._get_changes()
+        self.assertEqual(
+            [item["sodar_uuid"] for item in data["flowcells"]], [str(self.flow_cell.sodar_uuid)]
+        )
+        self.assertNotIn("libraries", data["flowcells"][0])
+        self.assertEqual(
+            [(item["sodar_uuid"], item["flow_cell"]) for item in data["libraries"]],
+            [(str(self.library.sodar_uuid), str(self.flow_cell.sodar_uuid))],
+        )
+        self.assertEqual(len(data["index_histograms"]), 4)
+        self.assertEqual(len(data["messages"]), 2)
+        self.assertEqual(data["deleted"], [])
+        self.assertTrue(data["token"])
+
+    @override_settings(FLOWCELLS_CHANGES_OVERLAP=60)
+    def testGetChangedSince(self):
+        """Test that only objects changed or deleted after the token are listed"""
+        token = self._get_changes()["token"]
+        self._age(seconds=120)
+        self.library.barcode_seq = "CCCCCCCC"
+        self.library.save()
+        self.histograms[0].delete()
+        data = self._get_changes(token)
+        self.assertEqual(data["flowcells"], [])
+        self.assertEqual([item["barcode_seq"] for item in data["libraries"]], ["CCCCCCCC"])
+        self.assertEqual(data["index_histograms"], [])
+        self.assertEqual(data["messages"], [])
+        self.assertEqual(
+            [(item["object_type"], item["object_uuid"]) for item in data["deleted"]],
+            [(TOMBSTONE_INDEX_HISTOGRAM, str(self.histograms[0].sodar_uuid))],
+        )
+        # The next token overlaps with this response.
+        data = self._get_changes(data["token"])
+        self.assertEqual(len(data["libraries"]), 1)
+        self.assertEqual(len(data["deleted"]), 1)
+        self._age(seconds=120)
+        data = self._get_changes(data["token"])
+        self.assertEqual((data["libraries"], data["deleted"]), ([], []))
+
+    def testGetRecreated(self):
+        """Test that objects re-created with the same UUID are not listed as deleted"""
+        token = self._get_changes()["token"]
+        library_uuid = self.library.sodar_uuid
+        self.library.delete()
+        self.flow_cell.libraries.create(
+            sodar_uuid=library_uuid, name="ONE", barcode_seq="ACGTACGT", lane_numbers=[1]
+        )
+        data = self._get_changes(token)
+        self.assertEqual([item["sodar_uuid"] for item in data["libraries"]], [str(library_uuid)])
+        self.assertEqual(data["deleted"], [])
+
+    def testGetInvalidToken(self):
+        """Test that invalid tokens are rejected"""
+        response = self.runGet(self.root, data={"since": "yesterday"})
+        self.response_400(response)
+
+    @override_settings(FLOWCELLS_TOMBSTONE_RETENTION_DAYS=30)
+    def testGetExpiredToken(self):
+        """Test that tokens older than the tombstone retention are rejected"""
+        token = self._get_changes()["token"]
+        with mock.patch(
+            "django.utils.timezone.now",
+            return_value=timezone.now() + datetime.timedelta(days=31),
+        ):
+            response = self.runGet(self.root, data={"since": token})
+        self.assertEqual(response.status_code, 410)
+
+    def testGetAccessDenied(self):
+        """Test that access is denied if role assignment is missing"""
+        self.runGet(None)
+        self.response_401()
+        for user in (self.norole, self.unrelated_owner):
+            self.runGet(user)
+            self.response_403()
+
+    def testGetAccessAllowed(self):
+        """Test that access is allowed if role assignment is correct"""
+        for user in (self.guest, self.contributor, self.delegate, self.owner, self.root):
+            response = self.runGet(user)
+            self.response_200(response)
+
+
+class LibraryListUpsertApiViewTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    AuthenticatedRequestMixin,
+    LookupCountMixin,
+    APITestCase,
+):
+    """Tests for listing and bulk updating libraries using REST API"""
+
+    url_name = "api:libraries"
+
+    def testGetLookups(self):
+        """Test that project and flow cell are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_200(self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid))
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 0}
+        )
+
+    def testPutLookups(self):
+        """Test that project and flow cell are looked up once per request"""
+        lookups = self.countLookups(lambda: self.response_200(self._put(self.root, self.rows)))
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 0}
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.rows = [
+            {
+                "sodar_uuid": str(self.library.sodar_uuid),
+                "name": "RENAMED",
+                "barcode": str(self.barcode_set_entry.sodar_uuid),
+                "lane_numbers": [1, 2],
+            },
+            {"name": "NEW", "barcode_seq": "ACGTACGT", "lane_numbers": [5]},
+        ]
+
+    def _put(self, user, rows):
+        return self.runPut(
+            user,
+            flowcell=self.flow_cell.sodar_uuid,
+            data=json.dumps(rows),
+            extra={"content_type": "application/json"},
+        )
+
+    def testGet(self):
+        """Test that listing the libraries works (with super user)"""
+        response = self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid)
+        self.response_200(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            [(item["sodar_uuid"], item["flow_cell"]) for item in data],
+            [(str(self.library.sodar_uuid), str(self.flow_cell.sodar_uuid))],
+        )
+
+    def testPut(self):
+        """Test that libraries are updated in place, created, and scheduled for error cache update"""
+        with mock.patch("flowcells.api.views.schedule_error_cache_update") as schedule:
+            response = self._put(self.root, self.rows)
+        self.response_200(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual([item["name"] for item in data], ["RENAMED", "NEW"])
+        self.assertEqual(data[0]["sodar_uuid"], str(self.library.sodar_uuid))
+        self.assertEqual(data[0]["barcode"], str(self.barcode_set_entry.sodar_uuid))
+        self.assertEqual(self.flow_cell.libraries.count(), 2)
+        schedule.assert_called_once_with(self.flow_cell.pk, lanes=[1, 2, 3, 4, 5])
+
+    def testPutUnknownBarcode(self):
+        """Test that unknown barcodes are rejected without changes"""
+        self.rows[1]["barcode2"] = "00000000-0000-0000-0000-000000000000"
+        response = self._put(self.root, self.rows)
+        self.response_400(response)
+        self.assertEqual(
+            list(self.flow_cell.libraries.values_list("name", flat=True)), [self.library.name]
+        )
+
+    def testPutInvalid(self):
+        """Test that invalid rows are rejected"""
+        response = self._put(self.root, [{"name": "NO_LANES"}])
+        self.response_400(response)
+
+    def testPutAccessDenied(self):
+        """Test that updating libraries is denied if role assignment is missing"""
+        self._put(None, self.rows)
+        self.response_401()
+        for user in (self.guest, self.norole, self.unrelated_owner):
+            self._put(user, self.rows)
+            self.response_403()
+
+    def testPutAccessAllowed(self):
+        """Test that updating libraries is allowed if role assignment is correct"""
+        for user in (self.contributor, self.delegate, self.owner, self.root):
+            response = self._put(user, self.rows)
+            self.response_200(response)
+
+
+class FlowCellSampleSheetApiViewTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    AuthenticatedRequestMixin,
+    APITestCase,
+):
+    """Tests for downloading sample sheets using REST API"""
+
+    url_name = "api:flowcells-samplesheet"
+
+    def _get(self, user, sheet_format, **kwargs):
+        return self.runGet(
+            user, flowcell=self.flow_cell.sodar_uuid, sheet_format=sheet_format, **kwargs
+        )
+
+    def testGet(self):
+        """Test that the sample sheet is streamed"""
+        for accept in ("*/*", "text/plain"):
+            response = self._get(self.root, "bcl-convert", extra={"HTTP_ACCEPT": accept})
+            self.response_200(response)
+            content = b"".join(response.streaming_content).decode("utf-8")
+            self.assertTrue(
+                content.endswith(
+                    "\n[BCLConvert_Data]\nLane,Sample_ID,Index,Index2\n"
+                    "1,ONE,AAAAAAAA,AAAAAAAA\n2,ONE,AAAAAAAA,AAAAAAAA\n3,ONE,AAAAAAAA,AAAAAAAA\n"
+                    "4,ONE,AAAAAAAA,AAAAAAAA\n"
+                )
+            )
+
+    def testGetInvalid(self):
+        """Test that invalid lanes and formats are rejected"""
+        response = self._get(self.root, "picard", data={"lane": 9})
+        self.response_400(response)
+        self.assertEqual(list(response.json()), ["lane"])
+        self.response_404(self._get(self.root, "bcl2fastq-v3"))
+
+    def testGetInvalidPlainText(self):
+        """Test that errors are returned as plain text to clients accepting it"""
+        response = self._get(
+            self.root, "picard", data={"lane": 9}, extra={"HTTP_ACCEPT": "text/plain"}
+        )
+        self.response_400(response)
+        self.assertEqual(response["Content-Type"], "text/plain; charset=utf-8")
+        self.assertEqual(response.content, b"lane: Lane must be a number between 1 and 8.\n")
+        response = self._get(self.root, "bcl2fastq-v3", extra={"HTTP_ACCEPT": "text/plain"})
+        self.response_404(response)
+        self.assertEqual(response.content, b"Unknown sample sheet format\n")
+
+    def testGetAccessDenied(self):
+        """Test that downloading sample sheets is denied if role assignment is missing"""
+        self.response_401(self._get(None, "bcl2fastq-v2"))
+        for user in (self.norole, self.unrelated_owner):
+            self.response_403(self._get(user, "bcl2fastq-v2"))
+
+
 class LaneIndexHistogramListCreateApiViewTest(
     SetupFlowCellMixin,
     SetupSequencingMachineMixin,
@@ -229,12 +886,37 @@ class LaneIndexHistogramListCreateApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for creation of lane index histogram entries using REST API"""
 
     url_name = "api:indexhistos"
 
+    def testGetLookups(self):
+        """Test that project and flow cell are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_200(self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid))
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 0}
+        )
+
+    def testPostLookups(self):
+        """Test that project and flow cell are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_201(
+                self.runPost(
+                    self.root,
+                    flowcell=self.flow_cell.sodar_uuid,
+                    data=self.lane_index_histo_api_post_data,
+                )
+            )
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 0}
+        )
+
     def testGet(self):
         """Test that querying API for the lane index histograms works (with super user)"""
         response = self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid)
@@ -267,6 +949,21 @@ class LaneIndexHistogramListCreateApiViewTest(
         data = json.loads(response.content.decode("utf-8"))
         self.assertIn("sodar_uuid", data)
 
+    @override_settings(FLOWCELLS_INDEX_HISTOGRAM_TOP_K=2)
+    def testPostReduced(self):
+        """Test that rare sequences beyond the top K are aggregated on creation"""
+        histogram = {"ACGT": 9000, "CGTA": 900, "GTAC": 50, "TACG": 40, "CCAA": 10}
+        data = dict(self.lane_index_histo_api_post_data, histogram=json.dumps(histogram))
+        response = self.runPost(self.root, flowcell=self.flow_cell.sodar_uuid, data=data)
+        self.response_201(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(data["histogram"], {"ACGT": 9000, "CGTA": 900})
+        self.assertEqual(data["other_count"], 100)
+        self.assertEqual(data["other_num_sequences"], 3)
+        histo = LaneIndexHistogram.objects.get(sodar_uuid=data["sodar_uuid"])
+        self.assertEqual(histo.histogram, {"ACGT": 9000, "CGTA": 900})
+        self.assertEqual((histo.other_count, histo.other_num_sequences), (100, 3))
+
     def testPostAccessDenied(self):
         """Test that creating lane index histograms via API is denied if role assignment is missing"""
         self.runPost(
@@ -291,6 +988,131 @@ class LaneIndexHistogramListCreateApiViewTest(
             LaneIndexHistogram.objects.filter(sodar_uuid=data["sodar_uuid"]).delete()
 
 
+class LaneIndexHistogramBatchApiViewTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    AuthenticatedRequestMixin,
+    LookupCountMixin,
+    APITestCase,
+):
+    """Tests for creating and updating all lane index histograms of a flow cell using REST API"""
+
+    url_name = "api:indexhistos-batch"
+
+    def testPostLookups(self):
+        """Test that project and flow cell are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_201(self._post(self.root, self._make_histograms([1, 2])))
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 0}
+        )
+
+    def _make_histograms(self, lanes, sample_size=2000):
+        return [
+            {
+                "lane": lane,
+                "index_read_no": index_read_no,
+                "sample_size": sample_size,
+                "histogram": {"ACGTACGT": 1500, "TTTTTTTT": 500},
+            }
+            for lane in lanes
+            for index_read_no in (1, 2)
+        ]
+
+    def _post(self, user, histograms):
+        return self.runPost(
+            user,
+            flowcell=self.flow_cell.sodar_uuid,
+            data=json.dumps(histograms),
+            extra={"content_type": "application/json"},
+        )
+
+    def testPost(self):
+        """Test that histograms are created and updated with one error cache update"""
+        old_uuid = self.histograms[0].sodar_uuid
+        with mock.patch("flowcells.api.serializers.schedule_error_cache_update") as schedule:
+            response = self._post(self.root, self._make_histograms(range(1, 9)))
+        self.response_201(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(len(data), 16)
+        self.assertEqual(data[0]["sodar_uuid"], str(old_uuid))
+        self.assertEqual(data[0]["histogram"], {"ACGTACGT": 1500, "TTTTTTTT": 500})
+        schedule.assert_called_once_with(
+            self.flow_cell.pk, lanes=list(range(1, 9)), index_read_nos=[1, 2]
+        )
+        self.assertEqual(self.flow_cell.index_histograms.count(), 16)
+        histo = LaneIndexHistogram.objects.get(sodar_uuid=old_uuid)
+        self.assertEqual((histo.sample_size, histo.index_read_no), (2000, 1))
+        self.assertEqual(histo.histogram, {"ACGTACGT": 1500, "TTTTTTTT": 500})
+        self.assertGreater(histo.date_modified, self.histograms[0].date_modified)
+
+    @override_settings(FLOWCELLS_INDEX_HISTOGRAM_TOP_K=1)
+    def testPostReducedKeepsSheetBarcodes(self):
+        """Test that rare sequences matching the sample sheet barcodes are kept on reduction"""
+        histogram = {"ACGTACGT": 1990, "CCCCCCCC": 5, "AAAAAAAA": 3, "TTTTTTTT": 2}
+        histograms = [dict(h, histogram=histogram) for h in self._make_histograms(range(1, 5))]
+        with mock.patch("flowcells.api.serializers.schedule_error_cache_update"):
+            response = self._post(self.root, histograms)
+        self.response_201(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(data[0]["histogram"], {"ACGTACGT": 1990, "AAAAAAAA": 3})
+        self.assertEqual((data[0]["other_count"], data[0]["other_num_sequences"]), (7, 2))
+        self.flow_cell.update_error_caches().save()
+        flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        errors = flow_cell.get_reverse_index_errors()[str(self.library.sodar_uuid)]
+        self.assertFalse([msg for msg in errors["barcode"] if "not found in adapters" in msg])
+
+    @override_settings(FLOWCELLS_INDEX_HISTOGRAM_TOP_K=1)
+    def testPostReducedKeepsBarcodeLists(self):
+        """Test that rare sequences of comma-separated sample sheet barcodes are kept on reduction"""
+        self.flow_cell.libraries.create(
+            name="CHROMIUM", barcode_seq="AAAACCCC,GGGGTTTT", lane_numbers=[5]
+        )
+        histogram = {"ACGTACGT": 1990, "CCCCCCCC": 5, "GGGGTTTT": 3}
+        histograms = [dict(h, histogram=histogram) for h in self._make_histograms([5])]
+        with mock.patch("flowcells.api.serializers.schedule_error_cache_update"):
+            response = self._post(self.root, histograms)
+        self.response_201(response)
+        data = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(
+            [hist["histogram"] for hist in data],
+            [{"ACGTACGT": 1990, "GGGGTTTT": 3}, {"ACGTACGT": 1990}],
+        )
+
+    def testPostConstantQueries(self):
+        """Test that the number of queries does not depend on the number of histograms"""
+        counts = []
+        for lanes in (range(1, 3), range(1, 9)):
+            with CaptureQueriesContext(connection) as queries, mock.patch(
+                "flowcells.api.serializers.schedule_error_cache_update"
+            ):
+                self.response_201(self._post(self.root, self._make_histograms(lanes)))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def testPostDuplicate(self):
+        """Test that duplicate lane and index read are rejected"""
+        response = self._post(self.root, self._make_histograms([1]) * 2)
+        self.response_400(response)
+
+    def testPostAccessDenied(self):
+        """Test that posting histograms is denied if role assignment is missing"""
+        self._post(None, self._make_histograms([1]))
+        self.response_401()
+        for user in (self.guest, self.norole, self.unrelated_owner):
+            self._post(user, self._make_histograms([1]))
+            self.response_403()
+
+    def testPostAccessAllowed(self):
+        """Test that posting histograms is allowed if role assignment is correct"""
+        for user in (self.contributor, self.delegate, self.owner, self.root):
+            self.response_201(self._post(user, self._make_histograms([1])))
+
+
 class LaneIndexHistogramUpdateDeleteApiViewTest(
     SetupFlowCellMixin,
     SetupSequencingMachineMixin,
@@ -298,12 +1120,28 @@ class LaneIndexHistogramUpdateDeleteApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for update and delete action using REST API"""
 
     url_name = "api:indexhistos"
 
+    def testGetLookups(self):
+        """Test that project and flow cell are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_200(
+                self.runGet(
+                    self.root,
+                    flowcell=self.flow_cell.sodar_uuid,
+                    indexhistogram=self.histograms[0].sodar_uuid,
+                )
+            )
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 0}
+        )
+
     def testGet(self):
         """Test that querying API for the index histograms works (with super user)"""
         response = self.runGet(
@@ -315,6 +1153,30 @@ class LaneIndexHistogramUpdateDeleteApiViewTest(
         data = json.loads(response.content.decode("utf-8"))
         self.assertEqual(data["sodar_uuid"], str(self.histograms[0].sodar_uuid))
 
+    def testGetPackedSameAsJson(self):
+        """Test that packed histograms render to the same bytes as JSON histograms"""
+        histogram = {"ACGTACGT": 500, "NNNNNNNN": 20, "ACGTACGA": 100, "ACGTAC": 3, "ACGTAN": 1}
+
+        def get_content():
+            response = self.runGet(
+                self.root,
+                flowcell=self.flow_cell.sodar_uuid,
+                indexhistogram=self.histograms[0].sodar_uuid,
+            )
+            self.response_200(response)
+            return response.content
+
+        with self.settings(FLOWCELLS_HISTOGRAM_PACKED=False):
+            self.histograms[0].histogram = histogram
+            self.histograms[0].save()
+        self.assertIsNone(LaneIndexHistogram.objects.get(pk=self.histograms[0].pk).histogram_packed)
+        content_json = get_content()
+
+        self.histograms[0].histogram = histogram
+        self.histograms[0].save()
+        self.assertIsNone(LaneIndexHistogram.objects.get(pk=self.histograms[0].pk).histogram_json)
+        self.assertEqual(get_content(), content_json)
+
     def testGetAccessDenied(self):
         """Test that access is denied if role assignment is missing"""
         self.runGet(
@@ -435,12 +1297,37 @@ class MessageListCreateApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for creation of messages using REST API"""
 
     url_name = "api:messages"
 
+    def testGetLookups(self):
+        """Test that project and flow cell are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_200(self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid))
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 0}
+        )
+
+    def testPostLookups(self):
+        """Test that project and flow cell are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_201(
+                self.runPost(
+                    self.root,
+                    flowcell=self.flow_cell.sodar_uuid,
+                    data=self.sent_message_api_post_data,
+                )
+            )
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 0}
+        )
+
     def testGet(self):
         """Test that querying API for the messages works (with super user)"""
         response = self.runGet(self.root, flowcell=self.flow_cell.sodar_uuid)
@@ -502,12 +1389,28 @@ class MessageUpdateDeleteApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for update and delete action using REST API"""
 
     url_name = "api:messages"
 
+    def testGetLookups(self):
+        """Test that project, flow cell, and message are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_200(
+                self.runGet(
+                    self.root,
+                    flowcell=self.flow_cell.sodar_uuid,
+                    message=self.sent_message.sodar_uuid,
+                )
+            )
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 1}
+        )
+
     def testGet(self):
         """Test that querying API for messages works (with super user)"""
         response = self.runGet(
@@ -625,12 +1528,44 @@ class AttachmentListCreateApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for creation of attachments using REST API"""
 
     url_name = "api:attachments"
 
+    def testGetLookups(self):
+        """Test that project, flow cell, and message are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_200(
+                self.runGet(
+                    self.root,
+                    flowcell=self.flow_cell.sodar_uuid,
+                    message=self.draft_message.sodar_uuid,
+                )
+            )
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 1}
+        )
+
+    def testPostLookups(self):
+        """Test that project, flow cell, and message are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_201(
+                self.runPost(
+                    self.root,
+                    flowcell=self.flow_cell.sodar_uuid,
+                    message=self.draft_message.sodar_uuid,
+                    data=self.get_file_post_data(),
+                )
+            )
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 1}
+        )
+
     def testGet(self):
         """Test that querying API for the attachments works (with super user)"""
         response = self.runGet(
@@ -712,12 +1647,29 @@ class AttachmentUpdateDeleteApiViewTest(
     SetupProjectMixin,
     SetupUserMixin,
     AuthenticatedRequestMixin,
+    LookupCountMixin,
     APITestCase,
 ):
     """Tests for update and delete action using REST API"""
 
     url_name = "api:attachments"
 
+    def testGetLookups(self):
+        """Test that project, flow cell, and message are looked up once per request"""
+        lookups = self.countLookups(
+            lambda: self.response_200(
+                self.runGet(
+                    self.root,
+                    flowcell=self.flow_cell.sodar_uuid,
+                    message=self.draft_message.sodar_uuid,
+                    file=self.attached_file.sodar_uuid,
+                )
+            )
+        )
+        self.assertEqual(
+            lookups, {"projectroles_project": 1, "flowcells_flowcell": 1, "flowcells_message": 1}
+        )
+
     def testGet(self):
         """Test that querying API for attachments works (with super user)"""
         response = self.runGet(
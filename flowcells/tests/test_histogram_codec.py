@@ -0,0 +1,46 @@
+import random
+
+from test_plus.test import TestCase
+
+from ..histogram_codec import jsonb_key, pack_histogram, unpack_histogram
+
+
+class HistogramCodecTest(TestCase):
+    """Tests for ``pack_histogram()`` and ``unpack_histogram()``"""
+
+    def testRoundTrip(self):
+        histogram = {"ACGTACGT": 500, "ACGTA": 3, "NNNNNNNN": 20, "acgt": 1, "": 7, "AC": 2**40}
+        self.assertEqual(unpack_histogram(pack_histogram(histogram)), histogram)
+
+    def testRoundTripEmpty(self):
+        self.assertEqual(unpack_histogram(pack_histogram({})), {})
+
+    def testJsonbKeyOrder(self):
+        """Test that decoded histograms use the key order of PostgreSQL ``jsonb``"""
+        histogram = {"ACGTACGT": 1, "TT": 2, "ACGN": 3, "ACGA": 4, "ÄCG": 5}
+        self.assertEqual(
+            list(unpack_histogram(pack_histogram(histogram))),
+            ["TT", "ACGA", "ACGN", "ÄCG", "ACGTACGT"],
+        )
+        self.assertEqual(
+            list(unpack_histogram(pack_histogram(histogram))), sorted(histogram, key=jsonb_key)
+        )
+
+    def testCannotPack(self):
+        for histogram in (None, [], {"ACGT": 1.0}, {"ACGT": -1}, {"ACGT": True}, {"A": 2**64}):
+            self.assertIsNone(pack_histogram(histogram), histogram)
+
+    def testUnpackInvalid(self):
+        with self.assertRaises(ValueError):
+            unpack_histogram(b"\x00")
+
+    def testRoundTripRandom(self):
+        rng = random.Random(1)
+        for _ in range(30):
+            histogram = {
+                "".join(rng.choice("ACGTN") for _ in range(rng.randint(0, 10))): rng.randint(
+                    0, 10 ** rng.randint(1, 12)
+                )
+                for _ in range(rng.randint(0, 50))
+            }
+            self.assertEqual(unpack_histogram(pack_histogram(histogram)), histogram)
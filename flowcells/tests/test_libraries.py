@@ -0,0 +1,125 @@
+from django.core.exceptions import ValidationError
+from test_plus.test import TestCase
+
+from barcodes.tests import SetupBarcodeSetMixin
+from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
+from sequencers.tests import SetupSequencingMachineMixin
+
+from ..libraries import upsert_libraries
+from ..models import Library, Tombstone
+from ..tests import SetupFlowCellMixin
+
+
+class UpsertLibrariesTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Tests for the bulk update of libraries from sample sheet rows"""
+
+    def _make_row(self, name, **kwargs):
+        return {
+            "name": name,
+            "project_id": "",
+            "barcode": str(self.barcode_set_entry.sodar_uuid),
+            "barcode_seq": "",
+            "barcode2": None,
+            "barcode_seq2": "ACGTACGT",
+            "lane_numbers": [1],
+            "demux_reads": "",
+            **kwargs,
+        }
+
+    def _get_libraries(self):
+        return list(self.flow_cell.libraries.order_by("rank"))
+
+    def testCreate(self):
+        """Test that new rows create libraries in row order"""
+        self.library.delete()
+        changed_lanes = upsert_libraries(
+            self.flow_cell, [self._make_row("A", lane_numbers=[1, 2]), self._make_row("B")]
+        )
+        self.assertEqual(changed_lanes, {1, 2})
+        libraries = self._get_libraries()
+        self.assertEqual([(lib.rank, lib.name) for lib in libraries], [(0, "A"), (1, "B")])
+        self.assertEqual(libraries[0].barcode, self.barcode_set_entry)
+        self.assertIsNone(libraries[0].barcode2)
+
+    def testUpdateByName(self):
+        """Test that libraries are matched by name and keep their UUID"""
+        changed_lanes = upsert_libraries(
+            self.flow_cell,
+            [self._make_row("NEW", lane_numbers=[5]), self._make_row("ONE", lane_numbers=[1, 2])],
+        )
+        self.assertEqual(changed_lanes, {1, 2, 3, 4, 5})
+        libraries = self._get_libraries()
+        self.assertEqual([lib.name for lib in libraries], ["NEW", "ONE"])
+        self.assertEqual(libraries[1].sodar_uuid, self.library.sodar_uuid)
+        self.assertEqual(libraries[1].pk, self.library.pk)
+        self.assertEqual(libraries[1].lane_numbers, [1, 2])
+        self.assertGreater(libraries[1].date_modified, self.library.date_modified)
+        self.assertFalse(Tombstone.objects.all())
+
+    def testUpdateByUuid(self):
+        """Test that libraries are matched by UUID, allowing renames"""
+        upsert_libraries(
+            self.flow_cell, [self._make_row("RENAMED", sodar_uuid=self.library.sodar_uuid)]
+        )
+        self.assertEqual(
+            [(lib.pk, lib.name) for lib in self._get_libraries()], [(self.library.pk, "RENAMED")]
+        )
+
+    def testUnchanged(self):
+        """Test that unchanged libraries are not written and no lanes are reported"""
+        row = self._make_row(
+            "ONE",
+            project_id=None,
+            barcode2=str(self.barcode_set_entry.sodar_uuid),
+            barcode_seq=None,
+            barcode_seq2=None,
+            lane_numbers=[1, 2, 3, 4],
+            demux_reads=None,
+            reference=self.library.reference,
+        )
+        self.flow_cell.libraries.update(rank=0)
+        with self.assertNumQueries(2):
+            self.assertEqual(upsert_libraries(self.flow_cell, [row]), set())
+        self.assertEqual(self._get_libraries()[0].date_modified, self.library.date_modified)
+
+    def testDelete(self):
+        """Test that libraries without row are deleted"""
+        self.assertEqual(upsert_libraries(self.flow_cell, []), {1, 2, 3, 4})
+        self.assertFalse(Library.objects.all())
+        self.assertEqual(Tombstone.objects.get().object_uuid, self.library.sodar_uuid)
+
+    def testConstantQueries(self):
+        """Test that the number of queries does not depend on the number of rows"""
+        rows = [self._make_row("LIB%d" % i) for i in range(50)]
+        upsert_libraries(self.flow_cell, rows)
+        rows = [self._make_row("LIB%d" % i, lane_numbers=[2]) for i in range(25, 100)]
+        # Fetch barcodes and libraries, delete (select, delete, one tombstone each), update, create, and
+        # lock and update the summary.
+        with self.assertNumQueries(2 + 2 + 25 + 1 + 1 + 2):
+            upsert_libraries(self.flow_cell, rows)
+        self.assertEqual(
+            [lib.name for lib in self._get_libraries()], ["LIB%d" % i for i in range(25, 100)]
+        )
+
+    def testUnknownBarcode(self):
+        """Test that unknown barcodes are rejected"""
+        with self.assertRaises(ValidationError):
+            upsert_libraries(
+                self.flow_cell,
+                [self._make_row("ONE", barcode="00000000-0000-0000-0000-000000000000")],
+            )
+
+    def testUnknownLibrary(self):
+        """Test that unknown library UUIDs are rejected"""
+        with self.assertRaises(ValidationError):
+            upsert_libraries(
+                self.flow_cell,
+                [self._make_row("ONE", sodar_uuid="00000000-0000-0000-0000-000000000000")],
+            )
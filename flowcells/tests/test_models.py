@@ -1,6 +1,10 @@
 import datetime
+from unittest import mock
 
 from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.shortcuts import reverse
 from projectroles.models import PROJECT_TAG_STARRED
 from test_plus.test import TestCase
@@ -11,16 +15,26 @@ from sequencers.tests import SetupSequencingMachineMixin
 from ..models import (
     pretty_range,
     prefix_match,
+    reduce_histogram,
     FlowCell,
     FlowCellTag,
     flow_cell_updated,
     flow_cell_created,
     KnownIndexContamination,
+    known_contamination_index,
     Library,
     Message,
     message_created,
+    FLOWCELL_ERROR_CACHE_FIELDS,
+    FLOWCELL_ERROR_CACHE_VERSION,
     FLOWCELL_TAG_WATCHING,
+    KNOWN_CONTAMINATIONS_TOKEN_KEY,
     STATUS_COMPLETE,
+    Tombstone,
+    TOMBSTONE_FLOWCELL,
+    TOMBSTONE_INDEX_HISTOGRAM,
+    TOMBSTONE_LIBRARY,
+    TOMBSTONE_MESSAGE,
 )
 from ..tests import SetupFlowCellMixin
 
@@ -44,6 +58,43 @@ class HelperFunctionsTest(TestCase):
         self.assertFalse(prefix_match("x12345", ["12345"]))
         self.assertFalse(prefix_match("x12345", ["123456"]))
 
+    def testReduceHistogram(self):
+        """Test for ``reduce_histogram()`` keeping top K and sequences above threshold"""
+        histogram = {"AAAA": 500, "CCCC": 300, "GGGG": 100, "TTTT": 5, "ACGT": 3, "TGCA": 2}
+        self.assertEqual(
+            reduce_histogram(histogram, 1000, 0.005, 1),
+            ({"AAAA": 500, "CCCC": 300, "GGGG": 100, "TTTT": 5}, 5, 2),
+        )
+        self.assertEqual(reduce_histogram(histogram, 1000, 0.001, 1), (histogram, 0, 0))
+        # The threshold is capped at ``THRESH_MIN_INDEX_FRAC`` to keep the sequences relevant for index errors.
+        self.assertEqual(
+            reduce_histogram(histogram, 1000, 0.5, 1),
+            ({"AAAA": 500, "CCCC": 300, "GGGG": 100}, 10, 3),
+        )
+
+    def testReduceHistogramTies(self):
+        """Test for ``reduce_histogram()`` breaking ties by sequence"""
+        histogram = {"TTTT": 1, "CCCC": 1, "AAAA": 1}
+        self.assertEqual(reduce_histogram(histogram, 1000, 0.01, 2), ({"CCCC": 1, "AAAA": 1}, 1, 1))
+
+    def testReduceHistogramKeep(self):
+        """Test for ``reduce_histogram()`` keeping sequences matching the ``keep`` sequences"""
+        histogram = {"AAAA": 500, "CCCC": 300, "GGGG": 1, "TTTT": 2}
+        self.assertEqual(
+            reduce_histogram(histogram, 1000, 0.01, 1, keep=["GGGGAA"]),
+            ({"AAAA": 500, "CCCC": 300, "GGGG": 1}, 2, 1),
+        )
+
+    def testReduceHistogramUnchanged(self):
+        """Test for ``reduce_histogram()`` with disabled reduction and unexpected values"""
+        histogram = {"AAAA": 500, "CCCC": 1}
+        self.assertEqual(reduce_histogram(histogram, 1000, 0.01, 0), (histogram, 0, 0))
+        self.assertEqual(reduce_histogram(histogram, 1000, 0.01, 2), (histogram, 0, 0))
+        self.assertEqual(
+            reduce_histogram({"AAAA": 1.5, "C": 1}, 10, 0.5, 1), ({"AAAA": 1.5, "C": 1}, 0, 0)
+        )
+        self.assertEqual(reduce_histogram([1, 2], 10, 0.5, 1), ([1, 2], 0, 0))
+
 
 class FlowCellTest(
     SetupFlowCellMixin,
@@ -151,6 +202,30 @@ class FlowCellTest(
         self.flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
         self.assertEqual(list(sorted(self.flow_cell.get_index_errors().keys())), expected)
 
+    def testGetIndexErrorsSpecialSequences(self):
+        """Test ``get_index_errors()`` with sequences that are prefixes, contaminations, rare, or cannot be
+        encoded for the vectorized analysis"""
+        self.histograms[0].histogram = {
+            "AAAAAAAA": 100,  # in sample sheet
+            "AAAAAAAAGT": 100,  # sample sheet barcode is prefix
+            "AAAA": 100,  # prefix of sample sheet barcode
+            "ACGTACGTAG": 100,
+            "ACGTACGTAC": 5,  # below threshold
+            "ACGTNCGTAG": 100,  # has "N"
+            "acgtacgt": 100,
+            "CGATCGATCGAT": 100,  # known contamination
+            "CGATCGAT": 100,  # prefix of known contamination
+            "C" * 40: 100,
+            "": 100,
+        }
+        self.histograms[0].save()
+        self.flow_cell.update_error_caches().save()
+        self.flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEqual(
+            [key for key in sorted(self.flow_cell.get_index_errors()) if key[0] == 1],
+            [(1, 1, "ACGTACGTAG"), (1, 1, "C" * 40), (1, 1, "acgtacgt")],
+        )
+
     def testGetIndexErrorsEmptySheet(self):
         """Test if sheet is empty"""
         flow_cell = self.make_flow_cell()
@@ -205,11 +280,189 @@ class FlowCellTest(
         flow_cell = FlowCell.objects.get(pk=flow_cell.pk)
         self.assertEqual(flow_cell.get_sample_sheet_errors(), {})
 
+    def testGetAdapterSiblings(self):
+        """Test ``get_adapter_siblings()`` with and without cache"""
+        self.flow_cell.index_histograms.create(
+            lane=1, index_read_no=2, sample_size=1000, histogram={"ACGTACGTAA": 500}
+        )
+        expected = ["ACGTACGTAA", "ACGTACGTAG"]
+        self.flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEqual(self.flow_cell.get_adapter_siblings("ACGTACGTAG"), expected)
+        self.flow_cell.update_error_caches().save()
+        self.flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEqual(
+            self.flow_cell.cache_adapter_siblings,
+            {"AAAAAAAA": [], "ACGTACGTAA": ["ACGTACGTAG"], "ACGTACGTAG": ["ACGTACGTAA"]},
+        )
+        self.assertEqual(
+            self.flow_cell.get_cached_adapter_seqs(), ("AAAAAAAA", "ACGTACGTAA", "ACGTACGTAG")
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.flow_cell.get_adapter_siblings("ACGTACGTAG"), expected)
+
     def testIsUserWatching(self):
         """Test ``is_user_watching()``"""
         self.assertTrue(self.flow_cell.is_user_watching(self.user))
 
 
+class FlowCellErrorCachePartitionsTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Test partial updates of the ``FlowCell`` error caches"""
+
+    def setUp(self):
+        super().setUp()
+        self.flow_cell.update_error_caches().save()
+
+    def _get_caches(self):
+        flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        return {name: getattr(flow_cell, name) for name in FLOWCELL_ERROR_CACHE_FIELDS}
+
+    def _get_full_rebuild_caches(self):
+        FlowCell.objects.get(pk=self.flow_cell.pk).update_error_caches().save_error_caches()
+        return self._get_caches()
+
+    def testUpdateHistogramPartition(self):
+        """Test that updating one partition after histogram change equals full rebuild"""
+        self.histograms[1].histogram = {"TTTTTTTTTT": 1000}
+        self.histograms[1].save()
+        FlowCell.objects.get(pk=self.flow_cell.pk).update_error_caches(
+            lanes=[2], index_read_nos=[1]
+        ).save_error_caches()
+        partial = self._get_caches()
+        keys = [tuple(key) for key, _ in partial["cache_index_errors"]]
+        self.assertIn((2, 1, "TTTTTTTTTT"), keys)
+        self.assertNotIn((2, 1, "ACGTACGTAG"), keys)
+        self.assertEqual(partial, self._get_full_rebuild_caches())
+
+    def testUpdateKeepsOtherPartitions(self):
+        """Test that errors outside of the selected partitions are kept"""
+        for histogram in self.histograms[1:3]:
+            histogram.histogram = {"TTTTTTTTTT": 1000}
+            histogram.save()
+        FlowCell.objects.get(pk=self.flow_cell.pk).update_error_caches(
+            lanes=[2]
+        ).save_error_caches()
+        keys = [tuple(key) for key, _ in self._get_caches()["cache_index_errors"]]
+        self.assertEqual(
+            keys,
+            [
+                (1, 1, "ACGTACGTAG"),
+                (2, 1, "TTTTTTTTTT"),
+                (3, 1, "ACGTACGTAG"),
+                (4, 1, "ACGTACGTAG"),
+            ],
+        )
+
+    def testUpdateLibraryLanes(self):
+        """Test that updating lanes after library change equals full rebuild"""
+        self.flow_cell.libraries.create(
+            name="ONE",
+            barcode=self.barcode_set_entry,
+            barcode2=self.barcode_set_entry,
+            lane_numbers=[2],
+        )
+        self.flow_cell.libraries.create(name="TWO", barcode_seq="TTTTTTTT", lane_numbers=[])
+        FlowCell.objects.get(pk=self.flow_cell.pk).update_error_caches(
+            lanes=[2]
+        ).save_error_caches()
+        partial = self._get_caches()
+        self.assertEqual(len(partial["cache_sample_sheet_errors"]), 3)
+        self.assertEqual(partial, self._get_full_rebuild_caches())
+
+    def testUpdateLibraryRemoved(self):
+        """Test that errors of removed libraries are dropped"""
+        self.flow_cell.libraries.all().delete()
+        FlowCell.objects.get(pk=self.flow_cell.pk).update_error_caches(
+            lanes=[1, 2, 3, 4]
+        ).save_error_caches()
+        caches = self._get_caches()
+        self.assertEqual(caches["cache_index_errors"], [])
+        self.assertEqual(caches["cache_reverse_index_errors"], [])
+        self.assertEqual(caches["cache_sample_sheet_errors"], [])
+
+    def testUpdateOutdatedCachesRebuildsAll(self):
+        """Test that partial update on outdated caches performs a full rebuild"""
+        FlowCell.objects.filter(pk=self.flow_cell.pk).update(
+            cache_index_errors=None, error_caches_version=None
+        )
+        FlowCell.objects.get(pk=self.flow_cell.pk).update_error_caches(
+            lanes=[1]
+        ).save_error_caches()
+        caches = self._get_caches()
+        self.assertEqual(len(caches["cache_index_errors"]), 4)
+        self.assertEqual(caches["error_caches_version"], FLOWCELL_ERROR_CACHE_VERSION)
+
+    def testSaveErrorCachesOnly(self):
+        """Test that ``save_error_caches()`` does not write other fields"""
+        self.flow_cell.label = "changed"
+        self.flow_cell.cache_index_errors = []
+        self.flow_cell.save_error_caches()
+        flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEqual(flow_cell.cache_index_errors, [])
+        self.assertEqual(flow_cell.label, "my_flow_cell")
+
+
+class FlowCellSaveTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Test that ``FlowCell.save()`` only updates the error caches if necessary"""
+
+    def setUp(self):
+        super().setUp()
+        self.flow_cell.update_error_caches().save()
+        self.flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+
+    def testGetChangedFields(self):
+        self.assertEqual(self.flow_cell.get_changed_fields(), set())
+        self.flow_cell.status_sequencing = STATUS_COMPLETE
+        self.flow_cell.sequencing_machine = self.make_machine()
+        self.assertEqual(
+            self.flow_cell.get_changed_fields(), {"status_sequencing", "sequencing_machine_id"}
+        )
+        self.flow_cell.save()
+        self.assertEqual(self.flow_cell.get_changed_fields(), set())
+
+    def testSaveStatusOnly(self):
+        self.flow_cell.status_sequencing = STATUS_COMPLETE
+        with mock.patch.object(FlowCell, "update_error_caches") as update_error_caches:
+            with CaptureQueriesContext(connection) as queries:
+                self.flow_cell.save()
+        update_error_caches.assert_not_called()
+        self.assertEqual(len(queries), 1)
+        self.assertIn('"status_sequencing" = ', queries[0]["sql"])
+        self.assertNotIn("cache_index_errors", queries[0]["sql"])
+        other = FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEqual(other.status_sequencing, STATUS_COMPLETE)
+
+    def testSaveDependencyChanged(self):
+        self.flow_cell.planned_reads = "100T8B100T"
+        with mock.patch.object(
+            FlowCell, "update_error_caches", autospec=True
+        ) as update_error_caches:
+            self.flow_cell.save()
+        update_error_caches.assert_called_once_with(self.flow_cell)
+
+    def testSaveSuppressedLanesChanged(self):
+        self.flow_cell.lanes_suppress_no_sample_found_for_observed_index_warning = [2]
+        self.flow_cell.save()
+        other = FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEqual(
+            list(sorted(other.get_index_errors().keys())),
+            [(1, 1, "ACGTACGTAG"), (3, 1, "ACGTACGTAG"), (4, 1, "ACGTACGTAG")],
+        )
+
+
 class FlowCellManagerTest(
     SetupFlowCellMixin,
     SetupSequencingMachineMixin,
@@ -605,3 +858,110 @@ class KnownIndexContaminationTest(
     def testStr(self):
         """Test ``__str__()``"""
         self.assertEqual(str(self.known_index_contamination), "CGATCGATCGAT: Some Contamination")
+
+
+class KnownContaminationIndexTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Test the process-wide ``known_contamination_index``"""
+
+    def _count_contamination_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return len(
+            [
+                query
+                for query in context.captured_queries
+                if KnownIndexContamination._meta.db_table in query["sql"]
+            ]
+        )
+
+    def testGet(self):
+        """Test ``get()`` with the sequences cut down to the lengths"""
+        result = known_contamination_index.get([4, 12])
+        self.assertEqual(result["CGAT"], self.known_index_contamination)
+        self.assertEqual(result["CGATCGATCGAT"], self.known_index_contamination)
+        self.assertNotIn("CGATCGAT", result)
+
+    def testNoQueriesForOtherFlowCells(self):
+        """Test that rebuilding the error caches of further flow cells does not query contaminations"""
+        other = self.make_flow_cell()
+        other.index_histograms.create(
+            lane=1, index_read_no=1, sample_size=1000, histogram={"CGATCGATCGAT": 1000}
+        )
+        self.assertEqual(self._count_contamination_queries(self.flow_cell.update_error_caches), 1)
+        self.assertEqual(self._count_contamination_queries(other.update_error_caches), 0)
+        self.assertIn("CGATCGATCGAT", other.get_known_contaminations())
+
+    def testInvalidateOnChange(self):
+        """Test that changing contaminations invalidates the index"""
+        known_contamination_index.get([11])
+        contamination = self.make_known_index_contamination()
+        self.assertIn("ACACACACACA", known_contamination_index.get([11]))
+        contamination.delete()
+        self.assertNotIn("ACACACACACA", known_contamination_index.get([11]))
+
+    def testInvalidateOtherProcesses(self):
+        """Test that the token in the shared cache is replaced on commit and the index reloaded"""
+        known_contamination_index.get([11])
+        token = cache.get(KNOWN_CONTAMINATIONS_TOKEN_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_known_index_contamination()
+        self.assertNotEqual(cache.get(KNOWN_CONTAMINATIONS_TOKEN_KEY), token)
+        # Another process replacing the token makes this process reload.
+        known_contamination_index.get([11])
+        cache.set(KNOWN_CONTAMINATIONS_TOKEN_KEY, "other")
+        self.assertEqual(
+            self._count_contamination_queries(lambda: known_contamination_index.get([11])), 1
+        )
+
+    def testCacheUnavailable(self):
+        """Test that the index is reloaded on each use if the cache is unavailable"""
+        with mock.patch.object(cache, "get", return_value=None), mock.patch.object(cache, "add"):
+            known_contamination_index.get([11])
+            # Changed without signals, e.g., by another process.
+            KnownIndexContamination.objects.update(sequence="ACACACACACA")
+            self.assertIn("ACACACACACA", known_contamination_index.get([11]))
+
+
+class TombstoneTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Test the recording of ``Tombstone`` objects on deletion"""
+
+    def testDeleteLibrary(self):
+        """Test that deleting a library records a tombstone"""
+        library_uuid = self.library.sodar_uuid
+        self.library.delete()
+        tombstone = Tombstone.objects.get()
+        self.assertEqual(tombstone.object_type, TOMBSTONE_LIBRARY)
+        self.assertEqual(tombstone.object_uuid, library_uuid)
+        self.assertEqual(tombstone.flowcell_uuid, self.flow_cell.sodar_uuid)
+        self.assertEqual(tombstone.project_uuid, self.project.sodar_uuid)
+
+    def testDeleteFlowCell(self):
+        """Test that deleting a flow cell records tombstones for it and its children"""
+        self.flow_cell.delete()
+        self.assertEqual(
+            list(
+                sorted(
+                    Tombstone.objects.filter(flowcell_uuid=self.flow_cell.sodar_uuid).values_list(
+                        "object_type", flat=True
+                    )
+                )
+            ),
+            [TOMBSTONE_FLOWCELL]
+            + 4 * [TOMBSTONE_INDEX_HISTOGRAM]
+            + [TOMBSTONE_LIBRARY]
+            + 2 * [TOMBSTONE_MESSAGE],
+        )
@@ -0,0 +1,97 @@
+import json
+from unittest import mock
+
+from test_plus.test import TestCase
+
+from barcodes.tests import SetupBarcodeSetMixin
+from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
+from sequencers.tests import SetupSequencingMachineMixin
+
+from .. import models
+from ..models import FlowCell, FLOWCELL_ERROR_CACHE_FIELDS, FLOWCELL_ERROR_CACHE_VERSION
+from ..rebuild import compute_error_caches, ErrorCacheRebuilder, load_chunk
+from ..tests import SetupFlowCellMixin
+
+
+class ErrorCacheRebuilderTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Tests for the bulk rebuild of error caches"""
+
+    def setUp(self):
+        super().setUp()
+        self.other_flow_cell = self.make_flow_cell()
+        FlowCell.objects.get(pk=self.flow_cell.pk).update_error_caches().save_error_caches()
+        self.expected = self._get_caches(FlowCell.objects.get(pk=self.flow_cell.pk))
+        FlowCell.objects.update(error_caches_version=None, cache_index_errors=None)
+        self.messages = []
+
+    @staticmethod
+    def _get_caches(flow_cell):
+        return {name: getattr(flow_cell, name) for name in FLOWCELL_ERROR_CACHE_FIELDS}
+
+    def _make_rebuilder(self, **kwargs):
+        return ErrorCacheRebuilder(progress=self.messages.append, **kwargs)
+
+    def testRun(self):
+        rebuilder = self._make_rebuilder()
+        self.assertIsNone(rebuilder.run())
+        self.assertEqual((rebuilder.num_updated, rebuilder.num_failed), (2, 0))
+        self.assertEqual(
+            self._get_caches(FlowCell.objects.get(pk=self.flow_cell.pk)), self.expected
+        )
+        self.assertEqual(
+            FlowCell.objects.get(pk=self.other_flow_cell.pk).error_caches_version,
+            FLOWCELL_ERROR_CACHE_VERSION,
+        )
+        self.assertEqual(self.messages[0], "Rebuilding error caches of 2 flow cell(s)")
+        self.assertTrue(self.messages[-1].startswith("2/2 flow cell(s) done"))
+
+    def testComputeWithoutQueries(self):
+        chunk = load_chunk()
+        self.assertEqual(
+            [flow_cell.pk for flow_cell in chunk], [self.flow_cell.pk, self.other_flow_cell.pk]
+        )
+        contaminations = list(models.KnownIndexContamination.objects.all())
+        with mock.patch.object(
+            models, "known_contamination_index", models.KnownContaminationIndex(contaminations)
+        ):
+            with self.assertNumQueries(0):
+                pk, caches, error = compute_error_caches(chunk[0])
+        self.assertEqual(
+            (pk, json.loads(json.dumps(caches)), error), (self.flow_cell.pk, self.expected, None)
+        )
+
+    def testResume(self):
+        rebuilder = self._make_rebuilder(chunk_size=1)
+        self.assertEqual(rebuilder.run(deadline=0), self.flow_cell.pk)
+        self.assertIsNone(FlowCell.objects.get(pk=self.other_flow_cell.pk).error_caches_version)
+        self.assertIsNone(rebuilder.run(after_pk=self.flow_cell.pk))
+        self.assertEqual(rebuilder.num_updated, 2)
+        self.assertIn("Rebuilding error caches of 1 flow cell(s)", self.messages)
+
+    def testFailure(self):
+        rebuilder = self._make_rebuilder()
+        with mock.patch.object(
+            FlowCell, "update_error_caches", side_effect=ValueError("boom")
+        ), self.assertLogs("flowcells.rebuild", "WARNING") as logs:
+            self.assertIsNone(rebuilder.run())
+        self.assertIn("ValueError: boom", logs.output[0])
+        self.assertEqual((rebuilder.num_updated, rebuilder.num_failed), (0, 2))
+        self.assertIsNone(FlowCell.objects.get(pk=self.flow_cell.pk).error_caches_version)
+
+    def testSkipUpdatedMeanwhile(self):
+        chunk = load_chunk()
+        FlowCell.objects.filter(pk=self.flow_cell.pk).update(
+            error_caches_version=FLOWCELL_ERROR_CACHE_VERSION, cache_index_errors=[]
+        )
+        rebuilder = self._make_rebuilder()
+        with mock.patch("flowcells.rebuild.load_chunk", side_effect=[chunk, []]):
+            rebuilder.run()
+        self.assertEqual(rebuilder.num_updated, 1)
+        self.assertEqual(FlowCell.objects.get(pk=self.flow_cell.pk).cache_index_errors, [])
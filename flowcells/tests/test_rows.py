@@ -0,0 +1,167 @@
+from django.db import connection
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from test_plus.test import TestCase
+
+from barcodes.tests import SetupBarcodeSetMixin
+from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
+from sequencers.tests import SetupSequencingMachineMixin
+
+from ..models import FlowCell, FlowCellSummary, FlowCellTag, FLOWCELL_TAG_WATCHING
+from ..rows import get_row_tokens, load_row_data, select_row_data
+from ..tests import SetupFlowCellMixin
+
+
+class LoadRowDataTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Tests for the bulk loading of the flow cell row data"""
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.make_flow_cell(num_lanes=2)
+        self.other.libraries.create(
+            name="suppressed", lane_numbers=[2], suppress_barcode2_not_observed_error=True
+        )
+        self.other.libraries.create(name="unsuppressed", lane_numbers=[2])
+
+    def testLoadRowData(self):
+        """Test that the row data is loaded in two queries"""
+        flowcells = list(FlowCell.objects.order_by("pk"))
+        with self.assertNumQueries(2):
+            load_row_data(flowcells, self.user)
+            first, second = [flowcell.row_data for flowcell in flowcells]
+            self.assertEqual(
+                [flowcell.has_sheet_for_lane(lane) for flowcell in flowcells for lane in (1, 2)],
+                [True, True, False, True],
+            )
+        self.assertEqual((first.num_libraries, second.num_libraries), (1, 2))
+        self.assertEqual(
+            (
+                first.has_suppressed_reverse_index_errors,
+                second.has_suppressed_reverse_index_errors,
+            ),
+            (False, True),
+        )
+        self.assertEqual((first.is_watching, second.is_watching), (True, False))
+        # Only the sent message, not the draft.
+        self.assertEqual((first.num_messages, second.num_messages), (1, 0))
+        self.assertEqual((first.has_index_histograms, second.has_index_histograms), (True, False))
+
+    def testLoadRowDataSelected(self):
+        """Test that only the tags are queried for flow cells loaded with their row data"""
+        flowcells = list(select_row_data(FlowCell.objects.order_by("pk")))
+        with self.assertNumQueries(1):
+            load_row_data(flowcells, self.user)
+            self.assertEqual([flowcell.row_data.num_libraries for flowcell in flowcells], [1, 2])
+            self.assertFalse(flowcells[1].has_sheet_for_lane(1))
+
+    def testLoadRowDataMissingSummary(self):
+        """Test that flow cells without summary are shown as empty"""
+        FlowCellSummary.objects.filter(pk=self.other.pk).delete()
+        flowcells = load_row_data(list(select_row_data(FlowCell.objects.order_by("pk"))), self.user)
+        self.assertEqual([flowcell.row_data.num_libraries for flowcell in flowcells], [1, 0])
+
+    def testLoadRowDataOtherUser(self):
+        """Test that the watching state is for the given user"""
+        (flowcell,) = load_row_data([FlowCell.objects.get(pk=self.flow_cell.pk)], self.root)
+        self.assertFalse(flowcell.row_data.is_watching)
+
+    def testLoadRowDataEmpty(self):
+        """Test that no queries are run without flow cells"""
+        with self.assertNumQueries(0):
+            self.assertEqual(load_row_data([], self.user), [])
+
+
+class RowCacheTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Tests for the caching of the rendered flow cell rows"""
+
+    def render(self, user=None):
+        request = RequestFactory().get("/")
+        request.user = user or self.user
+        flowcell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        return render_to_string(
+            "flowcells/_flowcell_item.html",
+            {"flowcell": flowcell, "item": flowcell, "project": self.project, "request": request},
+        )
+
+    def assertInvalidates(self, func):
+        """Assert that ``func`` replaces the token of the row when the transaction commits"""
+        (token,) = get_row_tokens([self.flow_cell.pk]).values()
+        with self.captureOnCommitCallbacks(execute=True):
+            func()
+        self.assertNotEqual(get_row_tokens([self.flow_cell.pk]), {self.flow_cell.pk: token})
+
+    def testCached(self):
+        """Test that the row is rendered from the cache until invalidated"""
+        self.assertIn("Hasdfghijkl", self.render())
+        # Updates without signals are not seen.
+        FlowCell.objects.filter(pk=self.flow_cell.pk).update(vendor_id="Hchanged")
+        with self.assertNumQueries(4):  # flow cell, sequencer, tags, and summary
+            self.assertIn("Hasdfghijkl", self.render())
+        self.assertInvalidates(self.flow_cell.save_error_caches)
+        self.assertIn("Hchanged", self.render())
+
+    def testInvalidateOnSequencer(self):
+        """Test that the row is invalidated on renaming the sequencer"""
+        self.assertIn(self.hiseq2000.vendor_id, self.render())
+        self.hiseq2000.vendor_id = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.hiseq2000.save()
+        self.assertIn(">\n      Renamed\n    </a>", self.render())
+
+    def testInvalidateOnDemuxOperator(self):
+        """Test that the row is invalidated on renaming the demultiplexing operator"""
+        self.flow_cell.demux_operator = self.root
+        self.flow_cell.save()
+        self.assertIn(self.root.username, self.render())
+        self.root.username = "renamed_operator"
+        self.assertInvalidates(self.root.save)
+        self.assertIn("renamed_operator", self.render())
+        # Logging in does not look for the flow cells of the user.
+        self.root.last_login = timezone.now()
+        with CaptureQueriesContext(connection) as queries:
+            self.root.save(update_fields=["last_login"])
+        self.assertFalse([query for query in queries if "flowcells_flowcell" in query["sql"]])
+
+    def testWatchingState(self):
+        """Test that the rows are cached by the watching state of the user"""
+        self.assertIn('"mdi:eye-outline" title="watching', self.render())
+        self.assertIn('"mdi:eye-off-outline" title="not watching', self.render(self.root))
+
+    def testInvalidateOnSave(self):
+        """Test that the row is invalidated on saving the flow cell"""
+        self.assertInvalidates(self.flow_cell.save)
+
+    def testInvalidateOnTags(self):
+        """Test that the row is invalidated on changes of the tags"""
+        self.assertInvalidates(
+            lambda: FlowCellTag.objects.create(
+                flowcell=self.flow_cell, user=self.root, name=FLOWCELL_TAG_WATCHING
+            )
+        )
+        self.assertInvalidates(self.tag_user_watches_flow_cell.delete)
+
+    def testInvalidateOnMessages(self):
+        """Test that the row is invalidated on creating and deleting messages"""
+        self.assertInvalidates(lambda: self.make_message())
+        self.assertInvalidates(self.sent_message.delete)
+
+    def testInvalidateOnLibraries(self):
+        """Test that the row is invalidated on changes of the libraries and index histograms"""
+        self.assertInvalidates(lambda: self.make_library())
+        self.assertInvalidates(lambda: self.make_index_histogram())
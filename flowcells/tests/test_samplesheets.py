@@ -0,0 +1,193 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from test_plus.test import TestCase
+
+from barcodes.tests import SetupBarcodeSetMixin
+from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
+from sequencers.models import INDEX_WORKFLOW_B
+from sequencers.tests import SetupSequencingMachineMixin
+
+from ..models import FlowCell
+from ..samplesheets import SAMPLE_SHEET_FORMATS, get_sheet_lane, iter_sample_sheet
+from ..tests import SetupFlowCellMixin
+
+
+class SampleSheetTestMixin(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.make_library()
+
+    def getSheet(self, name, lane=None):
+        flowcell = FlowCell.objects.select_related("sequencing_machine").get(pk=self.flow_cell.pk)
+        return "".join(iter_sample_sheet(flowcell, name, lane))
+
+
+class SampleSheetTest(SampleSheetTestMixin, TestCase):
+    """Tests for the generation of sample sheets"""
+
+    def testBcl2fastqV1(self):
+        # Same format as before the download, without trailing newline.
+        self.assertEqual(
+            self.getSheet("bcl2fastq-v1", lane=4),
+            "\n".join(
+                [
+                    "FCID\tLane\tSampleID\tSampleRef\tIndex\tDescription\tControl\tRecipe\tOperator\tSampleProject",
+                    "Hasdfghijkl\t4\tONE\thg19\tAAAAAAAA-AAAAAAAA\t\tN\tPE_Indexing\tNone\tProject",
+                    "Hasdfghijkl\t4\tTHREE\thg19\tATATATATA-GCGCGCGCG\t\tN\tPE_Indexing\tNone\tProject",
+                ]
+            ),
+        )
+
+    def testBcl2fastqV2(self):
+        self.assertEqual(
+            self.getSheet("bcl2fastq-v2"),
+            "[Header]\nIEMFileVersion,4\nInvestigator Name,None\nExperiment Name,Project\nDate,19/01/18\n"
+            "Workflow,GenerateFASTQ\nApplications,FASTQ Only\nAssay,TruSeq HT\nDescription,\n\n"
+            "[Reads]\n150\n150\n\n[Data]\n"
+            "Lane,Sample_ID,Sample_Name,Sample_Plate,Sample_Well,i7_Index_ID,index,Sample_Project,"
+            "Description\n"
+            + "".join("%d,ONE,,,,First entry,AAAAAAAA,Project,\n" % lane for lane in (1, 2, 3, 4))
+            + "".join("%d,THREE,,,,,,Project,\n" % lane for lane in (3, 4, 5)),
+        )
+
+    def testBclConvert(self):
+        self.hiseq2000.dual_index_workflow = INDEX_WORKFLOW_B
+        self.hiseq2000.save()
+        self.assertEqual(
+            self.getSheet("bcl-convert", lane=5),
+            "[Header]\nFileFormatVersion,2\nRunName,Hasdfghijkl\n\n"
+            "[Reads]\nRead1Cycles,150\nRead2Cycles,150\nIndex1Cycles,10\n\n"
+            "[BCLConvert_Settings]\nFastqCompressionFormat,gzip\n\n"
+            "[BCLConvert_Data]\nLane,Sample_ID,Index,Index2\n5,THREE,ATATATATA,GCGCGCGCG\n",
+        )
+
+    def testPicard(self):
+        self.hiseq2000.dual_index_workflow = INDEX_WORKFLOW_B
+        self.hiseq2000.save()
+        self.assertEqual(
+            self.getSheet("picard", lane=5).splitlines(),
+            [
+                "barcode_sequence_1\tbarcode_sequence_2\tbarcode_name\tlibrary_name",
+                "ATATATATA\tCGCGCGCGC\tTHREE\tTHREE",
+            ],
+        )
+
+    def testPicardSingleIndex(self):
+        self.flow_cell.libraries.create(name="FOUR", barcode_seq="ACGT", lane_numbers=[6])
+        self.assertEqual(
+            self.getSheet("picard", lane=6).splitlines(),
+            ["barcode_sequence_1\tbarcode_name\tlibrary_name", "ACGT\tFOUR\tFOUR"],
+        )
+
+    def testGetSheetLane(self):
+        self.assertIsNone(get_sheet_lane(self.flow_cell, "bcl2fastq-v2", None))
+        self.assertEqual(get_sheet_lane(self.flow_cell, "picard", "8"), 8)
+        for name, value in (("picard", None), ("picard", "9"), ("bcl2fastq-v2", "one")):
+            with self.assertRaises(ValueError):
+                get_sheet_lane(self.flow_cell, name, value)
+
+    def testQueryCount(self):
+        """Test that the libraries and barcodes are loaded in one query, after the stamps"""
+        flowcell = FlowCell.objects.select_related("sequencing_machine").get(pk=self.flow_cell.pk)
+        for _ in range(10):
+            self.make_library()
+        with self.assertNumQueries(2):
+            list(iter_sample_sheet(flowcell, "bcl2fastq-v1"))
+
+    def testCached(self):
+        """Test that the sheets are cached until the flow cell or its libraries change"""
+        sheet = self.getSheet("bcl2fastq-v2")
+        flowcell = FlowCell.objects.select_related("sequencing_machine").get(pk=self.flow_cell.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual("".join(iter_sample_sheet(flowcell, "bcl2fastq-v2")), sheet)
+        self.library.name = "RENAMED"
+        self.library.save()
+        self.assertIn(",RENAMED,", self.getSheet("bcl2fastq-v2"))
+        self.library.delete()
+        self.assertNotIn(",RENAMED,", self.getSheet("bcl2fastq-v2"))
+        self.flow_cell.operator = "Jane"
+        self.flow_cell.save()
+        self.assertIn("Investigator Name,Jane\n", self.getSheet("bcl2fastq-v2"))
+
+
+class FlowCellSampleSheetViewTest(SampleSheetTestMixin, TestCase):
+    """Tests for downloading sample sheets"""
+
+    def getResponse(self, name, **extra):
+        with self.login(self.owner):
+            return self.get(
+                "flowcells:flowcell-samplesheet",
+                project=self.project.sodar_uuid,
+                flowcell=self.flow_cell.sodar_uuid,
+                sheet_format=name,
+                **extra
+            )
+
+    def testGet(self):
+        response = self.getResponse("bcl2fastq-v2")
+        self.response_200(response)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response["Content-Disposition"], 'attachment; filename="Hasdfghijkl_bcl2fastq_v2.csv"'
+        )
+        self.assertEqual(
+            b"".join(response.streaming_content).decode("utf-8"), self.getSheet("bcl2fastq-v2")
+        )
+
+    def testGetLane(self):
+        response = self.getResponse("picard", data={"lane": 5})
+        self.response_200(response)
+        self.assertEqual(
+            response["Content-Disposition"],
+            'attachment; filename="Hasdfghijkl_L005_picard_barcodes.txt"',
+        )
+
+    def testGetNotModified(self):
+        etag = self.getResponse("bcl2fastq-v1")["ETag"]
+        self.assertEqual(
+            self.getResponse("bcl2fastq-v1", extra={"HTTP_IF_NONE_MATCH": etag}).status_code, 304
+        )
+        self.make_library()
+        self.response_200(self.getResponse("bcl2fastq-v1", extra={"HTTP_IF_NONE_MATCH": etag}))
+
+    def testGetInvalid(self):
+        self.response_400(self.getResponse("picard"))
+        self.response_404(self.getResponse("bcl2fastq-v3"))
+
+    def testGetAccessDenied(self):
+        with self.login(self.user):
+            response = self.get(
+                "flowcells:flowcell-samplesheet",
+                project=self.project.sodar_uuid,
+                flowcell=self.flow_cell.sodar_uuid,
+                sheet_format="bcl2fastq-v2",
+            )
+        self.response_302(response)
+
+    def testRenderCopySheet(self):
+        """Test that the sample sheet tab links to the downloads without generating sheets"""
+        with self.assertNumQueries(0):
+            html = render_to_string(
+                "flowcells/_flowcell_copy_sheet.html",
+                {
+                    "project": self.project,
+                    "object": self.flow_cell,
+                    "sample_sheet_formats": SAMPLE_SHEET_FORMATS,
+                    "sample_sheet_lanes": range(1, 3),
+                },
+            )
+        url = self.reverse(
+            "flowcells:flowcell-samplesheet",
+            project=self.project.sodar_uuid,
+            flowcell=self.flow_cell.sodar_uuid,
+            sheet_format="picard",
+        )
+        self.assertIn('data-url="%s"' % url.replace("picard", "bcl2fastq-v2"), html)
+        self.assertIn('href="%s?lane=2"' % url, html)
@@ -0,0 +1,90 @@
+import random
+
+from test_plus.test import TestCase
+
+from ..models import prefix_match
+from ..seq_index import PrefixIndex, one_mismatch_neighbours
+
+
+class PrefixIndexTest(TestCase):
+    """Tests for ``PrefixIndex``"""
+
+    def testMatchTrue(self):
+        """Test ``match()`` with valid cases"""
+        self.assertTrue(PrefixIndex(["1234"]).match("12345"))
+        self.assertTrue(PrefixIndex(["12345"]).match("12345"))
+        self.assertTrue(PrefixIndex(["123456"]).match("12345"))
+        self.assertTrue(PrefixIndex(["x", "123456"]).match("12345"))
+
+    def testMatchFalse(self):
+        """Test ``match()`` with invalid cases"""
+        self.assertFalse(PrefixIndex(["1234"]).match("x12345"))
+        self.assertFalse(PrefixIndex(["12345"]).match("x12345"))
+        self.assertFalse(PrefixIndex(["123456"]).match("x12345"))
+        self.assertFalse(PrefixIndex([]).match("12345"))
+
+    def testMatchEmpty(self):
+        """Test ``match()`` with empty query and empty entry, consistent with ``prefix_match()``"""
+        self.assertTrue(PrefixIndex(["ACGT"]).match(""))
+        self.assertTrue(PrefixIndex([""]).match("ACGT"))
+        self.assertFalse(PrefixIndex([]).match(""))
+
+    def testContains(self):
+        """Test ``__contains__()``"""
+        self.assertIn("ACGTA", PrefixIndex(["ACGT"]))
+        self.assertNotIn("TTTT", PrefixIndex(["ACGT"]))
+
+    def testEquivalentToPrefixMatch(self):
+        """Test that ``match()`` agrees with ``prefix_match()`` on random data"""
+        rng = random.Random(1)
+
+        def make():
+            return "".join(rng.choice("ACG") for _ in range(rng.randint(0, 6)))
+
+        for _ in range(50):
+            entries = [make() for _ in range(rng.randint(0, 10))]
+            index = PrefixIndex(entries)
+            for _ in range(20):
+                query = make()
+                self.assertEqual(index.match(query), prefix_match(query, entries), (query, entries))
+
+
+class OneMismatchNeighboursTest(TestCase):
+    """Tests for ``one_mismatch_neighbours()``"""
+
+    @staticmethod
+    def _brute_force(seqs):
+        return {
+            seq: [
+                other
+                for other in sorted(seqs)
+                if other != seq and len([x for x, y in zip(seq, other) if x != y]) <= 1
+            ]
+            for seq in seqs
+        }
+
+    def testEmpty(self):
+        self.assertEqual(one_mismatch_neighbours([]), {})
+
+    def testSimple(self):
+        self.assertEqual(
+            one_mismatch_neighbours(["ACGT", "ACGA", "TCGA", "GGGG"]),
+            {"ACGT": ["ACGA"], "ACGA": ["ACGT", "TCGA"], "TCGA": ["ACGA"], "GGGG": []},
+        )
+
+    def testDifferentLengths(self):
+        """Test that sequences are compared up to the length of the shorter one"""
+        self.assertEqual(
+            one_mismatch_neighbours(["ACG", "ACGTT", "TCGAA", "AAA"]),
+            {"ACG": ["ACGTT", "TCGAA"], "ACGTT": ["ACG"], "TCGAA": ["ACG"], "AAA": []},
+        )
+
+    def testEquivalentToBruteForce(self):
+        """Test that result agrees with comparing all pairs on random data"""
+        rng = random.Random(1)
+        for _ in range(30):
+            seqs = {
+                "".join(rng.choice("ACG") for _ in range(rng.randint(0, 5)))
+                for _ in range(rng.randint(0, 40))
+            }
+            self.assertEqual(one_mismatch_neighbours(seqs), self._brute_force(seqs), seqs)
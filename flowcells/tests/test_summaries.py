@@ -0,0 +1,225 @@
+import threading
+import time
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from test_plus.test import BaseTestCase, TestCase
+
+from barcodes.tests import SetupBarcodeSetMixin
+from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
+from sequencers.tests import SetupSequencingMachineMixin
+
+from ..libraries import upsert_libraries
+from ..models import (
+    FlowCell,
+    FlowCellSummary,
+    Library,
+    MSG_STATE_SENT,
+    get_drifted_summary_pks,
+    update_flowcell_summaries,
+)
+from ..tests import SetupFlowCellMixin
+
+
+class FlowCellSummaryTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Tests for maintaining the flow cell summaries"""
+
+    def getSummary(self, flowcell=None):
+        return FlowCellSummary.objects.get(pk=(flowcell or self.flow_cell).pk)
+
+    def testCreated(self):
+        """Test that the summary is created with the flow cell"""
+        summary = self.getSummary(self.make_flow_cell())
+        self.assertEqual((summary.num_libraries, summary.lanes_with_sheets), (0, []))
+        self.assertEqual((summary.num_sent_messages, summary.num_index_histograms), (0, 0))
+
+    def testLibraries(self):
+        """Test that the summary follows the libraries"""
+        summary = self.getSummary()
+        self.assertEqual((summary.num_libraries, summary.lanes_with_sheets), (1, [1, 2, 3, 4]))
+        self.assertFalse(summary.has_suppressed_reverse_index_errors)
+        library = self.make_library()
+        library.suppress_barcode1_not_observed_error = True
+        library.save()
+        summary = self.getSummary()
+        self.assertEqual((summary.num_libraries, summary.lanes_with_sheets), (2, [1, 2, 3, 4, 5]))
+        self.assertTrue(summary.has_suppressed_reverse_index_errors)
+        self.library.delete()
+        summary = self.getSummary()
+        self.assertEqual((summary.num_libraries, summary.lanes_with_sheets), (1, [3, 4, 5]))
+
+    def testUpsertLibraries(self):
+        """Test that the summary is updated once for a sample sheet"""
+        self.make_library()
+        rows = [{"name": "LIB%d" % i, "barcode_seq": "ACGT", "lane_numbers": [6]} for i in range(3)]
+        # Two deleted with tombstones, the summary is locked and updated once.
+        with self.assertNumQueries(2 + 2 + 2 + 1 + 1 + 1):
+            upsert_libraries(self.flow_cell, rows)
+        summary = self.getSummary()
+        self.assertEqual((summary.num_libraries, summary.lanes_with_sheets), (3, [6]))
+
+    def testMessages(self):
+        """Test that only sent messages are counted"""
+        self.assertEqual(self.getSummary().num_sent_messages, 1)
+        message = self.make_message()
+        self.assertEqual(self.getSummary().num_sent_messages, 1)
+        message.state = MSG_STATE_SENT
+        message.save()
+        self.assertEqual(self.getSummary().num_sent_messages, 2)
+        self.sent_message.delete()
+        self.assertEqual(self.getSummary().num_sent_messages, 1)
+
+    def testIndexHistograms(self):
+        """Test that the summary follows the index histograms"""
+        self.assertEqual(self.getSummary().num_index_histograms, 4)
+        self.make_index_histogram()
+        self.assertEqual(self.getSummary().num_index_histograms, 5)
+        self.histograms[0].delete()
+        self.assertEqual(self.getSummary().num_index_histograms, 4)
+
+    def testErrorCaches(self):
+        """Test that the errors are counted when the error caches are saved"""
+        self.flow_cell.cache_index_errors = [[[1, 1, "ACGT"], ["error"]]]
+        self.flow_cell.cache_reverse_index_errors = []
+        self.flow_cell.cache_sample_sheet_errors = [["uuid1", {}], ["uuid2", {}]]
+        self.flow_cell.save_error_caches()
+        summary = self.getSummary()
+        self.assertEqual(
+            (
+                summary.num_index_errors,
+                summary.num_reverse_index_errors,
+                summary.num_sample_sheet_errors,
+            ),
+            (1, 0, 2),
+        )
+
+    def getSummaryUpdates(self, func):
+        """Return the queries of ``func`` locking or updating summaries"""
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        return [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('UPDATE "flowcells_flowcellsummary"')
+            or ('FROM "flowcells_flowcellsummary"' in query["sql"] and "FOR UPDATE" in query["sql"])
+        ]
+
+    def testDeleteFlowCell(self):
+        """Test that the summary is not updated for the objects of a deleted flow cell"""
+        for _ in range(5):
+            self.make_library()
+        self.assertEqual(self.getSummaryUpdates(self.flow_cell.delete), [])
+        self.assertFalse(FlowCellSummary.objects.exists())
+
+    def testDeleteFlowCells(self):
+        """Test that the summaries are not updated for the objects of deleted flow cells"""
+        self.make_library(self.make_flow_cell())
+        self.assertEqual(self.getSummaryUpdates(FlowCell.objects.all().delete), [])
+        self.assertFalse(FlowCellSummary.objects.exists())
+
+    def testDeleteLibraries(self):
+        """Test that the summary is updated once for deleting many libraries"""
+        for _ in range(5):
+            self.make_library()
+        updates = self.getSummaryUpdates(Library.objects.filter(flow_cell=self.flow_cell).delete)
+        self.assertEqual(len(updates), 2)  # lock and update
+        summary = self.getSummary()
+        self.assertEqual((summary.num_libraries, summary.lanes_with_sheets), (0, []))
+        self.assertEqual(
+            len(self.getSummaryUpdates(self.flow_cell.index_histograms.all().delete)), 2
+        )
+        self.assertEqual(self.getSummary().num_index_histograms, 0)
+
+    def testRolledBack(self):
+        """Test that the summary is updated in the transaction of the change"""
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                self.make_library()
+                self.assertEqual(self.getSummary().num_libraries, 2)
+                raise RuntimeError("roll back")
+        self.assertEqual(self.getSummary().num_libraries, 1)
+
+    def testUpdateCreates(self):
+        """Test that missing summaries are only created on request"""
+        FlowCellSummary.objects.all().delete()
+        update_flowcell_summaries(self.flow_cell.pk)
+        self.assertFalse(FlowCellSummary.objects.exists())
+        update_flowcell_summaries(self.flow_cell.pk, create=True)
+        self.assertEqual(self.getSummary().num_libraries, 1)
+
+
+class FlowCellSummaryConcurrencyTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TransactionTestCase,
+    BaseTestCase,
+):
+    """Tests for updating the summaries from concurrent transactions"""
+
+    def testConcurrentLibraries(self):
+        """Test that the summary counts the libraries added by two transactions at the same time"""
+        locked = threading.Event()
+
+        def add_library():
+            try:
+                with transaction.atomic():
+                    self.make_library()  # locks the summary until committed
+                    locked.set()
+                    time.sleep(0.5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=add_library)
+        thread.start()
+        self.assertTrue(locked.wait(10))
+        with transaction.atomic():
+            self.make_library()  # waits for the other transaction
+        thread.join()
+        self.assertEqual(FlowCellSummary.objects.get(pk=self.flow_cell.pk).num_libraries, 3)
+        self.assertEqual(get_drifted_summary_pks(), [])
+
+
+class FlowCellSummariesCommandTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Tests for the ``flowcells_summaries`` management command"""
+
+    def setUp(self):
+        super().setUp()
+        self.other = self.make_flow_cell()
+        # Drift off without signals.
+        FlowCellSummary.objects.filter(pk=self.flow_cell.pk).update(num_libraries=7)
+        FlowCellSummary.objects.filter(pk=self.other.pk).delete()
+
+    def testCheck(self):
+        """Test that drifted and missing summaries are reported"""
+        self.assertEqual(get_drifted_summary_pks(), [self.flow_cell.pk, self.other.pk])
+        with self.assertRaises(CommandError):
+            call_command("flowcells_summaries", "--check", stdout=None)
+        self.assertEqual(FlowCellSummary.objects.get(pk=self.flow_cell.pk).num_libraries, 7)
+
+    def testRebuild(self):
+        """Test that drifted and missing summaries are rebuilt"""
+        call_command("flowcells_summaries")
+        self.assertEqual(get_drifted_summary_pks(), [])
+        self.assertEqual(FlowCellSummary.objects.get(pk=self.flow_cell.pk).num_libraries, 1)
+        self.assertEqual(FlowCellSummary.objects.get(pk=self.other.pk).num_libraries, 0)
+        call_command("flowcells_summaries", "--check")
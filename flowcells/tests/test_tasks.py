@@ -1,4 +1,12 @@
-# import datetime
+import datetime
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import override_settings
+from django.utils import timezone
 
 # from django.shortcuts import reverse
 from test_plus.test import TestCase
@@ -7,8 +15,15 @@ from barcodes.tests import SetupBarcodeSetMixin
 from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
 from sequencers.tests import SetupSequencingMachineMixin
 
-from ..models import FlowCell, FLOWCELL_ERROR_CACHE_VERSION
-from ..tasks import flowcell_update_error_caches, flowcell_update_outdated_error_caches
+from ..models import FlowCell, Tombstone, FLOWCELL_ERROR_CACHE_VERSION
+from ..tasks import (
+    flowcell_purge_tombstones,
+    flowcell_rebuild_outdated_error_caches,
+    flowcell_update_error_caches,
+    flowcell_update_outdated_error_caches,
+    schedule_error_cache_update,
+    _error_cache_update_key,
+)
 from ..tests import SetupFlowCellMixin
 
 
@@ -47,6 +62,243 @@ class FlowCellUpdateErrorCachesTaskTest(
         self.assertEquals(len(flow_cell.cache_sample_sheet_errors), 2)
         self.assertEquals(flow_cell.error_caches_version, FLOWCELL_ERROR_CACHE_VERSION)
 
+    def testUpdateErrorCachesTaskPartition(self):
+        self.flow_cell.update_error_caches().save()
+        histogram = self.flow_cell.index_histograms.get(lane=2, index_read_no=1)
+        histogram.histogram = {"TTTTTTTTTT": 1000}
+        histogram.save()
+
+        # Execute the update task for lane 2 only.
+        flowcell_update_error_caches(self.flow_cell.pk, lanes=[2], index_read_nos=[1])
+
+        # Load flow cell from database
+        flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEquals(
+            [tuple(key) for key, _ in flow_cell.cache_index_errors],
+            [
+                (1, 1, "ACGTACGTAG"),
+                (2, 1, "TTTTTTTTTT"),
+                (3, 1, "ACGTACGTAG"),
+                (4, 1, "ACGTACGTAG"),
+            ],
+        )
+
+
+class ScheduleErrorCacheUpdateTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Test the ``schedule_error_cache_update()`` function."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.flow_cell.update_error_caches().save()
+
+    def testCoalesceRequests(self):
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            self.assertTrue(schedule_error_cache_update(self.flow_cell.pk, [2], [1]))
+            self.assertFalse(schedule_error_cache_update(self.flow_cell.pk, [3], [1]))
+            self.assertFalse(schedule_error_cache_update(self.flow_cell.pk, [2], [1]))
+        self.assertEquals(apply_async.call_count, 1)
+        args, kwargs = apply_async.call_args
+        self.assertEquals(args[0], (self.flow_cell.pk,))
+        self.assertEquals(kwargs["countdown"], settings.FLOWCELLS_ERROR_CACHE_UPDATE_DELAY)
+
+        # Change histograms of both requested lanes, the task picks up the merged lanes.
+        for lane in (2, 3):
+            histogram = self.flow_cell.index_histograms.get(lane=lane, index_read_no=1)
+            histogram.histogram = {"TTTTTTTTTT": 1000}
+            histogram.save()
+        self.assertEquals(flowcell_update_error_caches(*args[0], **args[1]), 2)
+
+        flow_cell = FlowCell.objects.get(pk=self.flow_cell.pk)
+        self.assertEquals(
+            [tuple(key) for key, _ in flow_cell.cache_index_errors],
+            [
+                (1, 1, "ACGTACGTAG"),
+                (2, 1, "TTTTTTTTTT"),
+                (3, 1, "TTTTTTTTTT"),
+                (4, 1, "ACGTACGTAG"),
+            ],
+        )
+
+    def testMergeAllLanes(self):
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [2], [1])
+            schedule_error_cache_update(self.flow_cell.pk)
+        args, _kwargs = apply_async.call_args
+        with mock.patch.object(
+            FlowCell, "update_error_caches", autospec=True, return_value=self.flow_cell
+        ) as update_error_caches:
+            flowcell_update_error_caches(*args[0], **args[1])
+        update_error_caches.assert_called_once_with(mock.ANY, lanes=None, index_read_nos=None)
+
+    def testScheduleAfterRun(self):
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+            args, _kwargs = apply_async.call_args
+            self.assertEquals(flowcell_update_error_caches(*args[0], **args[1]), 0)
+            self.assertTrue(schedule_error_cache_update(self.flow_cell.pk, [1], [1]))
+        self.assertEquals(apply_async.call_count, 2)
+
+    def testDropStaleTask(self):
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+        args, _kwargs = apply_async.call_args
+        self.assertIsNone(
+            flowcell_update_error_caches(*args[0], **dict(args[1], token="stale-token"))
+        )
+        self.assertEquals(flowcell_update_error_caches(*args[0], **args[1]), 0)
+
+    def runDuringFirstGet(self, func):
+        """Patch ``cache.get()`` such that ``func`` starts in a thread in the first call, which waits until
+        ``func`` is blocked on the lock (or done)"""
+        get = cache.get
+        threads = []
+
+        def get_and_interleave(key, *args, **kwargs):
+            if not threads and key == _error_cache_update_key(self.flow_cell.pk):
+                threads.append(threading.Thread(target=func))
+                threads[0].start()
+                threads[0].join(0.2)
+            return get(key, *args, **kwargs)
+
+        return threads, mock.patch.object(cache, "get", side_effect=get_and_interleave)
+
+    def testConcurrentSchedule(self):
+        """Test that concurrent requests merge their partitions"""
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+            threads, patch = self.runDuringFirstGet(
+                lambda: schedule_error_cache_update(self.flow_cell.pk, [3], [1])
+            )
+            with patch:
+                self.assertFalse(schedule_error_cache_update(self.flow_cell.pk, [2], [1]))
+            threads[0].join()
+        self.assertEquals(apply_async.call_count, 1)
+        state = cache.get(_error_cache_update_key(self.flow_cell.pk))
+        self.assertEquals((state["lanes"], state["absorbed"]), ([1, 2, 3], 2))
+
+    def testScheduleDuringTask(self):
+        """Test that requests arriving while the task reads the state are not lost"""
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+        args, _kwargs = apply_async.call_args
+        with mock.patch("flowcells.tasks._update_error_caches") as update_error_caches:
+            with mock.patch("flowcells.tasks._enqueue_error_cache_update") as enqueue:
+                threads, patch = self.runDuringFirstGet(
+                    lambda: schedule_error_cache_update(self.flow_cell.pk, [2], [1])
+                )
+                # Let the request merge before the task checks the state again.
+                update_error_caches.side_effect = lambda *_args: threads[0].join()
+                with patch:
+                    flowcell_update_error_caches(*args[0], **args[1])
+                update_error_caches.side_effect = None
+            # The task read the state first, it is enqueued again for the merged request.
+            update_error_caches.assert_called_once_with(self.flow_cell.pk, [1], [1])
+            self.assertEquals(enqueue.call_count, 1)
+            (flowcell_pk, state), _kwargs = enqueue.call_args
+            self.assertEquals(flowcell_update_error_caches(flowcell_pk, token=state["token"]), 0)
+            update_error_caches.assert_called_with(self.flow_cell.pk, [1, 2], [1])
+        # No orphaned state is left behind.
+        with mock.patch("flowcells.tasks._enqueue_error_cache_update"):
+            self.assertTrue(schedule_error_cache_update(self.flow_cell.pk, [3], [1]))
+
+    def testTaskDuringSchedule(self):
+        """Test that the task does not run between reading and writing the state by a request"""
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+        args, _kwargs = apply_async.call_args
+        with mock.patch("flowcells.tasks._update_error_caches") as update_error_caches:
+            with mock.patch("flowcells.tasks._enqueue_error_cache_update") as enqueue:
+                threads, patch = self.runDuringFirstGet(
+                    lambda: flowcell_update_error_caches(*args[0], **args[1])
+                )
+                with patch:
+                    self.assertFalse(schedule_error_cache_update(self.flow_cell.pk, [2], [1]))
+                threads[0].join()
+                # The task waited for the request and picked up the merged partitions.
+                update_error_caches.assert_called_once_with(self.flow_cell.pk, [1, 2], [1])
+                self.assertEquals(enqueue.call_count, 0)
+                self.assertTrue(schedule_error_cache_update(self.flow_cell.pk, [3], [1]))
+                self.assertEquals(enqueue.call_count, 1)
+
+    def testTaskFailed(self):
+        """Test that a failed task does not leave its state behind"""
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+        args, _kwargs = apply_async.call_args
+        with mock.patch(
+            "flowcells.tasks._update_error_caches", side_effect=RuntimeError("failed")
+        ), self.assertRaises(RuntimeError):
+            flowcell_update_error_caches(*args[0], **args[1])
+        with mock.patch("flowcells.tasks._enqueue_error_cache_update") as enqueue:
+            self.assertTrue(schedule_error_cache_update(self.flow_cell.pk, [2], [1]))
+        self.assertEquals(enqueue.call_count, 1)
+
+    def testTaskFailedRequeue(self):
+        """Test that a failed task is enqueued again for the requests merged while running"""
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+        args, _kwargs = apply_async.call_args
+
+        def fail(*_args):
+            schedule_error_cache_update(self.flow_cell.pk, [2], [1])
+            raise RuntimeError("failed")
+
+        with mock.patch("flowcells.tasks._update_error_caches", side_effect=fail), mock.patch(
+            "flowcells.tasks._enqueue_error_cache_update"
+        ) as enqueue, self.assertRaises(RuntimeError):
+            flowcell_update_error_caches(*args[0], **args[1])
+        self.assertEquals(enqueue.call_count, 1)
+        (_flowcell_pk, state), _kwargs = enqueue.call_args
+        self.assertEquals((state["lanes"], state["index_read_nos"]), ([1, 2], [1]))
+
+    def testTaskDeletedFlowCell(self):
+        """Test that the task for a deleted flow cell drops its state"""
+        with mock.patch.object(flowcell_update_error_caches, "apply_async") as apply_async:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+        args, _kwargs = apply_async.call_args
+        with mock.patch("flowcells.tasks._enqueue_error_cache_update") as enqueue:
+            schedule_error_cache_update(self.flow_cell.pk, [2], [1])
+            FlowCell.objects.filter(pk=self.flow_cell.pk).delete()
+            self.assertIsNone(flowcell_update_error_caches(*args[0], **args[1]))
+        self.assertEquals(enqueue.call_count, 0)
+        self.assertIsNone(cache.get(_error_cache_update_key(self.flow_cell.pk)))
+
+    def testOrphanedState(self):
+        """Test that the state of a killed task is replaced after its timeout"""
+        with mock.patch("flowcells.tasks._enqueue_error_cache_update") as enqueue:
+            schedule_error_cache_update(self.flow_cell.pk, [1], [1])
+            key = _error_cache_update_key(self.flow_cell.pk)
+            cache.set(key, dict(cache.get(key), created=time.time() - 24 * 60 * 60))
+            self.assertTrue(schedule_error_cache_update(self.flow_cell.pk, [2], [1]))
+        self.assertEquals(enqueue.call_count, 2)
+        (_flowcell_pk, state), _kwargs = enqueue.call_args
+        self.assertEquals((state["lanes"], state["absorbed"]), ([1, 2], 0))
+
+    def testCacheUnavailable(self):
+        """Test that requests do not wait for the lock if the cache is unavailable"""
+        with mock.patch.object(cache, "add", return_value=None), mock.patch.object(
+            cache, "get", return_value=None
+        ), mock.patch.object(cache, "set"), mock.patch("time.sleep") as sleep, mock.patch(
+            "flowcells.tasks._enqueue_error_cache_update"
+        ) as enqueue:
+            self.assertTrue(schedule_error_cache_update(self.flow_cell.pk, [1], [1]))
+            self.assertTrue(schedule_error_cache_update(self.flow_cell.pk, [2], [1]))
+        self.assertEquals(enqueue.call_count, 2)
+        sleep.assert_not_called()
+
+    def testScheduleEager(self):
+        # Without mocking, the task is executed eagerly in the tests.
+        self.assertTrue(schedule_error_cache_update(self.flow_cell.pk))
+        self.assertTrue(schedule_error_cache_update(self.flow_cell.pk))
+
 
 class FlowCellUpdateOutdatedErrorCachesTaskTest(
     SetupFlowCellMixin,
@@ -84,3 +336,57 @@ class FlowCellUpdateOutdatedErrorCachesTaskTest(
         self.assertEquals(len(flow_cell.cache_reverse_index_errors), 2)
         self.assertEquals(len(flow_cell.cache_sample_sheet_errors), 2)
         self.assertEquals(flow_cell.error_caches_version, FLOWCELL_ERROR_CACHE_VERSION)
+
+
+class FlowCellRebuildOutdatedErrorCachesTaskTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Test the ``flowcell_rebuild_outdated_error_caches()`` function."""
+
+    def testRebuildOutdatedErrorCachesTask(self):
+        self.make_flow_cell()
+        FlowCell.objects.update(error_caches_version=None)
+        self.assertEqual(flowcell_rebuild_outdated_error_caches(), 2)
+        self.assertFalse(
+            FlowCell.objects.exclude(error_caches_version=FLOWCELL_ERROR_CACHE_VERSION)
+        )
+
+    def testContinueAfterTimeBudget(self):
+        other = self.make_flow_cell()
+        FlowCell.objects.update(error_caches_version=None)
+        with mock.patch("flowcells.tasks.BULK_REBUILD_TIME_BUDGET", -1), mock.patch.object(
+            flowcell_rebuild_outdated_error_caches, "apply_async"
+        ) as apply_async:
+            self.assertEqual(flowcell_rebuild_outdated_error_caches(), 2)
+        apply_async.assert_called_once_with(kwargs={"after_pk": other.pk})
+        # The continuation finds nothing left to do.
+        self.assertEqual(flowcell_rebuild_outdated_error_caches(after_pk=other.pk), 0)
+
+
+class FlowCellPurgeTombstonesTaskTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Test the ``flowcell_purge_tombstones()`` function."""
+
+    @override_settings(FLOWCELLS_TOMBSTONE_RETENTION_DAYS=30)
+    def testPurgeTombstones(self):
+        self.library.delete()
+        self.draft_message.delete()
+        Tombstone.objects.filter(object_uuid=self.library.sodar_uuid).update(
+            date_deleted=timezone.now() - datetime.timedelta(days=31)
+        )
+        self.assertEqual(flowcell_purge_tombstones(), 1)
+        self.assertEqual(
+            list(Tombstone.objects.values_list("object_uuid", flat=True)),
+            [self.draft_message.sodar_uuid],
+        )
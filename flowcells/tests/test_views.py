@@ -0,0 +1,121 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from test_plus.test import TestCase
+
+from barcodes.tests import SetupBarcodeSetMixin
+from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin
+from sequencers.tests import SetupSequencingMachineMixin
+
+from ..models import FlowCellTag, FLOWCELL_TAG_WATCHING, MSG_STATE_SENT
+from ..tests import SetupFlowCellMixin
+
+
+class FlowCellListViewTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Tests for the flow cell list page"""
+
+    def countQueries(self):
+        with self.login(self.owner):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get("flowcells:flowcell-list", project=self.project.sodar_uuid)
+        self.response_200(response)
+        return len(queries)
+
+    def testGetQueryCount(self):
+        """Test that the number of queries does not depend on the number of flow cells on the page"""
+        expected = self.countQueries()
+        for run_number in range(10, 29):
+            flowcell = self.make_flow_cell(run_number=run_number, demux_operator=self.user)
+            self.make_library(flowcell)
+            self.make_message(flowcell)
+            self.make_index_histogram(flowcell)
+            FlowCellTag.objects.create(
+                flowcell=flowcell, user=self.user, name=FLOWCELL_TAG_WATCHING
+            )
+        self.assertEqual(self.countQueries(), expected)
+
+
+class FlowCellTabViewTest(
+    SetupFlowCellMixin,
+    SetupSequencingMachineMixin,
+    SetupBarcodeSetMixin,
+    SetupProjectMixin,
+    SetupUserMixin,
+    TestCase,
+):
+    """Tests for the tabs of the flow cell detail page"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def getTab(self, tab):
+        with self.login(self.owner):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get(
+                    "flowcells:flowcell-tab",
+                    project=self.project.sodar_uuid,
+                    flowcell=self.flow_cell.sodar_uuid,
+                    tab=tab,
+                )
+        self.response_200(response)
+        return response.content.decode("utf-8"), len(queries)
+
+    def testGet(self):
+        for tab, expected in (
+            ("sample-sheet", "ONE"),
+            ("index-stats", "ACGTACGTAG"),
+            ("messages", "the message subject"),
+        ):
+            self.assertIn(expected, self.getTab(tab)[0])
+
+    def testGetUnknown(self):
+        with self.login(self.owner):
+            response = self.get(
+                "flowcells:flowcell-tab",
+                project=self.project.sodar_uuid,
+                flowcell=self.flow_cell.sodar_uuid,
+                tab="properties",
+            )
+        self.response_404(response)
+
+    def testGetQueryCount(self):
+        """Test that the number of queries of each tab does not depend on the number of objects"""
+        expected = {}
+        for tab in ("sample-sheet", "index-stats", "messages"):
+            cache.clear()
+            expected[tab] = self.getTab(tab)[1]
+        for lane in range(5, 9):
+            self.flow_cell.libraries.create(
+                name="LIB%d" % lane,
+                barcode=self.barcode_set_entry,
+                barcode2=self.barcode_set_entry,
+                lane_numbers=[lane],
+            )
+            self.make_index_histogram(lane=lane)
+            message = self.make_message()
+            message.state = MSG_STATE_SENT
+            message.save()
+        for tab in ("sample-sheet", "index-stats", "messages"):
+            cache.clear()
+            self.assertEqual(self.getTab(tab)[1], expected[tab], tab)
+
+    def testGetCached(self):
+        """Test that the sample sheet and index statistics tabs are cached until the flow cell changes"""
+        for tab in ("sample-sheet", "index-stats"):
+            content, num_queries = self.getTab(tab)
+            cached, num_cached_queries = self.getTab(tab)
+            self.assertEqual(cached, content)
+            self.assertLess(num_cached_queries, num_queries)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.flow_cell.libraries.create(name="NEW", barcode_seq="GATTACA", lane_numbers=[5])
+            self.make_index_histogram(lane=5)
+        self.assertIn("NEW", self.getTab("sample-sheet")[0])
+        self.assertEqual(self.getTab("index-stats")[0].count("Based on 10,000 sampled"), 1)
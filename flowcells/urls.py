@@ -19,6 +19,16 @@ urlpatterns = [
         view=views.FlowCellDetailView.as_view(),
         name="flowcell-detail",
     ),
+    url(
+        regex=r"^(?P<project>[0-9a-f-]+)/flowcell/(?P<flowcell>[0-9a-f-]+)/tab/(?P<tab>[a-z-]+)/$",
+        view=views.FlowCellTabView.as_view(),
+        name="flowcell-tab",
+    ),
+    url(
+        regex=r"^(?P<project>[0-9a-f-]+)/flowcell/(?P<flowcell>[0-9a-f-]+)/samplesheet/(?P<sheet_format>[a-z0-9-]+)/$",
+        view=views.FlowCellSampleSheetView.as_view(),
+        name="flowcell-samplesheet",
+    ),
     url(
         regex=r"^(?P<project>[0-9a-f-]+)/flowcell/(?P<flowcell>[0-9a-f-]+)/update/$",
         view=views.FlowCellUpdateView.as_view(),
@@ -1,13 +1,18 @@
 """The views for the flowcells app."""
 
+import hashlib
 import json
 
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth import get_user_model
 from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.db import transaction
+from django.db.models import Count, Max, Prefetch, prefetch_related_objects
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
 from django.shortcuts import reverse, redirect, render
 from django.template.defaultfilters import pluralize
 from django.views.generic import CreateView, DeleteView, DetailView, ListView, UpdateView
@@ -16,7 +21,6 @@ from projectroles.plugins import get_backend_api
 from projectroles.utils import build_secret
 from projectroles.views import LoggedInPermissionMixin, ProjectContextMixin, ProjectPermissionMixin
 
-from barcodes.models import BarcodeSetEntry
 from digestiflow.utils import model_to_dict
 from .forms import (
     FlowCellForm,
@@ -28,6 +32,7 @@ from .forms import (
 )
 from .models import (
     FlowCell,
+    KnownIndexContamination,
     Message,
     MSG_STATE_DRAFT,
     MSG_STATE_SENT,
@@ -37,10 +42,20 @@ from .models import (
     message_created,
     flow_cell_created,
     flow_cell_updated,
-    REFERENCE_OTHER,
 )
-from .tasks import flowcell_update_error_caches
+from .libraries import upsert_libraries
+from .rows import get_row_tokens, load_row_data, select_row_data
+from .samplesheets import (
+    SAMPLE_SHEET_FORMATS,
+    get_sample_sheet_stamps,
+    get_sheet_lane,
+    sample_sheet_response,
+)
+from .tasks import schedule_error_cache_update
+
 
+#: Prefix of the cache keys of the rendered tabs of the flow cell detail page.
+TAB_CACHE_PREFIX = "flowcells:tab"
 
 # TODO: need to provide query set by project?!
 
@@ -61,17 +76,59 @@ class FlowCellListView(
     paginate_by = 20
 
     def get_queryset(self):
-        return (
-            super()
-            .get_queryset()
-            .filter(project__sodar_uuid=self.kwargs["project"])
-            .prefetch_related(
-                "index_histograms", "libraries", "messages", "sequencing_machine", "tags"
-            )
+        return select_row_data(
+            super().get_queryset().filter(project__sodar_uuid=self.kwargs["project"])
         )
 
+    def get_context_data(self, *args, **kwargs):
+        result = super().get_context_data(*args, **kwargs)
+        # Load the data of all rows of the page at once.
+        result["object_list"] = load_row_data(list(result["object_list"]), self.request.user)
+        return result
+
+
+def get_message_form(flowcell, user):
+    """Return the form for writing a message to ``flowcell``, with the draft of ``user`` if any."""
+    drafts = flowcell.messages.filter(author=user, state=MSG_STATE_DRAFT)
+    try:
+        instance = drafts.first()
+    except Message.DoesNotExit:
+        instance = Message()
+    return MessageForm(instance=instance)
+
+
+def load_sent_messages(flowcell):
+    """Return list of the sent messages of ``flowcell`` with their authors and attachments."""
+    return list(
+        flowcell.get_sent_messages()
+        .select_related("author", "attachment_folder")
+        .prefetch_related("attachment_folder__filesfolders_file_children")
+    )
+
+
+class FlowCellDetailContextMixin:
+    """Context of the pages rendering ``flowcell_detail.html``.
+
+    Only the data of the page around the tabs is loaded, the heavy tabs are loaded by ``FlowCellTabView``
+    when opened.  The messages are rendered with the page in ``message_mode``.
+    """
+
+    def get_detail_context(self, flowcell, message_mode=False):
+        # Badges and alerts only need the numbers and lanes of the libraries etc.
+        load_row_data([flowcell], self.request.user)
+        result = {
+            "message_mode": message_mode,
+            # The sample sheets are loaded from ``FlowCellSampleSheetView`` when displayed.
+            "sample_sheet_formats": SAMPLE_SHEET_FORMATS,
+            "sample_sheet_lanes": range(1, flowcell.num_lanes + 1),
+        }
+        if message_mode:
+            result["sent_messages"] = load_sent_messages(flowcell)
+        return result
+
 
 class FlowCellDetailView(
+    FlowCellDetailContextMixin,
     LoginRequiredMixin,
     LoggedInPermissionMixin,
     ProjectPermissionMixin,
@@ -88,125 +145,151 @@ class FlowCellDetailView(
     slug_url_kwarg = "flowcell"
     slug_field = "sodar_uuid"
 
-    def render_to_response(self, *args, **kwargs):
-        context = self.get_context_data()
+    def get_queryset(self):
+        return (
+            super().get_queryset().select_related("sequencing_machine", "demux_operator", "summary")
+        )
+
+    def render_to_response(self, context, **response_kwargs):
         if context["object"].is_error_cache_update_pending():
             messages.info(
                 self.request,
                 "Error information is outdated but will be refreshed shortly. Try reloading from time to time "
                 "until this message disappears.",
             )
-            flowcell_update_error_caches.delay(context["object"].pk)
-        return super().render_to_response(*args, **kwargs)
+            schedule_error_cache_update(context["object"].pk)
+        return super().render_to_response(context, **response_kwargs)
+
+    def get_context_data(self, *args, **kwargs):
+        result = super().get_context_data(*args, **kwargs)
+        result.update(self.get_detail_context(result["object"]))
+        return result
+
+
+class FlowCellTabView(
+    LoginRequiredMixin,
+    LoggedInPermissionMixin,
+    ProjectPermissionMixin,
+    ProjectContextMixin,
+    DetailView,
+):
+    """Render one of the tabs of the FlowCell detail page, loaded when the tab is opened.
+
+    Each tab loads its objects with a fixed number of queries.  The sample sheet and index statistics tabs
+    look the same for all users and are cached, see ``get_cache_stamps()``.
+    """
+
+    permission_required = "flowcells.view_flowcell"
+
+    model = FlowCell
+
+    slug_url_kwarg = "flowcell"
+    slug_field = "sodar_uuid"
+
+    #: Templates of the tabs.
+    tab_templates = {
+        "sample-sheet": "flowcells/_flowcell_samplesheet.html",
+        "index-stats": "flowcells/_flowcell_index_stats.html",
+        "messages": "flowcells/_flowcell_messages.html",
+    }
+
+    #: Related objects to load for the tabs.
+    tab_prefetch_lookups = {
+        "sample-sheet": (
+            Prefetch(
+                "libraries",
+                queryset=Library.objects.select_related(
+                    "barcode__barcode_set", "barcode2__barcode_set"
+                ),
+            ),
+        ),
+        "index-stats": ("index_histograms",),
+    }
+
+    def get_template_names(self):
+        return [self.tab_templates[self.kwargs["tab"]]]
 
     def get_context_data(self, *args, **kwargs):
         result = super().get_context_data(*args, **kwargs)
         flowcell = result["object"]
-        messages = flowcell.messages.filter(author=self.request.user, state=MSG_STATE_DRAFT)
-        try:
-            instance = messages.first()
-        except Message.DoesNotExit:
-            instance = Message()
-        result["message_form"] = MessageForm(instance=instance)
-        result["csv_v1"] = self._build_v1_csv(flowcell)
-        result["csv_v2"] = self._build_v2_csv(flowcell)
-        result["flowcell_libraries"] = self._get_libraries(flowcell)
+        if self.kwargs["tab"] == "sample-sheet":
+            result["flowcell_libraries"] = flowcell.libraries.all()
+            result["has_index_histograms"] = flowcell.index_histograms.exists()
+        elif self.kwargs["tab"] == "messages":
+            result["sent_messages"] = load_sent_messages(flowcell)
+            result["message_form"] = get_message_form(flowcell, self.request.user)
         return result
 
-    def _get_libraries(self, flowcell):
-        if not hasattr(self, "_flowcell_libraries"):
-            self._flowcell_libraries = {}
-        if flowcell.sodar_uuid not in self._flowcell_libraries:
-            self._flowcell_libraries[flowcell.sodar_uuid] = list(flowcell.libraries.all())
-        return self._flowcell_libraries[flowcell.sodar_uuid]
-
-    def _build_v1_csv(self, flowcell):
-        rows = [
-            [
-                "FCID",
-                "Lane",
-                "SampleID",
-                "SampleRef",
-                "Index",
-                "Description",
-                "Control",
-                "Recipe",
-                "Operator",
-                "SampleProject",
-            ]
-        ]
-        recipe = "PE_Indexing" if flowcell.is_paired else "SE_indexing"
-        for lib in self._get_libraries(flowcell):
-            if lib.get_barcode_seq2():
-                barcode = "{}-{}".format(lib.get_barcode_seq(), lib.get_barcode_seq2())
-            else:
-                barcode = lib.get_barcode_seq()
-            for lane_no in sorted(lib.lane_numbers):
-                rows.append(
-                    [
-                        flowcell.vendor_id,
-                        lane_no,
-                        lib.name,
-                        lib.reference,
-                        barcode,
-                        "",
-                        "N",  # not PhiX
-                        recipe,
-                        flowcell.operator,
-                        "Project",
-                    ]
-                )
-        return "\n".join("\t".join(map(str, row)) for row in rows)
-
-    def _build_v2_csv(self, flowcell):
-        date = flowcell.run_date.strftime("%y/%m/%d")
-        rows = [
-            ["[Header]"],
-            ["IEMFileVersion", "4"],
-            ["Investigator Name", flowcell.operator],
-            ["Experiment Name", "Project"],
-            ["Date", date],
-            ["Workflow", "GenerateFASTQ"],
-            ["Applications", "FASTQ Only"],
-            ["Assay", "TruSeq HT"],
-            ["Description", ""],
-            [],
-            ["[Reads]"],
-        ]
-        for tup in flowcell.get_planned_reads_tuples():
-            if tup[1] == "T":
-                rows.append([str(tup[0])])
-        rows += [
-            [],
-            ["[Data]"],
-            [
-                "Lane",
-                "Sample_ID",
-                "Sample_Name",
-                "Sample_Plate",
-                "Sample_Well",
-                "i7_Index_ID",
-                "index",
-                "Sample_Project",
-                "Description",
-            ],
-        ]
-        for lib in self._get_libraries(flowcell):
-            for lane_no in sorted(lib.lane_numbers):
-                rows.append(
-                    [
-                        lane_no,
-                        lib.name,
-                        "",
-                        "",
-                        "",
-                        lib.barcode.name if lib.barcode else "",
-                        lib.barcode.sequence if lib.barcode else "",
-                        "Project",
-                        "",
-                    ]
-                )
-        return "\n".join(",".join(map(str, row)) for row in rows) + "\n"  # noqa
+    def get_cache_stamps(self, flowcell):
+        """Return tuple of values changing with the tab, ``None`` if the tab is not cached.
+
+        Besides the flow cell and its error caches, these are the token of the flow cell replaced on changes
+        of its objects (see ``rows``), and the modifications of the barcodes or the known contaminations.
+        """
+        if self.kwargs["tab"] == "messages":
+            return None  # differs per user and carries the CSRF token
+        stamps = (
+            flowcell.date_modified,
+            flowcell.error_caches_version,
+            get_row_tokens([flowcell.pk])[flowcell.pk],
+        )
+        if self.kwargs["tab"] == "sample-sheet":
+            return stamps + tuple(get_sample_sheet_stamps(flowcell))
+        return stamps + tuple(
+            KnownIndexContamination.objects.aggregate(Max("date_modified"), Count("pk")).values()
+        )
+
+    def render_tab(self):
+        prefetch_related_objects(
+            [self.object], *self.tab_prefetch_lookups.get(self.kwargs["tab"], ())
+        )
+        return self.render_to_response(self.get_context_data(object=self.object))
+
+    def get(self, request, *args, **kwargs):
+        if self.kwargs["tab"] not in self.tab_templates:
+            raise Http404("Unknown tab")
+        self.object = self.get_object()
+        stamps = self.get_cache_stamps(self.object)
+        if stamps is None:
+            return self.render_tab()
+        key = "%s:%s" % (
+            TAB_CACHE_PREFIX,
+            hashlib.sha1(
+                repr((self.kwargs["tab"], self.object.pk, stamps)).encode("utf-8")
+            ).hexdigest(),
+        )
+        content = cache.get(key)
+        if content is None:
+            content = self.render_tab().rendered_content
+            cache.set(key, content, settings.FLOWCELLS_TAB_CACHE_TIMEOUT)
+        return HttpResponse(content)
+
+
+class FlowCellSampleSheetView(
+    LoginRequiredMixin, LoggedInPermissionMixin, ProjectPermissionMixin, DetailView
+):
+    """Download the sample sheet of a FlowCell record, see ``samplesheets``"""
+
+    permission_required = "flowcells.view_flowcell"
+
+    model = FlowCell
+
+    slug_url_kwarg = "flowcell"
+    slug_field = "sodar_uuid"
+
+    def get_queryset(self):
+        return super().get_queryset().select_related("sequencing_machine")
+
+    def get(self, request, *args, **kwargs):
+        flowcell = self.get_object()
+        name = self.kwargs["sheet_format"]
+        if name not in SAMPLE_SHEET_FORMATS:
+            raise Http404("Unknown sample sheet format")
+        try:
+            lane = get_sheet_lane(flowcell, name, request.GET.get("lane"))
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        return sample_sheet_response(request, flowcell, name, lane)
 
 
 class FlowCellRecreateLibrariesMixin:
@@ -218,35 +301,12 @@ class FlowCellRecreateLibrariesMixin:
 
         This method must be called within a transaction, of course.
 
-        For now, we just recreate the library entries.
+        The libraries are matched by name, see ``libraries.upsert_libraries()``, such that the error caches
+        only have to be updated for the lanes with changed libraries.
         """
-        flowcell.libraries.all().delete()
-
-        project_barcodes = BarcodeSetEntry.objects.filter(
-            barcode_set__project=self.get_project(self.request, self.kwargs)
-        )
-        print(json.loads(form.cleaned_data["libraries_json"]))
-        for rank, info in enumerate(json.loads(form.cleaned_data["libraries_json"])):
-            if info["barcode"]:
-                barcode = project_barcodes.get(sodar_uuid=info["barcode"])
-            else:
-                barcode = None
-            if info["barcode2"]:
-                barcode2 = project_barcodes.get(sodar_uuid=info["barcode2"])
-            else:
-                barcode2 = None
-            flowcell.libraries.create(
-                rank=rank,
-                name=info["name"],
-                project_id=info["project_id"],
-                reference=info.get("reference", REFERENCE_OTHER),
-                barcode=barcode,
-                barcode_seq=info["barcode_seq"],
-                barcode2=barcode2,
-                barcode_seq2=info["barcode_seq2"],
-                lane_numbers=info["lane_numbers"],
-                demux_reads=info["demux_reads"],
-            )
+        changed_lanes = upsert_libraries(flowcell, json.loads(form.cleaned_data["libraries_json"]))
+        if changed_lanes:
+            flowcell.update_error_caches(lanes=changed_lanes).save_error_caches()
 
 
 class FlowCellCreateView(
@@ -602,6 +662,9 @@ class LibrarySuppressWarningView(
 
     def form_valid(self, form):
         super().form_valid(form)
+        self.object.flow_cell.update_error_caches(
+            lanes=self.object.lane_numbers
+        ).save_error_caches()
         return self._render_row()
 
 
@@ -718,6 +781,7 @@ class MessageAttachmentHelpersMixin:
 
 
 class MessageCreateView(
+    FlowCellDetailContextMixin,
     MessageAttachmentHelpersMixin,
     LoginRequiredMixin,
     LoggedInPermissionMixin,
@@ -735,19 +799,14 @@ class MessageCreateView(
 
     def get_context_data(self, *args, **kwargs):
         result = super().get_context_data(*args, **kwargs)
-        # Enable directly going to the messages.
-        result["message_mode"] = True
         # Get flow cell to display as the main "single" object.
         project = self.get_project(self.request, self.kwargs)
         flow_cell = project.flowcell_set.get(sodar_uuid=self.kwargs["flowcell"])
         result["object"] = flow_cell
+        # Enable directly going to the messages.
+        result.update(self.get_detail_context(flow_cell, message_mode=True))
         # Setup the model form, push draft message into it, if any.
-        messages = flow_cell.messages.filter(author=self.request.user, state=MSG_STATE_DRAFT)
-        try:
-            instance = messages.first()
-        except Message.DoesNotExit:
-            instance = Message()
-        result["message_form"] = MessageForm(instance=instance)
+        result["message_form"] = get_message_form(flow_cell, self.request.user)
         return result
 
     @transaction.atomic
@@ -1,8 +1,17 @@
 """API Views for the ``sequencers`` app."""
 
+from django.db.models import OuterRef
 from rest_framework.generics import ListCreateAPIView, RetrieveUpdateDestroyAPIView, RetrieveAPIView
+from projectroles.models import Project
 
-from digestiflow.utils import ProjectMixin, SodarObjectInProjectPermissions
+from digestiflow.utils import (
+    ConditionalGetMixin,
+    ProjectMixin,
+    SodarObjectInProjectPermissions,
+    StreamingListMixin,
+    last_modified,
+    object_count,
+)
 from ..models import SequencingMachine
 from .serializers import SequencingMachineSerializer
 
@@ -18,28 +27,53 @@ class SequencingMachineApiViewMixin(ProjectMixin):
     def get_queryset(self):
         return SequencingMachine.objects.filter(project=self.get_project())
 
+    def get_modification_stamps(self):
+        """Return the latest modification of the sequencing machine."""
+        return (
+            self.get_queryset()
+            .filter(**{self.lookup_field: self.kwargs[self.lookup_url_kwarg]})
+            .values_list("date_modified")
+            .first()
+        )
 
-class SequencingMachineCreateApiView(SequencingMachineApiViewMixin, ListCreateAPIView):
+
+class SequencingMachineCreateApiView(
+    ConditionalGetMixin, StreamingListMixin, SequencingMachineApiViewMixin, ListCreateAPIView
+):
     queryset = SequencingMachine.objects.all()
     permission_classes = (SodarObjectInProjectPermissions,)
     serializer_class = SequencingMachineSerializer
     lookup_url_kwarg = "sequencer"
     lookup_field = "sodar_uuid"
 
+    def get_modification_stamps(self):
+        """Return the latest modification and number of the sequencing machines."""
+        machines = SequencingMachine.objects.filter(project=OuterRef("pk"))
+        return (
+            Project.objects.filter(pk=self.get_project().pk)
+            .order_by()
+            .values_list(last_modified(machines), object_count(machines))
+            .first()
+        )
+
 
 class SequencingMachineUpdateDestroyApiView(
-    SequencingMachineApiViewMixin, RetrieveUpdateDestroyAPIView
+    ConditionalGetMixin, SequencingMachineApiViewMixin, RetrieveUpdateDestroyAPIView
 ):
     queryset = SequencingMachine.objects.all()
     permission_classes = (SodarObjectInProjectPermissions,)
     serializer_class = SequencingMachineSerializer
     lookup_url_kwarg = "sequencer"
     lookup_field = "sodar_uuid"
+    last_modified_stamps = True
 
 
-class SequencingMachineByVendorApiView(SequencingMachineApiViewMixin, RetrieveAPIView):
+class SequencingMachineByVendorApiView(
+    ConditionalGetMixin, SequencingMachineApiViewMixin, RetrieveAPIView
+):
     queryset = SequencingMachine.objects.all()
     permission_classes = (SodarObjectInProjectPermissions,)
     serializer_class = SequencingMachineSerializer
     lookup_url_kwarg = "sequencer"
     lookup_field = "vendor_id"
+    last_modified_stamps = True
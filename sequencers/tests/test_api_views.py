@@ -1,6 +1,9 @@
 # TODO: check timeline events
 
+import datetime
 import json
+
+from django.db.models import F
 from test_plus.test import APITestCase
 
 from digestiflow.test_utils import SetupUserMixin, SetupProjectMixin, AuthenticatedRequestMixin
@@ -26,6 +29,28 @@ class SequencingMachineListCreateApiViewTest(
         data = json.loads(response.content.decode("utf-8"))
         self.assertEqual(len(data), 1)
 
+    def testGetNotModified(self):
+        """Test that a request with the current ETag is answered with 304"""
+        response = self.runGet(self.root)
+        self.response_200(response)
+        response = self.runGet(self.root, extra={"HTTP_IF_NONE_MATCH": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def testGetModified(self):
+        """Test that the ETag changes with the deletion of machines"""
+        etag = self.runGet(self.root)["ETag"]
+        self.hiseq2000.delete()
+        response = self.runGet(self.root, extra={"HTTP_IF_NONE_MATCH": etag})
+        self.response_200(response)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def testGetStream(self):
+        """Test that the streamed list is the regular list"""
+        expected = self.runGet(self.root).content
+        response = self.runGet(self.root, data={"stream": "1"})
+        self.response_200(response)
+        self.assertEqual(b"".join(response.streaming_content), expected)
+
     def testGetAccessDenied(self):
         """Test that access is denied if role assignment is missing"""
         self.runGet(None)
@@ -85,6 +110,29 @@ class SequencingMachineUpdateApiViewTest(
         data = json.loads(response.content.decode("utf-8"))
         self.assertEqual(data["sodar_uuid"], str(self.hiseq2000.sodar_uuid))
 
+    def testGetIfModifiedSince(self):
+        """Test that ``If-Modified-Since`` is answered based on the last modification of the machine"""
+        SequencingMachine.objects.update(
+            date_modified=F("date_modified") - datetime.timedelta(hours=1)
+        )
+        response = self.runGet(self.root, sequencer=self.hiseq2000.sodar_uuid)
+        self.response_200(response)
+        last_modified = response["Last-Modified"]
+        response = self.runGet(
+            self.root,
+            sequencer=self.hiseq2000.sodar_uuid,
+            extra={"HTTP_IF_MODIFIED_SINCE": last_modified},
+        )
+        self.assertEqual(response.status_code, 304)
+        self.hiseq2000.label = "changed"
+        self.hiseq2000.save()
+        response = self.runGet(
+            self.root,
+            sequencer=self.hiseq2000.sodar_uuid,
+            extra={"HTTP_IF_MODIFIED_SINCE": last_modified},
+        )
+        self.response_200(response)
+
     def testGetAccessDenied(self):
         """Test that access is denied if role assignment is missing"""
         self.runGet(None, sequencer=self.hiseq2000.sodar_uuid)